@@ -1,49 +1,166 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, make_response
-from database import create_tables
+from markupsafe import Markup
+from flask import Flask, render_template, stream_template, request, redirect, url_for, jsonify, make_response, Response, stream_with_context
+from flask import before_render_template, template_rendered, g
+import metrics
+import views
+from compression import GzipMiddleware
+from events import SSE_RETRY_AFTER, event_stream, stream_slots
+from etags import make_etag, with_etag, not_modified
+from db import create_tables, get_pool_stats, start_change_listener
+from compaction import start_compaction_thread
+from commands import compact_items_command, export_list_command, import_list_command
+from suggest import refresh_in_background
+from profiling import profiler
+from idempotency import FORM_MIMETYPE, HASHED_MIMETYPES, KEY_HEADER, encode_form, idempotency_store
+from transfer import FORMATS, export_list
+from views import FIRST_PAINT_ITEMS, ITEMS_PAGE_SIZE, fragment_cache, page_cache
 from models.item import Item
 from models.category import Category
 from models.shopping_list import ShoppingList
+from models.list_snapshot import ListSnapshot
+from models.change_log import ChangeLog
+
+# Create missing tables and apply pending schema migrations on startup
+create_tables()
 
 app = Flask(__name__)
+# Text responses are gzipped for clients that accept it; see compression.py
+app.wsgi_app = GzipMiddleware(app.wsgi_app)
+
+# --- Request metrics ---
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    stats = metrics.finish_request(request.method, request.url_rule and request.url_rule.rule, response.status_code)
+    if stats is not None and (app.debug or metrics.QUERY_COUNT_HEADER):
+        # Makes N+1 query patterns visible from the browser's network panel
+        response.headers['X-Query-Count'] = str(stats.queries)
+    return response
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    # Requests whose exception propagated never reached after_request
+    metrics.finish_request(request.method, request.url_rule and request.url_rule.rule, 500)
+    metrics.end_request()
+
+before_render_template.connect(metrics.template_started, app)
+template_rendered.connect(metrics.template_finished, app)
+
+# --- Profiling (armed through /admin/profile) ---
+@app.before_request
+def start_profiling():
+    if not profiler.enabled:
+        return
+    profiler.poll()
+    if not request.path.startswith('/admin/'):
+        g.profile_session = profiler.start(request.url_rule and request.url_rule.rule, request.path)
+
+@app.teardown_request
+def finish_profiling(error=None):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        profiler.finish(session)
+
+@app.before_request
+def start_background_jobs():
+    # Started lazily so every forked worker gets its own thread
+    start_compaction_thread()
+    # Load name suggestions before the first keystroke needs them
+    refresh_in_background()
+
+# --- Idempotency keys ---
+@app.before_request
+def check_idempotency_key():
+    key = request.headers.get(KEY_HEADER)
+    if key is None or not views.is_mutating(request.method, request.endpoint):
+        return
+    # Streamed uploads (e.g. imports) are identified by their URL only, so their body isn't read here
+    if request.mimetype == FORM_MIMETYPE:
+        body = encode_form(request.form.items(multi=True))
+    else:
+        body = request.get_data() if request.mimetype in HASHED_MIMETYPES else b''
+    claim, response = views.claim_idempotency_key(key, request.method, request.full_path, body, Response)
+    if response is not None:
+        return response
+    g.idempotency_key = claim
+
+@app.after_request
+def store_idempotent_response(response):
+    claimed = g.get('idempotency_key')
+    if claimed is not None:
+        body = None if response.is_streamed else response.get_data()
+        idempotency_store.finish(*claimed, response.status_code, list(response.headers.items()), body)
+        # Stored; a failure above leaves the key for teardown to release
+        g.pop('idempotency_key')
+    return response
+
+@app.teardown_request
+def release_idempotency_key(error=None):
+    # Requests whose exception propagated never stored a response; a retry may run again
+    claimed = g.pop('idempotency_key', None)
+    if claimed is not None:
+        idempotency_store.release(claimed[0])
 
 # --- Helper ---
-def get_active_list_id():
-    return request.cookies.get('active_list_id', '1') # Default to list 1
+def render_category(category):
+    key = views.fragment_key(category)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(render_template('partials/_category.html', category=category))
+        fragment_cache.set(key, html)
+    return html
+
+def render_categories(grouped_items):
+    # Lazy, so a streamed page renders each category as soon as it has been read
+    return (render_category(category) for category in grouped_items)
+
+def stream_index(snapshot):
+    """The index page, rendered piece by piece as it is sent; once sent, it is cached unless too long."""
+    recorder = views.PageRecorder(snapshot)
+    for piece in stream_template('index.html', **views.index_context(snapshot, render_categories(snapshot.grouped_items))):
+        yield recorder.add(piece)
+    recorder.finish()
 
 # --- Main Routes ---
 @app.route('/')
 def index():
-    active_list_id = get_active_list_id()
-    all_lists = ShoppingList.get_all()
-    
-    if not all_lists:
-        # Create a default list if the database is completely empty
-        default_list = ShoppingList("Main List")
-        default_list.save()
-        all_lists = [default_list]
-
     active_list_id = request.cookies.get('active_list_id')
-    if not active_list_id or not any(l.id == int(active_list_id) for l in all_lists):
-        active_list_id = all_lists[0].id
+    collapsed = views.get_collapsed_categories(request.cookies)
+    revision = ListSnapshot.get_revision(active_list_id) if active_list_id else None
+    cached = None
+    if revision is not None:
+        # Answer unchanged re-polls before touching the cache or the template
+        response = not_modified(views.index_etag(int(active_list_id), revision, collapsed), request, Response)
+        if response is not None:
+            response.vary.add('Cookie')
+            return response
+        cached = page_cache.get((int(active_list_id), revision, collapsed))
 
-    categories = Category.get_all_for_list(active_list_id)
-    items = Item.get_all_for_list(active_list_id)
-    
-    grouped_items = {cat.id: {'id': cat.id, 'name': cat.name, 'items': []} for cat in categories}
-
-    for item in items:
-        category_id = item['category_id']
-        if category_id in grouped_items:
-            grouped_items[category_id]['items'].append(item)
-
-    response = make_response(render_template(
-        'index.html', 
-        grouped_items=list(grouped_items.values()), 
-        categories=categories,
-        all_lists=all_lists,
-        active_list_id=int(active_list_id)
-    ))
-    response.set_cookie('active_list_id', str(active_list_id))
+    if cached is None:
+        snapshot = ListSnapshot.stream(active_list_id, ITEMS_PAGE_SIZE, FIRST_PAINT_ITEMS, collapsed=collapsed)
+
+        if not snapshot.lists:
+            # Create a default list if the database is completely empty
+            default_list = ShoppingList("Main List")
+            default_list.save()
+            snapshot = ListSnapshot.stream(default_list.id, ITEMS_PAGE_SIZE, FIRST_PAINT_ITEMS, collapsed=collapsed)
+
+        # The head and the first categories go out while later ones are still being read
+        body = stream_with_context(stream_index(snapshot))
+        # Recorded once the page has been sent, so its rendering and queries count
+        response = Response(metrics.stream_request(body, request.method, request.url_rule.rule), mimetype='text/html')
+        # Hands back the database connection of a page the client stopped reading
+        response.call_on_close(snapshot.close)
+    else:
+        snapshot, html = cached
+        response = make_response(html)
+
+    response = with_etag(response, views.index_etag(snapshot.active_list_id, snapshot.revision, snapshot.collapsed))
+    response.vary.add('Cookie')
+    response.set_cookie('active_list_id', str(snapshot.active_list_id))
     return response
 
 @app.route('/set_active_list/<int:list_id>')
@@ -55,28 +172,22 @@ def set_active_list(list_id):
 # --- Shopping List Endpoints ---
 @app.route('/list/<int:list_id>')
 def get_list(list_id):
+    etag = make_etag('list', list_id, ListSnapshot.get_revision(list_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
     shopping_list = ShoppingList.get_by_id(list_id)
     if shopping_list:
-        return jsonify({'id': shopping_list.id, 'name': shopping_list.name})
+        return with_etag(jsonify({'id': shopping_list.id, 'name': shopping_list.name}), etag)
     return jsonify({'error': 'List not found'}), 404
 
 @app.route('/update_list/<int:list_id>', methods=['POST'])
 def update_list(list_id):
-    new_name = request.json.get('name')
-    if new_name:
-        ShoppingList.update_name(list_id, new_name)
-        return jsonify(success=True)
-    return jsonify(success=False, error="New name is required"), 400
+    return views.rename(ShoppingList.update_name, list_id, request.json)
 
 @app.route('/add_list', methods=['POST'])
 def add_list():
-    list_name = request.form.get('list_name')
-    if list_name:
-        new_list = ShoppingList(name=list_name)
-        new_list.save()
-        # Create a default "Other" category for the new list
-        other = Category(name="Other", list_id=new_list.id)
-        other.save()
+    views.add_list(request.form.get('list_name'))
     return redirect(url_for('index'))
 
 @app.route('/delete_list/<int:list_id>', methods=['POST'])
@@ -88,32 +199,57 @@ def delete_list(list_id):
 @app.route('/add_category', methods=['POST'])
 def add_category():
     name = request.form.get('category_name')
-    active_list_id = get_active_list_id()
+    active_list_id = views.get_active_list_id(request.cookies)
     if name and active_list_id:
         Category(name=name, list_id=active_list_id).save()
     return redirect(url_for('index'))
 
 @app.route('/update_category_order', methods=['POST'])
 def update_category_order():
-    category_ids = request.json.get('category_ids', [])
-    if category_ids:
-        Category.update_order(category_ids)
-    return jsonify(success=True)
+    return views.reorder_categories(request.json)
 
 @app.route('/category/<int:category_id>')
 def get_category(category_id):
+    etag = make_etag('category', category_id, ListSnapshot.get_revision(category_id=category_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
     category = Category.get_by_id(category_id)
     if category:
-        return jsonify({'id': category.id, 'name': category.name})
+        return with_etag(jsonify({'id': category.id, 'name': category.name}), etag)
     return jsonify({'error': 'Category not found'}), 404
 
+@app.route('/category/<int:category_id>/fragment')
+def get_category_fragment(category_id):
+    # The category's markup with its items, for the client to swap in without a page load
+    etag = make_etag('category-html', category_id, ListSnapshot.get_category_revision(category_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    category = ListSnapshot.load_category(category_id, ITEMS_PAGE_SIZE)
+    if category is None:
+        return jsonify({'error': 'Category not found'}), 404
+    return with_etag(make_response(render_category(category)), make_etag('category-html', category_id, category['revision']))
+
+@app.route('/category/<int:category_id>/items')
+def get_category_items(category_id):
+    # The next page of a category's items as markup, for lazy loading and infinite scroll
+    try:
+        after, limit = views.page_args(request.args, 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = make_etag('category-items', category_id, ListSnapshot.get_category_revision(category_id))
+    if etag is None:
+        return jsonify({'error': 'Category not found'}), 404
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    items, next_cursor = Item.get_page(category_id, after, limit)
+    return with_etag(make_response(render_template('partials/_item_page.html', items=items, next_cursor=next_cursor)), etag)
+
 @app.route('/update_category/<int:category_id>', methods=['POST'])
 def update_category(category_id):
-    new_name = request.json.get('name')
-    if new_name:
-        Category.update(category_id, new_name)
-        return jsonify(success=True)
-    return jsonify(success=False, error="New name is required"), 400
+    return views.rename(Category.update, category_id, request.json)
 
 @app.route('/delete_category/<int:category_id>', methods=['POST'])
 def delete_category(category_id):
@@ -123,51 +259,31 @@ def delete_category(category_id):
 # --- Item Endpoints ---
 @app.route('/add', methods=['POST'])
 def add_item():
-    active_list_id = get_active_list_id()
-    category_id = request.form.get('category_id')
-    if not category_id:
-        # Find the Other category for the active list
-        conn = get_db_connection()
-        other = conn.execute('SELECT id FROM categories WHERE name = "Other" AND list_id = ?', (active_list_id,)).fetchone()
-        conn.close()
-        category_id = other['id'] if other else None
-
-    item = Item(
-        name=request.form.get('name'),
-        quantity=int(request.form.get('quantity', 1)),
-        notes=request.form.get('notes'),
-        who_needs_it=request.form.get('who_needs_it'),
-        who_will_buy_it=request.form.get('who_will_buy_it'),
-        category_id=category_id
-    )
-    item.save()
+    item = views.add_item(request.form, views.get_active_list_id(request.cookies))
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True, id=item.id)
     return redirect(url_for('index'))
 
 @app.route('/item/<int:item_id>')
 def get_item(item_id):
+    etag = make_etag('item', item_id, ListSnapshot.get_revision(item_id=item_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
     item = Item.get_by_id(item_id)
     if item:
-        return jsonify({
-            'id': item.id, 'name': item.name, 'quantity': item.quantity,
-            'notes': item.notes, 'who_needs_it': item.who_needs_it,
-            'who_will_buy_it': item.who_will_buy_it, 'category_id': item.category_id,
-            'is_completed': item.is_completed
-        })
+        return with_etag(jsonify(views.item_json(item)), etag)
     return jsonify({'error': 'Item not found'}), 404
 
 @app.route('/update_item/<int:item_id>', methods=['POST'])
 def update_item(item_id):
-    data = request.json
-    Item.update(
-        item_id, data.get('name'), data.get('quantity'), data.get('notes'),
-        data.get('who_needs_it'), data.get('who_will_buy_it'), data.get('category_id'),
-        data.get('is_completed')
-    )
-    return jsonify(success=True)
+    return views.update_item(item_id, request.json)
     
 @app.route('/delete/<int:item_id>')
 def delete_item(item_id):
     Item.delete(item_id)
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True)
     return redirect(url_for('index'))
 
 @app.route('/update_item_name/<int:item_id>', methods=['POST'])
@@ -184,20 +300,113 @@ def toggle_completed(item_id):
 
 @app.route('/clear_completed', methods=['POST'])
 def clear_completed():
-    active_list_id = get_active_list_id()
-    Item.clear_completed(active_list_id)
+    Item.clear_completed(views.get_active_list_id(request.cookies))
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True)
     return redirect(url_for('index'))
 
 @app.route('/update_item_and_order', methods=['POST'])
 def update_item_and_order():
-    data = request.json
-    Item.update_order_and_category(
-        data.get('item_id'),
-        data.get('new_category_id'),
-        data.get('sibling_ids', [])
-    )
-    return jsonify(success=True)
+    return views.move_item(request.json)
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    return views.apply_batch(request.get_json(silent=True))
+
+@app.route('/api/lists/<int:list_id>/items')
+def list_items(list_id):
+    # The list's items page by page, in the order the index page shows them
+    try:
+        after, limit = views.page_args(request.args, 4)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if ListSnapshot.get_revision(list_id=list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    return views.list_items(list_id, after, limit)
+
+# --- Sync Endpoints ---
+@app.route('/api/lists/<int:list_id>/changes')
+def list_changes(list_id):
+    since = request.args.get('since', 0, type=int)
+    delta = ChangeLog.get_since(list_id, since)
+    if delta is None:
+        return jsonify({'error': 'List not found'}), 404
+    # Send ready-made markup so the client patches the DOM without its own templates
+    for item in delta['items']:
+        item['html'] = render_template('partials/_item.html', item=item)
+    for category in delta['categories']:
+        category['html'] = render_template('partials/_category.html', category=dict(category, items=[]))
+    return jsonify(delta)
+
+@app.route('/api/lists/<int:list_id>/events')
+def list_events(list_id):
+    if ListSnapshot.get_revision(list_id=list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    start_change_listener()
+    # A reconnecting EventSource resumes from the last revision it saw
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    # Each stream holds one of the worker's threads until the page closes, so
+    # past the cap pages poll /changes instead (app_asgi.py has no such limit)
+    if not stream_slots.acquire():
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': str(SSE_RETRY_AFTER)}
+    stream = event_stream(list_id, since, lambda: ListSnapshot.get_revision(list_id=list_id))
+    response = Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # keep proxies like nginx from buffering the stream
+    })
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/api/search')
+def search():
+    return views.search(request.args)
+
+@app.route('/api/suggest')
+def suggest():
+    return views.suggest(request.args)
+
+# --- Import / Export ---
+@app.route('/api/lists/<int:list_id>/export')
+def export_items(list_id):
+    if not ShoppingList.get_by_id(list_id):
+        return jsonify({'error': 'List not found'}), 404
+    try:
+        fmt = views.export_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Generated batch by batch while it is sent, so large lists are never held in memory
+    return Response(export_list(list_id, fmt), mimetype=FORMATS[fmt], headers=views.export_headers(list_id, fmt))
+
+@app.route('/api/lists/<int:list_id>/import', methods=['POST'])
+def import_items(list_id):
+    if not ShoppingList.get_by_id(list_id):
+        return jsonify({'error': 'List not found'}), 404
+    try:
+        fmt = views.import_format(request.args, request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The request body is the raw file, read as it arrives
+    return views.import_items(list_id, request.stream, fmt)
+
+# --- Diagnostics ---
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    return views.admin_profile(request.method, request.headers.get('Authorization'), request.get_json(silent=True) or request.form)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/stats')
+def admin_stats():
+    return views.admin_stats(request.headers.get('Authorization'), pool=get_pool_stats(), event_streams=stream_slots.stats())
+
+# --- CLI ---
+app.cli.add_command(compact_items_command)
+app.cli.add_command(export_list_command)
+app.cli.add_command(import_list_command)
 
 if __name__ == '__main__':
-    create_tables()
     app.run(debug=True)
@@ -0,0 +1,463 @@
+import asyncio
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# The async pool and LISTEN task below are Postgres-only
+os.environ.setdefault('DATABASE_BACKEND', 'postgres')
+
+from markupsafe import Markup
+from quart import Quart, render_template, stream_template, stream_with_context, request, redirect, url_for, jsonify, make_response, Response, g
+from quart.signals import before_render_template, template_rendered
+from quart.utils import run_sync
+from quart.wrappers.response import DataBody
+import metrics
+import views
+import database_async
+from db import create_tables, get_pool_stats
+from database_pg import POOL_MAX_SIZE
+from compression import AsyncGzipMiddleware
+from compaction import start_compaction_thread
+from commands import compact_items_command, export_list_command, import_list_command
+from suggest import refresh_in_background
+from profiling import profiler
+from transfer import FORMATS, export_list
+from events import async_event_stream
+from etags import make_etag, with_etag, not_modified
+from idempotency import FORM_MIMETYPE, HASHED_MIMETYPES, KEY_HEADER, encode_form, idempotency_store
+from views import FIRST_PAINT_ITEMS, ITEMS_PAGE_SIZE, fragment_cache, page_cache
+from models.item import Item
+from models.category import Category
+from models.shopping_list import ShoppingList
+from models.list_snapshot import ListSnapshot
+from models.change_log import ChangeLog
+
+# ASGI twin of app.py with the same routes, run with e.g.
+#   hypercorn app_asgi:app --worker-class uvloop
+# The request handling both apps share lives in views.py; this module keeps
+# the async glue.
+#
+# Only the reads that every open page repeats (revision checks, 304s, event
+# streams) are async, on database_async's pool. Every other read and write
+# calls the shared, blocking models on a worker thread, through database_pg's
+# psycopg2 pool, so the data-access code lives in one place. A process
+# therefore runs at most ASGI_THREADS model calls at once, like a threaded
+# WSGI worker would; what this app adds is that idle event streams and 304s
+# cost a coroutine rather than a thread. Each process opens up to twice
+# DB_POOL_MAX_SIZE connections (both pools) plus one for LISTEN.
+
+# Worker threads for model calls. Threads beyond the sync pool's size would
+# only sit waiting for a connection, so by default there are as many as it has.
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', POOL_MAX_SIZE))
+
+create_tables()
+
+app = Quart(__name__)
+app.asgi_app = AsyncGzipMiddleware(app.asgi_app)
+
+
+@app.before_serving
+async def startup():
+    # run_sync() runs model calls on the loop's default executor
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix='asgi-models'))
+    await database_async.open_pool()
+    app.listener_task = asyncio.create_task(database_async.listen_for_changes())
+    start_compaction_thread()
+    refresh_in_background()
+
+
+@app.after_serving
+async def shutdown():
+    app.listener_task.cancel()
+    await database_async.close_pool()
+
+
+# --- Request metrics ---
+@app.before_request
+async def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+async def record_request_metrics(response):
+    stats = metrics.finish_request(request.method, request.url_rule and request.url_rule.rule, response.status_code)
+    if stats is not None and (app.debug or metrics.QUERY_COUNT_HEADER):
+        response.headers['X-Query-Count'] = str(stats.queries)
+    return response
+
+@app.teardown_request
+async def end_request_metrics(error=None):
+    metrics.finish_request(request.method, request.url_rule and request.url_rule.rule, 500)
+    metrics.end_request()
+
+# Quart sends its signals asynchronously; async receivers avoid a hop to a thread
+async def template_started(sender, **extra):
+    metrics.template_started()
+
+async def template_finished(sender, **extra):
+    metrics.template_finished()
+
+before_render_template.connect(template_started, app)
+template_rendered.connect(template_finished, app)
+
+
+# --- Profiling (armed through /admin/profile) ---
+# Sessions profile the event loop's thread, so a profile also shows whatever
+# other requests ran on the loop meanwhile, and none of the worker threads.
+@app.before_request
+async def start_profiling():
+    if not profiler.enabled:
+        return
+    profiler.poll()
+    if not request.path.startswith('/admin/'):
+        g.profile_session = profiler.start(request.url_rule and request.url_rule.rule, request.path)
+
+@app.teardown_request
+async def finish_profiling(error=None):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        profiler.finish(session)
+
+
+# --- Idempotency keys ---
+@app.before_request
+async def check_idempotency_key():
+    key = request.headers.get(KEY_HEADER)
+    if key is None or not views.is_mutating(request.method, request.endpoint):
+        return
+    if request.mimetype == FORM_MIMETYPE:
+        body = encode_form((await request.form).items(multi=True))
+    else:
+        body = await request.get_data() if request.mimetype in HASHED_MIMETYPES else b''
+    claim, response = await run_sync(views.claim_idempotency_key)(key, request.method, request.full_path, body, Response)
+    if response is not None:
+        return response
+    g.idempotency_key = claim
+
+@app.after_request
+async def store_idempotent_response(response):
+    claimed = g.get('idempotency_key')
+    if claimed is not None:
+        body = await response.get_data() if isinstance(response.response, DataBody) else None
+        await run_sync(idempotency_store.finish)(*claimed, response.status_code, list(response.headers.items()), body)
+        # Stored; a failure above leaves the key for teardown to release
+        g.pop('idempotency_key')
+    return response
+
+@app.teardown_request
+async def release_idempotency_key(error=None):
+    claimed = g.pop('idempotency_key', None)
+    if claimed is not None:
+        await run_sync(idempotency_store.release)(claimed[0])
+
+
+# --- Helper ---
+async def get_revision(list_id=None, category_id=None, item_id=None):
+    return await database_async.fetch_value(*ListSnapshot.revision_query(list_id, category_id, item_id))
+
+async def get_category_revision(category_id):
+    return await database_async.fetch_value(ListSnapshot.CATEGORY_REVISION_QUERY, (category_id,))
+
+async def render_category(category):
+    key = views.fragment_key(category)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(await render_template('partials/_category.html', category=category))
+        fragment_cache.set(key, html)
+    return html
+
+async def render_categories(grouped_items):
+    # Each category is read on a worker thread and rendered as soon as it arrives
+    async for category in iterate_in_thread(grouped_items):
+        yield await render_category(category)
+
+async def stream_index(snapshot):
+    """The index page, rendered piece by piece as it is sent; once sent, it is cached unless too long."""
+    recorder = views.PageRecorder(snapshot)
+    async for piece in await stream_template('index.html', **views.index_context(snapshot, render_categories(snapshot.grouped_items))):
+        yield recorder.add(piece)
+    recorder.finish()
+
+async def iterate_in_thread(iterator):
+    """Drives a blocking iterator from worker threads, one item per step."""
+    done = object()
+    while (item := await run_sync(next)(iterator, done)) is not done:
+        yield item
+
+# --- Main Routes ---
+@app.route('/')
+async def index():
+    active_list_id = request.cookies.get('active_list_id')
+    collapsed = views.get_collapsed_categories(request.cookies)
+    revision = await get_revision(active_list_id) if active_list_id else None
+    cached = None
+    if revision is not None:
+        response = not_modified(views.index_etag(int(active_list_id), revision, collapsed), request, Response)
+        if response is not None:
+            response.vary.add('Cookie')
+            return response
+        cached = page_cache.get((int(active_list_id), revision, collapsed))
+
+    if cached is None:
+        snapshot = await run_sync(ListSnapshot.stream)(active_list_id, ITEMS_PAGE_SIZE, FIRST_PAINT_ITEMS, collapsed=collapsed)
+
+        if not snapshot.lists:
+            default_list = ShoppingList("Main List")
+            await run_sync(default_list.save)()
+            snapshot = await run_sync(ListSnapshot.stream)(default_list.id, ITEMS_PAGE_SIZE, FIRST_PAINT_ITEMS, collapsed=collapsed)
+
+        body = metrics.stream_request(stream_with_context(stream_index)(snapshot), request.method, request.url_rule.rule)
+        response = Response(body, 200, {'Content-Type': 'text/html; charset=utf-8'})
+        response.timeout = None
+    else:
+        snapshot, html = cached
+        response = await make_response(html)
+
+    response = with_etag(response, views.index_etag(snapshot.active_list_id, snapshot.revision, snapshot.collapsed))
+    response.vary.add('Cookie')
+    response.set_cookie('active_list_id', str(snapshot.active_list_id))
+    return response
+
+@app.route('/set_active_list/<int:list_id>')
+async def set_active_list(list_id):
+    response = await make_response(redirect(url_for('index')))
+    response.set_cookie('active_list_id', str(list_id))
+    return response
+
+# --- Shopping List Endpoints ---
+@app.route('/list/<int:list_id>')
+async def get_list(list_id):
+    etag = make_etag('list', list_id, await get_revision(list_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    shopping_list = await run_sync(ShoppingList.get_by_id)(list_id)
+    if shopping_list:
+        return with_etag(jsonify({'id': shopping_list.id, 'name': shopping_list.name}), etag)
+    return jsonify({'error': 'List not found'}), 404
+
+@app.route('/update_list/<int:list_id>', methods=['POST'])
+async def update_list(list_id):
+    return await run_sync(views.rename)(ShoppingList.update_name, list_id, await request.get_json())
+
+@app.route('/add_list', methods=['POST'])
+async def add_list():
+    await run_sync(views.add_list)((await request.form).get('list_name'))
+    return redirect(url_for('index'))
+
+@app.route('/delete_list/<int:list_id>', methods=['POST'])
+async def delete_list(list_id):
+    await run_sync(ShoppingList.delete)(list_id)
+    return redirect(url_for('index'))
+
+# --- Category Endpoints ---
+@app.route('/add_category', methods=['POST'])
+async def add_category():
+    name = (await request.form).get('category_name')
+    active_list_id = views.get_active_list_id(request.cookies)
+    if name and active_list_id:
+        await run_sync(Category(name=name, list_id=active_list_id).save)()
+    return redirect(url_for('index'))
+
+@app.route('/update_category_order', methods=['POST'])
+async def update_category_order():
+    return await run_sync(views.reorder_categories)(await request.get_json())
+
+@app.route('/category/<int:category_id>')
+async def get_category(category_id):
+    etag = make_etag('category', category_id, await get_revision(category_id=category_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    category = await run_sync(Category.get_by_id)(category_id)
+    if category:
+        return with_etag(jsonify({'id': category.id, 'name': category.name}), etag)
+    return jsonify({'error': 'Category not found'}), 404
+
+@app.route('/category/<int:category_id>/fragment')
+async def get_category_fragment(category_id):
+    etag = make_etag('category-html', category_id, await get_category_revision(category_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    category = await run_sync(ListSnapshot.load_category)(category_id, ITEMS_PAGE_SIZE)
+    if category is None:
+        return jsonify({'error': 'Category not found'}), 404
+    return with_etag(await make_response(await render_category(category)), make_etag('category-html', category_id, category['revision']))
+
+@app.route('/category/<int:category_id>/items')
+async def get_category_items(category_id):
+    try:
+        after, limit = views.page_args(request.args, 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = make_etag('category-items', category_id, await get_category_revision(category_id))
+    if etag is None:
+        return jsonify({'error': 'Category not found'}), 404
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    items, next_cursor = await run_sync(Item.get_page)(category_id, after, limit)
+    return with_etag(await make_response(await render_template('partials/_item_page.html', items=items, next_cursor=next_cursor)), etag)
+
+@app.route('/update_category/<int:category_id>', methods=['POST'])
+async def update_category(category_id):
+    return await run_sync(views.rename)(Category.update, category_id, await request.get_json())
+
+@app.route('/delete_category/<int:category_id>', methods=['POST'])
+async def delete_category(category_id):
+    await run_sync(Category.delete)(category_id)
+    return jsonify(success=True)
+
+# --- Item Endpoints ---
+@app.route('/add', methods=['POST'])
+async def add_item():
+    item = await run_sync(views.add_item)(await request.form, views.get_active_list_id(request.cookies))
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True, id=item.id)
+    return redirect(url_for('index'))
+
+@app.route('/item/<int:item_id>')
+async def get_item(item_id):
+    etag = make_etag('item', item_id, await get_revision(item_id=item_id))
+    response = not_modified(etag, request, Response)
+    if response is not None:
+        return response
+    item = await run_sync(Item.get_by_id)(item_id)
+    if item:
+        return with_etag(jsonify(views.item_json(item)), etag)
+    return jsonify({'error': 'Item not found'}), 404
+
+@app.route('/update_item/<int:item_id>', methods=['POST'])
+async def update_item(item_id):
+    return await run_sync(views.update_item)(item_id, await request.get_json())
+
+@app.route('/delete/<int:item_id>')
+async def delete_item(item_id):
+    await run_sync(Item.delete)(item_id)
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True)
+    return redirect(url_for('index'))
+
+@app.route('/update_item_name/<int:item_id>', methods=['POST'])
+async def update_item_name(item_id):
+    data = await request.get_json()
+    await run_sync(Item.update_name)(item_id, data.get('name'))
+    return jsonify(success=True)
+
+@app.route('/toggle_completed/<int:item_id>', methods=['POST'])
+async def toggle_completed(item_id):
+    is_completed = (await request.get_json()).get('is_completed', 0)
+    await run_sync(Item.toggle_completed)(item_id, is_completed)
+    return jsonify(success=True)
+
+@app.route('/clear_completed', methods=['POST'])
+async def clear_completed():
+    await run_sync(Item.clear_completed)(views.get_active_list_id(request.cookies))
+    if views.wants_json(request.accept_mimetypes):
+        return jsonify(success=True)
+    return redirect(url_for('index'))
+
+@app.route('/update_item_and_order', methods=['POST'])
+async def update_item_and_order():
+    return await run_sync(views.move_item)(await request.get_json())
+
+@app.route('/batch', methods=['POST'])
+async def batch():
+    return await run_sync(views.apply_batch)(await request.get_json(silent=True))
+
+@app.route('/api/lists/<int:list_id>/items')
+async def list_items(list_id):
+    try:
+        after, limit = views.page_args(request.args, 4)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if await get_revision(list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    return await run_sync(views.list_items)(list_id, after, limit)
+
+# --- Sync Endpoints ---
+@app.route('/api/lists/<int:list_id>/changes')
+async def list_changes(list_id):
+    since = request.args.get('since', 0, type=int)
+    delta = await run_sync(ChangeLog.get_since)(list_id, since)
+    if delta is None:
+        return jsonify({'error': 'List not found'}), 404
+    for item in delta['items']:
+        item['html'] = await render_template('partials/_item.html', item=item)
+    for category in delta['categories']:
+        category['html'] = await render_template('partials/_category.html', category=dict(category, items=[]))
+    return jsonify(delta)
+
+@app.route('/api/lists/<int:list_id>/events')
+async def list_events(list_id):
+    if await get_revision(list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    stream = async_event_stream(list_id, since, lambda: get_revision(list_id))
+    response = await make_response(stream, 200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # Streams stay open for as long as the page does
+    response.timeout = None
+    return response
+
+@app.route('/api/search')
+async def search():
+    return await run_sync(views.search)(request.args)
+
+@app.route('/api/suggest')
+async def suggest():
+    return views.suggest(request.args)
+
+# --- Import / Export ---
+@app.route('/api/lists/<int:list_id>/export')
+async def export_items(list_id):
+    if await get_revision(list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    try:
+        fmt = views.export_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = await make_response(iterate_in_thread(export_list(list_id, fmt)), 200, {
+        'Content-Type': FORMATS[fmt], **views.export_headers(list_id, fmt),
+    })
+    response.timeout = None
+    return response
+
+@app.route('/api/lists/<int:list_id>/import', methods=['POST'])
+async def import_items(list_id):
+    if await get_revision(list_id) is None:
+        return jsonify({'error': 'List not found'}), 404
+    try:
+        fmt = views.import_format(request.args, request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Spool the body (to disk once it is large) so the blocking parser can read it from a thread
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as body:
+        async for data in request.body:
+            body.write(data)
+        body.seek(0)
+        return await run_sync(views.import_items)(list_id, body, fmt)
+
+# --- Diagnostics ---
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+async def admin_profile():
+    data = await request.get_json(silent=True) or await request.form
+    return await run_sync(views.admin_profile)(request.method, request.headers.get('Authorization'), data)
+
+@app.route('/metrics')
+async def prometheus_metrics():
+    return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/stats')
+async def admin_stats():
+    return views.admin_stats(request.headers.get('Authorization'), pool=get_pool_stats(), async_pool=database_async.get_pool_stats())
+
+# --- CLI ---
+app.cli.add_command(compact_items_command)
+app.cli.add_command(export_list_command)
+app.cli.add_command(import_list_command)
@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+
+# Shared by the benchmark scripts; import this before anything that opens the
+# database. Runs use their own SQLite file unless SQLITE_PATH or DATABASE_URL
+# says otherwise, and background jobs are kept out of the measurements.
+os.environ.setdefault('SQLITE_PATH', 'bench.db')
+os.environ.setdefault('COMPACTION_INTERVAL', '0')
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(sorted_values, fraction):
+    """The value below which `fraction` of sorted_values fall, by linear interpolation."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latency statistics in milliseconds for a list of durations in seconds."""
+    values = sorted(latencies)
+    summary = {'count': len(values), 'errors': errors}
+    if values:
+        summary.update({
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'min_ms': round(values[0] * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        })
+    if elapsed:
+        summary['ops_per_sec'] = round(len(values) / elapsed, 1)
+    return summary
+
+
+def run_metadata(args):
+    """Where and how a run was made, stored next to its numbers."""
+    import db
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(RESULTS_DIR)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'backend': db.BACKEND,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'dataset': dataset_size(),
+    }
+
+
+def dataset_size():
+    from db import get_db_connection
+    conn = get_db_connection()
+    sizes = {
+        'lists': conn.execute('SELECT COUNT(*) FROM shopping_lists').fetchone()[0],
+        'categories': conn.execute('SELECT COUNT(*) FROM categories').fetchone()[0],
+        'items': conn.execute('SELECT COUNT(*) FROM items WHERE is_deleted = FALSE').fetchone()[0],
+        'deleted_items': conn.execute('SELECT COUNT(*) FROM items WHERE is_deleted = TRUE').fetchone()[0],
+    }
+    conn.close()
+    return sizes
+
+
+def save_results(kind, args, results):
+    """Writes results as JSON to args.output, or to a timestamped file in bench/results, and returns the path."""
+    path = args.output
+    if not path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(RESULTS_DIR, f'{kind}-{stamp}.json')
+    with open(path, 'w') as f:
+        json.dump({'kind': kind, 'meta': run_metadata(args), 'results': results}, f, indent=2)
+    return path
+
+
+def print_table(results, out=sys.stdout):
+    out.write(f"{'benchmark':<28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}\n")
+    for name, summary in results.items():
+        if 'p50_ms' not in summary:
+            out.write(f"{name:<28} {summary['count']:>7} {'-':>9} {'-':>9} {'-':>9} {'-':>9}\n")
+            continue
+        out.write(
+            f"{name:<28} {summary['count']:>7} {summary['p50_ms']:>9.3f} {summary['p95_ms']:>9.3f} "
+            f"{summary['p99_ms']:>9.3f} {summary.get('ops_per_sec', 0):>9.1f}\n"
+        )
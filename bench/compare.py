@@ -0,0 +1,41 @@
+"""Compares two benchmark result files, benchmark by benchmark.
+
+    python -m bench.compare bench/results/micro-before.json bench/results/micro-after.json
+
+Negative changes in latency and positive changes in ops/s are improvements.
+"""
+import argparse
+import json
+
+
+def change(before, after):
+    if before is None or after is None or not before:
+        return '     -'
+    return f'{(after - before) / before * 100:+6.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    for label, run in (('before', before), ('after', after)):
+        meta = run['meta']
+        print(f"{label}: {run['kind']} on {meta['backend']} at {meta['commit'] or '?'} ({meta['started_at']}), dataset {meta['dataset']}")
+
+    print(f"\n{'benchmark':<28} {'p50 ms':>19} {'p95 ms':>19} {'p99 ms':>19} {'ops/s':>19}")
+    for name in [name for name in before['results'] if name in after['results']]:
+        old, new = before['results'][name], after['results'][name]
+        columns = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'ops_per_sec'):
+            columns.append(f"{new.get(key, 0):>10.2f} {change(old.get(key), new.get(key))}")
+        print(f"{name:<28} {' '.join(columns)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Appends items to one category from many threads at once and checks their orders.
+
+    python -m bench.concurrent_inserts --threads 32 --inserts 1000
+    DATABASE_URL=postgresql://localhost/bench python -m bench.concurrent_inserts --modes counter,legacy
+
+'counter' is Item.save, which takes the next order from the category's
+counter; 'legacy' is the old SELECT MAX(display_order) + INSERT pair, kept
+here for comparison. Every mode appends to a fresh category in a fresh list,
+preloaded with --preload items, so no generated data is needed. The run
+exits non-zero if the counter mode handed out a display_order twice; the
+legacy mode is expected to on Postgres. tests/test_ordering.py checks the
+same uniqueness on every test run; this script is for the throughput.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from bench.common import save_results, summarize
+from db import create_tables, get_db_connection, record_change, writes
+from ordering import ORDER_GAP
+
+
+@writes
+def legacy_save(item):
+    conn = get_db_connection()
+    max_order = conn.execute('SELECT MAX(display_order) FROM items WHERE category_id = ?', (item.category_id,)).fetchone()[0] or 0
+    item.display_order = max_order + ORDER_GAP
+    item.id = conn.execute(
+        'INSERT INTO items (name, quantity, notes, who_needs_it, who_will_buy_it, category_id, display_order) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id',
+        (item.name, item.quantity, item.notes, item.who_needs_it, item.who_will_buy_it, item.category_id, item.display_order)
+    ).fetchone()[0]
+    record_change(conn, 'item', [item.id])
+    conn.commit()
+    conn.close()
+
+
+def prepare(mode, preload):
+    """A new list with one category holding `preload` items; returns (list id, category id)."""
+    from models.category import Category
+    from models.item import Item
+    from models.shopping_list import ShoppingList
+
+    shopping_list = ShoppingList(f'concurrent inserts ({mode})')
+    shopping_list.save()
+    category = Category(name='Target', list_id=shopping_list.id)
+    category.save()
+    Item.import_rows(shopping_list.id, [('Target', f'preloaded {n}', 1, None, None, None, 0) for n in range(preload)])
+    return shopping_list.id, category.id
+
+
+def run(mode, category_id, threads, inserts):
+    from models.item import Item
+
+    save = Item.save if mode == 'counter' else legacy_save
+    latencies, errors = [], []
+    per_thread = [inserts // threads + (1 if index < inserts % threads else 0) for index in range(threads)]
+    start = threading.Barrier(threads + 1)
+
+    def worker(index, count):
+        start.wait()
+        for n in range(count):
+            item = Item(name=f'thread {index} item {n}', quantity=1, category_id=category_id)
+            begin = time.perf_counter()
+            try:
+                save(item)
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            latencies.append(time.perf_counter() - begin)
+
+    workers = [threading.Thread(target=worker, args=(index, count)) for index, count in enumerate(per_thread)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def check_orders(category_id):
+    """(rows sharing a display_order with another row, rows without one)."""
+    conn = get_db_connection()
+    duplicated = conn.execute('''
+        SELECT CAST(COALESCE(SUM(copies), 0) AS INTEGER) FROM
+            (SELECT COUNT(*) AS copies FROM items WHERE category_id = ? GROUP BY display_order HAVING COUNT(*) > 1) AS duplicates
+    ''', (category_id,)).fetchone()[0]
+    missing = conn.execute('SELECT COUNT(*) FROM items WHERE category_id = ? AND display_order IS NULL', (category_id,)).fetchone()[0]
+    conn.close()
+    return duplicated, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--inserts', type=int, default=640, help='items to append per mode, spread over the threads')
+    parser.add_argument('--preload', type=int, default=5000, help='items already in the category')
+    parser.add_argument('--modes', default='counter,legacy', help='comma-separated: counter, legacy')
+    parser.add_argument('--keep', action='store_true', help="don't delete the lists created for the run")
+    parser.add_argument('--output', help='result file (default: bench/results/concurrent_inserts-<time>.json)')
+    args = parser.parse_args()
+
+    from models.shopping_list import ShoppingList
+
+    create_tables()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - {'counter', 'legacy'}
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+    results = {}
+    failed = False
+    print(f"{'mode':<10} {'inserts':>8} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'inserts/s':>10} {'duplicated':>11}")
+    for mode in modes:
+        list_id, category_id = prepare(mode, args.preload)
+        latencies, errors, elapsed = run(mode, category_id, args.threads, args.inserts)
+        duplicated, missing = check_orders(category_id)
+        summary = summarize(latencies, elapsed, len(errors))
+        summary.update({'duplicated_orders': duplicated, 'missing_orders': missing, 'first_errors': errors[:5]})
+        results[mode] = summary
+        failed = failed or (mode == 'counter' and (duplicated > 0 or missing > 0))
+        print(
+            f"{mode:<10} {summary['count']:>8} {summary['errors']:>7} {summary.get('p50_ms', 0):>9.3f} "
+            f"{summary.get('p99_ms', 0):>9.3f} {summary.get('ops_per_sec', 0):>10.1f} {duplicated:>11}"
+        )
+        if not args.keep:
+            ShoppingList.delete(list_id)
+
+    print(f"Saved {save_results('concurrent_inserts', args, results)}")
+    if failed:
+        print("Item.save handed out a display_order twice (or not at all)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Fills the benchmark database with N lists x M categories x K items.
+
+    python -m bench.datagen --lists 20 --categories 8 --items 25 --reset
+
+The database is the same one the app would use (DATABASE_URL / DATABASE_BACKEND),
+except that SQLite defaults to bench.db. The same --seed always produces the
+same rows, so runs on different commits compare like with like.
+"""
+import argparse
+import random
+import time
+
+from bench import common  # noqa: F401  (sets up the environment first)
+from db import bulk_insert, create_tables, get_db_connection
+from ordering import ORDER_GAP
+
+PRODUCTS = [
+    'milk', 'bread', 'eggs', 'butter', 'cheese', 'yogurt', 'apples', 'bananas', 'oranges', 'grapes',
+    'tomatoes', 'potatoes', 'onions', 'garlic', 'carrots', 'lettuce', 'spinach', 'peppers', 'cucumbers',
+    'rice', 'pasta', 'flour', 'sugar', 'salt', 'coffee', 'tea', 'juice', 'water', 'chicken', 'beef',
+    'salmon', 'tuna', 'tofu', 'beans', 'lentils', 'cereal', 'oats', 'honey', 'jam', 'olive oil',
+    'vinegar', 'soap', 'shampoo', 'toothpaste', 'paper towels', 'batteries', 'sponges', 'foil',
+]
+VARIANTS = ['', '', '', 'organic', 'large', 'small', 'frozen', 'fresh', 'whole', 'low fat', 'spicy', 'family size']
+CATEGORIES = [
+    'Produce', 'Dairy', 'Bakery', 'Meat', 'Fish', 'Pantry', 'Frozen', 'Drinks', 'Snacks', 'Household',
+    'Personal care', 'Baby', 'Pets', 'Deli', 'Spices', 'Breakfast',
+]
+PEOPLE = [None, None, 'Anna', 'Ben', 'Carla', 'Dev', 'Emma']
+NOTES = [None, None, None, 'any brand', 'the cheap one', 'check the date', 'two if on offer', 'for the weekend']
+
+
+def reset(conn):
+    for table in ('changes', 'items_archive', 'items', 'categories', 'shopping_lists'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.commit()
+
+
+def generate(lists, categories, items, completed=0.3, deleted=0.1, seed=1):
+    rng = random.Random(seed)
+    conn = get_db_connection()
+    now = int(time.time())
+    totals = {'lists': 0, 'categories': 0, 'items': 0}
+    for list_number in range(lists):
+        list_id = bulk_insert(conn, 'shopping_lists', ['name'], [(f'Bench list {list_number + 1}',)])[0][0]
+        category_ids = [row[0] for row in bulk_insert(
+            conn, 'categories', ['name', 'display_order', 'list_id'],
+            [(CATEGORIES[index % len(CATEGORIES)] + (f' {index // len(CATEGORIES) + 1}' if index >= len(CATEGORIES) else ''),
+              (index + 1) * ORDER_GAP, list_id) for index in range(categories)]
+        )]
+        rows = []
+        for category_id in category_ids:
+            for position in range(items):
+                is_deleted = rng.random() < deleted
+                rows.append((
+                    ' '.join(filter(None, [rng.choice(VARIANTS), rng.choice(PRODUCTS)])),
+                    rng.randint(1, 4), rng.choice(NOTES), rng.choice(PEOPLE), rng.choice(PEOPLE),
+                    rng.random() < completed, is_deleted, now if is_deleted else None,
+                    category_id, (position + 1) * ORDER_GAP,
+                ))
+        bulk_insert(conn, 'items', [
+            'name', 'quantity', 'notes', 'who_needs_it', 'who_will_buy_it',
+            'is_completed', 'is_deleted', 'deleted_at', 'category_id', 'display_order',
+        ], rows)
+        conn.commit()
+        totals['lists'] += 1
+        totals['categories'] += len(category_ids)
+        totals['items'] += len(rows)
+    conn.close()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lists', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=8, help='categories per list')
+    parser.add_argument('--items', type=int, default=25, help='items per category')
+    parser.add_argument('--completed', type=float, default=0.3, help='fraction of items marked completed')
+    parser.add_argument('--deleted', type=float, default=0.1, help='fraction of items soft-deleted')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='delete all existing lists first')
+    args = parser.parse_args()
+
+    create_tables()
+    if args.reset:
+        conn = get_db_connection()
+        reset(conn)
+        conn.close()
+    started = time.monotonic()
+    totals = generate(args.lists, args.categories, args.items, args.completed, args.deleted, args.seed)
+    print(f"Generated {totals['lists']} lists, {totals['categories']} categories and "
+          f"{totals['items']} items in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Times the index page streamed and rendered whole, for lists of growing size.
+
+    python -m bench.index_stream --sizes 1000,10000,50000
+    python -m bench.index_stream --page-size 100000 --first-paint 100000   # everything on the first paint
+
+'stream' is GET / as served: the page goes out while the list is read
+through a server-side cursor, gzipped on the fly. 'buffered' loads the
+whole snapshot and renders the page in memory before its first byte, as
+the index did before. Each size gets a fresh list of that many items over
+--categories categories. Reported per mode: time to the first byte and to
+the last, the peak memory Python allocated while serving (from a separate
+traced request) and the bytes sent.
+"""
+import argparse
+import gzip
+import os
+import time
+import tracemalloc
+
+from bench.common import save_results, summarize
+from db import create_tables, get_db_connection
+
+
+def prepare(size, categories):
+    from models.item import Item
+    from models.shopping_list import ShoppingList
+
+    shopping_list = ShoppingList(f'index stream ({size} items)')
+    shopping_list.save()
+    Item.import_rows(shopping_list.id, [
+        (f'Category {n % categories}', f'item {n}', 1, None, None, None, 0) for n in range(size)
+    ])
+    # Planner statistics for the new rows, which autovacuum would gather in time on a live database
+    conn = get_db_connection()
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return shopping_list.id
+
+
+def serve_stream(client, list_id):
+    """(seconds to the first chunk, seconds to the last, bytes sent)."""
+    started = time.perf_counter()
+    response = client.get('/', headers={'Cookie': f'active_list_id={list_id}', 'Accept-Encoding': 'gzip'}, buffered=False)
+    first, sent = None, 0
+    for chunk in response.response:
+        if first is None:
+            first = time.perf_counter() - started
+        sent += len(chunk)
+    response.close()
+    return first, time.perf_counter() - started, sent
+
+
+def serve_buffered(app, list_id):
+    from flask import render_template
+    from app import FIRST_PAINT_ITEMS, ITEMS_PAGE_SIZE, render_categories
+    from models.list_snapshot import ListSnapshot
+
+    started = time.perf_counter()
+    with app.test_request_context('/'):
+        snapshot = ListSnapshot.load(list_id, ITEMS_PAGE_SIZE, FIRST_PAINT_ITEMS)
+        html = render_template(
+            'index.html', category_fragments=render_categories(snapshot.grouped_items), categories=snapshot.categories,
+            all_lists=snapshot.lists, active_list_id=snapshot.active_list_id, revision=snapshot.revision
+        )
+        body = gzip.compress(html.encode())
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed, len(body)
+
+
+def measure(serve, repeat, clear_caches):
+    firsts, lasts, sent = [], [], 0
+    for _ in range(repeat):
+        clear_caches()
+        first, last, sent = serve()
+        firsts.append(first)
+        lasts.append(last)
+    clear_caches()
+    tracemalloc.start()
+    serve()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'first_byte': summarize(firsts), 'last_byte': summarize(lasts),
+        'peak_kib': round(peak / 1024, 1), 'bytes_sent': sent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma-separated item counts')
+    parser.add_argument('--categories', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--page-size', type=int, help='ITEMS_PAGE_SIZE for the run')
+    parser.add_argument('--first-paint', type=int, help='FIRST_PAINT_ITEMS for the run')
+    parser.add_argument('--modes', default='stream,buffered', help='comma-separated: stream, buffered')
+    parser.add_argument('--keep', action='store_true', help="don't delete the lists created for the run")
+    parser.add_argument('--output', help='result file (default: bench/results/index_stream-<time>.json)')
+    args = parser.parse_args()
+
+    # Read by app.py when it is imported
+    if args.page_size:
+        os.environ['ITEMS_PAGE_SIZE'] = str(args.page_size)
+    if args.first_paint:
+        os.environ['FIRST_PAINT_ITEMS'] = str(args.first_paint)
+
+    from app import app, fragment_cache, page_cache
+    from models.shopping_list import ShoppingList
+
+    create_tables()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - {'stream', 'buffered'}
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+    def clear_caches():
+        page_cache.clear()
+        fragment_cache.clear()
+
+    client = app.test_client(use_cookies=False)
+    results = {}
+    print(f"{'items':>7} {'mode':<9} {'first ms':>9} {'last ms':>9} {'peak KiB':>10} {'bytes':>9}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        list_id = prepare(size, args.categories)
+        for mode in modes:
+            if mode == 'stream':
+                result = measure(lambda: serve_stream(client, list_id), args.repeat, clear_caches)
+            else:
+                result = measure(lambda: serve_buffered(app, list_id), args.repeat, clear_caches)
+            results[f'{size}/{mode}'] = result
+            print(
+                f"{size:>7} {mode:<9} {result['first_byte']['p50_ms']:>9.2f} {result['last_byte']['p50_ms']:>9.2f} "
+                f"{result['peak_kib']:>10.1f} {result['bytes_sent']:>9}"
+            )
+        if not args.keep:
+            ShoppingList.delete(list_id)
+
+    print(f"Saved {save_results('index_stream', args, results)}")
+
+
+if __name__ == '__main__':
+    main()
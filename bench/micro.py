@@ -0,0 +1,132 @@
+"""Times each model method on its own, against whichever backend is configured.
+
+    python -m bench.datagen --reset
+    python -m bench.micro --iterations 300
+    DATABASE_URL=postgresql://localhost/bench python -m bench.micro
+
+Reads run against the largest generated list; writes change it, so
+regenerate the data between runs that should be compared.
+"""
+import argparse
+import random
+import time
+
+from bench.common import print_table, save_results, summarize
+from db import create_tables, get_db_connection
+
+
+def pick_targets(rng):
+    """Ids from the list with the most items, for the benchmarks to work on."""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT c.list_id, COUNT(i.id) AS items FROM categories c
+        LEFT JOIN items i ON i.category_id = c.id AND i.is_deleted = FALSE
+        GROUP BY c.list_id ORDER BY items DESC, c.list_id LIMIT 1
+    ''').fetchone()
+    if row is None:
+        raise SystemExit("No data to benchmark; run python -m bench.datagen first")
+    list_id = row[0]
+    category_ids = [r[0] for r in conn.execute('SELECT id FROM categories WHERE list_id = ? ORDER BY display_order', (list_id,))]
+    item_rows = conn.execute('''
+        SELECT i.id, i.category_id, i.name FROM items i JOIN categories c ON c.id = i.category_id
+        WHERE c.list_id = ? AND i.is_deleted = FALSE
+    ''', (list_id,)).fetchall()
+    revision = conn.execute('SELECT revision FROM shopping_lists WHERE id = ?', (list_id,)).fetchone()[0]
+    conn.close()
+    if not item_rows:
+        raise SystemExit("The largest list has no items; run python -m bench.datagen with --items > 0")
+    return {
+        'list_id': list_id,
+        'category_ids': category_ids,
+        'items': [(r[0], r[1]) for r in item_rows],
+        'words': [r[2].split()[-1] for r in item_rows],
+        'revision': revision,
+        'rng': rng,
+    }
+
+
+def benchmarks(t):
+    """(name, callable) pairs; each callable performs one operation."""
+    from app import app, fragment_cache, render_categories
+    from flask import render_template
+    from models.category import Category
+    from models.change_log import ChangeLog
+    from models.item import Item
+    from models.list_snapshot import ListSnapshot
+    from suggest import item_names
+
+    rng = t['rng']
+    list_id = t['list_id']
+    item_ids = [item_id for item_id, category_id in t['items']]
+    snapshot = ListSnapshot.load(list_id)
+    item_names.replace(Item.name_counts(item_names.max_names))
+
+    def render_index(cached_fragments=False):
+        with app.test_request_context('/'):
+            if not cached_fragments:
+                fragment_cache.clear()
+            render_template(
+                'index.html', category_fragments=render_categories(snapshot.grouped_items), categories=snapshot.categories,
+                all_lists=snapshot.lists, active_list_id=snapshot.active_list_id, revision=snapshot.revision
+            )
+
+    def move_item():
+        item_id, category_id = rng.choice(t['items'])
+        Item.move(item_id, category_id, rng.choice(item_ids), None)
+
+    return [
+        ('ListSnapshot.load', lambda: ListSnapshot.load(list_id)),
+        ('ListSnapshot.get_revision', lambda: ListSnapshot.get_revision(list_id=list_id)),
+        ('render_index', render_index),
+        ('render_index_cached', lambda: render_index(cached_fragments=True)),
+        ('Item.get_all_for_list', lambda: Item.get_all_for_list(list_id)),
+        ('Item.get_by_id', lambda: Item.get_by_id(rng.choice(item_ids))),
+        ('Category.get_all_for_list', lambda: Category.get_all_for_list(list_id)),
+        ('ChangeLog.get_since', lambda: ChangeLog.get_since(list_id, t['revision'])),
+        ('Item.search', lambda: Item.search(rng.choice(t['words']))),
+        ('suggest', lambda: item_names.suggest(rng.choice(t['words'])[:2])),
+        ('Item.toggle_completed', lambda: Item.toggle_completed(rng.choice(item_ids), rng.random() < 0.5)),
+        ('Item.update_name', lambda: Item.update_name(rng.choice(item_ids), f'renamed {rng.choice(t["words"])}')),
+        ('Item.move', move_item),
+        ('Item.apply_batch', lambda: Item.apply_batch([
+            {'op': 'toggle', 'id': item_id, 'is_completed': rng.random() < 0.5} for item_id in rng.sample(item_ids, min(20, len(item_ids)))
+        ])),
+        ('Item.save', lambda: Item(f'bench {rng.choice(t["words"])}', 1, category_id=rng.choice(t['category_ids'])).save()),
+        ('Category.move', lambda: Category.move(rng.choice(t['category_ids']), rng.choice(t['category_ids']), None)),
+    ]
+
+
+def run(operation, iterations, warmup):
+    for _ in range(warmup):
+        operation()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', help='comma-separated benchmark names to run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result file (default: bench/results/micro-<time>.json)')
+    args = parser.parse_args()
+
+    create_tables()
+    targets = pick_targets(random.Random(args.seed))
+    selected = set(args.only.split(',')) if args.only else None
+    results = {}
+    for name, operation in benchmarks(targets):
+        if selected is None or name in selected:
+            results[name] = run(operation, args.iterations, args.warmup)
+    print_table(results)
+    print(f"Saved {save_results('micro', args, results)}")
+
+
+if __name__ == '__main__':
+    main()
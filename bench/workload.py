@@ -0,0 +1,183 @@
+"""Drives a mixed workload of page loads and edits and reports latency percentiles.
+
+    python -m bench.datagen --reset
+    python -m bench.workload --threads 8 --duration 20
+    python -m bench.workload --url http://127.0.0.1:8000 --threads 32 --duration 60
+
+Without --url the requests go through Flask's test client in this process;
+with it they go over HTTP to a running server (e.g. gunicorn) that uses the
+same database, since the item and category ids are read from it here.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from bench.common import print_table, save_results, summarize
+from db import create_tables, get_db_connection
+
+DEFAULT_MIX = 'index=60,toggle=25,move=10,add=5'
+
+
+class TestClient:
+    """Requests through the WSGI app in this process."""
+
+    def __init__(self):
+        from app import app
+        # Without a cookie jar the Cookie header of each request is sent as given
+        self.client = app.test_client(use_cookies=False)
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        response.close()
+        return response.status_code
+
+
+class HttpClient:
+    """Requests over one kept-alive HTTP connection."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+def load_targets():
+    """Category and item ids per list, for requests to pick from."""
+    conn = get_db_connection()
+    categories = {}
+    for row in conn.execute('SELECT list_id, id FROM categories'):
+        categories.setdefault(row[0], []).append(row[1])
+    items = {}
+    for row in conn.execute('''
+        SELECT c.list_id, i.id, i.category_id FROM items i JOIN categories c ON c.id = i.category_id
+        WHERE i.is_deleted = FALSE
+    '''):
+        items.setdefault(row[0], []).append((row[1], row[2]))
+    conn.close()
+    list_ids = [list_id for list_id in categories if items.get(list_id)]
+    if not list_ids:
+        raise SystemExit("No data to run against; run python -m bench.datagen first")
+    return list_ids, categories, items
+
+
+def make_operations(list_ids, categories, items):
+    """Each operation picks its own targets and returns (method, path, body, headers)."""
+    def page(rng):
+        return 'GET', '/', None, {'Cookie': f'active_list_id={rng.choice(list_ids)}'}
+
+    def toggle(rng):
+        item_id, _ = rng.choice(items[rng.choice(list_ids)])
+        return 'POST', f'/toggle_completed/{item_id}', json.dumps({'is_completed': rng.random() < 0.5}), {'Content-Type': 'application/json'}
+
+    def move(rng):
+        list_items = items[rng.choice(list_ids)]
+        item_id, _ = rng.choice(list_items)
+        neighbour_id, category_id = rng.choice(list_items)
+        body = {'item_id': item_id, 'new_category_id': category_id, 'prev_id': neighbour_id, 'next_id': None}
+        return 'POST', '/update_item_and_order', json.dumps(body), {'Content-Type': 'application/json'}
+
+    def add(rng):
+        list_id = rng.choice(list_ids)
+        body = urllib.parse.urlencode({'name': f'workload item {rng.randint(1, 1000)}', 'quantity': 1, 'category_id': rng.choice(categories[list_id])})
+        return 'POST', '/add', body, {
+            'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json', 'Cookie': f'active_list_id={list_id}',
+        }
+
+    return {'index': page, 'toggle': toggle, 'move': move, 'add': add}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def worker(client_factory, operations, mix, deadline, remaining, latencies, errors, seed):
+    rng = random.Random(seed)
+    client = client_factory()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline:
+        if remaining is not None:
+            with remaining['lock']:
+                if remaining['count'] <= 0:
+                    return
+                remaining['count'] -= 1
+        name = rng.choices(names, weights)[0]
+        method, path, body, headers = operations[name](rng)
+        begin = time.perf_counter()
+        try:
+            status = client.request(method, path, body, headers)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - begin
+        # list.append is atomic, so threads can share these lists
+        if status is None or status >= 400:
+            errors[name].append(status)
+        else:
+            latencies[name].append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running server; default is the in-process test client')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for')
+    parser.add_argument('--requests', type=int, help='stop after this many requests instead')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'operation weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result file (default: bench/results/workload-<time>.json)')
+    args = parser.parse_args()
+
+    create_tables()
+    mix = parse_mix(args.mix)
+    operations = make_operations(*load_targets())
+    unknown = set(mix) - set(operations)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    client_factory = (lambda: HttpClient(args.url)) if args.url else TestClient
+
+    latencies = {name: [] for name in mix}
+    errors = {name: [] for name in mix}
+    remaining = {'count': args.requests, 'lock': threading.Lock()} if args.requests else None
+    deadline = time.perf_counter() + (args.duration if not args.requests else float('inf'))
+    threads = [
+        threading.Thread(target=worker, args=(client_factory, operations, mix, deadline, remaining, latencies, errors, args.seed + index))
+        for index in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {name: summarize(latencies[name], elapsed, len(errors[name])) for name in mix}
+    results['all'] = summarize([value for values in latencies.values() for value in values], elapsed,
+                               sum(len(values) for values in errors.values()))
+    print_table(results)
+    print(f"{results['all']['count']} requests in {elapsed:.1f}s, {results['all']['errors']} errors")
+    print(f"Saved {save_results('workload', args, results)}")
+
+
+if __name__ == '__main__':
+    main()
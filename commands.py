@@ -0,0 +1,50 @@
+import click
+
+from compaction import compact_items, COMPACTION_MIN_AGE, COMPACTION_BATCH_SIZE
+from transfer import FORMATS, InvalidRow, export_list, guess_format, import_list
+from models.shopping_list import ShoppingList
+
+# Maintenance commands, registered on both app.py and app_asgi.py, e.g.
+#   flask --app app compact-items --purge
+#   quart --app app_asgi export-list 1 list.csv
+
+
+@click.command('compact-items')
+@click.option('--min-age-days', type=float, default=COMPACTION_MIN_AGE / 86400, show_default=True,
+              help='Only compact items deleted at least this many days ago.')
+@click.option('--batch-size', type=int, default=COMPACTION_BATCH_SIZE, show_default=True,
+              help='Rows moved per transaction.')
+@click.option('--purge', is_flag=True, help='Delete old items outright instead of archiving them.')
+def compact_items_command(min_age_days, batch_size, purge):
+    """Move old deleted items out of the items table."""
+    report = compact_items(int(min_age_days * 86400), batch_size, archive=not purge)
+    click.echo(f"{report['action'].capitalize()} {report['rows']} items in {report['batches']} batches ({report['seconds']:.2f}s)")
+
+
+@click.command('export-list')
+@click.argument('list_id', type=int)
+@click.argument('output', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+              help='Defaults to the extension of OUTPUT, else ndjson.')
+def export_list_command(list_id, output, fmt):
+    """Write a list's items to OUTPUT (stdout by default)."""
+    if not ShoppingList.get_by_id(list_id):
+        raise click.ClickException(f"List {list_id} not found")
+    for chunk in export_list(list_id, fmt or guess_format(output.name)):
+        output.write(chunk.encode('utf-8'))
+
+
+@click.command('import-list')
+@click.argument('list_id', type=int)
+@click.argument('input', type=click.File('rb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+              help='Defaults to the extension of INPUT, else ndjson.')
+def import_list_command(list_id, input, fmt):
+    """Append the items in INPUT (stdin by default) to a list."""
+    if not ShoppingList.get_by_id(list_id):
+        raise click.ClickException(f"List {list_id} not found")
+    try:
+        imported = import_list(list_id, input, fmt or guess_format(input.name))
+    except InvalidRow as e:
+        raise click.ClickException(f"{e} ({e.imported} items were imported before it)")
+    click.echo(f"Imported {imported} items")
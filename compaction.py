@@ -0,0 +1,76 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from models.item import Item
+
+logger = logging.getLogger(__name__)
+
+# Deleted items younger than this many seconds are left alone (default: 30 days)
+COMPACTION_MIN_AGE = int(os.environ.get('COMPACTION_MIN_AGE', 30 * 24 * 3600))
+# Rows moved per transaction; small batches keep each write short
+COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', 500))
+# Seconds between background runs; 0 disables the background job
+COMPACTION_INTERVAL = int(os.environ.get('COMPACTION_INTERVAL', 6 * 3600))
+# Set to 0 to delete old tombstones outright instead of archiving them
+COMPACTION_ARCHIVE = os.environ.get('COMPACTION_ARCHIVE', '1') != '0'
+
+
+def compact_items(min_age=COMPACTION_MIN_AGE, batch_size=COMPACTION_BATCH_SIZE, archive=COMPACTION_ARCHIVE,
+                  pause=0.05, max_batches=None):
+    """Moves items deleted more than min_age seconds ago out of the items table.
+
+    Works in transactions of batch_size rows and sleeps for pause seconds
+    between them, so foreground writes are never held up for long. Returns a
+    report of what was done.
+    """
+    started = time.monotonic()
+    deleted_before = int(time.time()) - min_age
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = Item.compact_batch(deleted_before, batch_size, archive)
+        moved += count
+        batches += 1
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    return {
+        'rows': moved,
+        'action': 'archived' if archive else 'purged',
+        'batches': batches,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+
+_compactor = None
+_compactor_pid = None
+_compactor_lock = threading.Lock()
+
+
+def _run_periodically(interval):
+    # Spread the workers of one deployment out instead of compacting in lockstep
+    time.sleep(random.uniform(0, interval))
+    while True:
+        try:
+            report = compact_items()
+            if report['rows']:
+                logger.info("Compaction %s %d items in %d batches (%.2fs)",
+                            report['action'], report['rows'], report['batches'], report['seconds'])
+        except Exception:
+            logger.exception("Item compaction failed")
+        time.sleep(interval)
+
+
+def start_compaction_thread(interval=COMPACTION_INTERVAL):
+    """Starts the background compaction job for this process, unless disabled."""
+    global _compactor, _compactor_pid
+    if interval <= 0 or _compactor_pid == os.getpid():
+        return
+    with _compactor_lock:
+        if _compactor is None or _compactor_pid != os.getpid():
+            _compactor = threading.Thread(target=_run_periodically, args=(interval,), name='item-compaction', daemon=True)
+            _compactor.start()
+            _compactor_pid = os.getpid()
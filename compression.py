@@ -0,0 +1,132 @@
+import os
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+# Text responses are gzipped on the fly for clients that accept it. Bodies of
+# a known size below GZIP_MIN_SIZE are sent as they are, since a packet or two
+# gains nothing from compression. Streamed bodies have no size up front and are
+# compressed chunk by chunk, each chunk flushed, so the client can use every
+# part of the page as soon as it is rendered.
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+# zlib's window size plus 16 writes a gzip header and trailer around the deflate stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def accepts_gzip(accept_encoding):
+    return parse_accept_header(accept_encoding or '').quality('gzip') > 0
+
+
+def should_compress(status, headers):
+    """Whether a response with this status code and these Headers is worth gzipping."""
+    if status != 200 or 'Content-Encoding' in headers:
+        return False
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+    if headers.get('Content-Type', '').split(';')[0].strip() not in COMPRESSIBLE_MIMETYPES:
+        return False
+    length = headers.get('Content-Length')
+    return length is None or int(length) >= GZIP_MIN_SIZE
+
+
+def compressed_headers(headers):
+    """Headers of the same response gzipped. Its ETag turns weak, as the bytes differ from the identity version."""
+    headers.remove('Content-Length')
+    headers['Content-Encoding'] = 'gzip'
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return headers
+
+
+class GzipStream:
+    def __init__(self, level=GZIP_LEVEL):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+    def compress(self, data):
+        # A sync flush sends everything compressed so far without resetting the dictionary
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class GzipMiddleware:
+    """Gzips responses of a WSGI app, e.g. app.wsgi_app = GzipMiddleware(app.wsgi_app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING')):
+            return self.app(environ, start_response)
+
+        stream = None
+
+        def gzip_start_response(status, response_headers, exc_info=None):
+            nonlocal stream
+            headers = Headers(response_headers)
+            if should_compress(int(status.split(' ', 1)[0]), headers):
+                stream = GzipStream()
+                response_headers = list(compressed_headers(headers).items())
+            write = start_response(status, response_headers, exc_info)
+            return (lambda data: write(stream.compress(data))) if stream else write
+
+        return self._compress(self.app(environ, gzip_start_response), lambda: stream)
+
+    def _compress(self, app_iter, get_stream):
+        try:
+            for data in app_iter:
+                stream = get_stream()
+                if stream is None:
+                    yield data
+                elif data:
+                    yield stream.compress(data)
+            stream = get_stream()
+            if stream is not None:
+                yield stream.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+class AsyncGzipMiddleware:
+    """The same for an ASGI app, e.g. app.asgi_app = AsyncGzipMiddleware(app.asgi_app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accept_encoding = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]).get('Accept-Encoding')
+        if not accepts_gzip(accept_encoding):
+            return await self.app(scope, receive, send)
+
+        stream = None
+
+        async def gzip_send(message):
+            nonlocal stream
+            if message['type'] == 'http.response.start':
+                headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in message['headers']])
+                if should_compress(message['status'], headers):
+                    stream = GzipStream()
+                    message = {**message, 'headers': [
+                        (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in compressed_headers(headers).items()
+                    ]}
+            elif message['type'] == 'http.response.body' and stream is not None:
+                body = stream.compress(message.get('body', b''))
+                if not message.get('more_body', False):
+                    body += stream.finish()
+                message = {**message, 'body': body}
+            await send(message)
+
+        await self.app(scope, receive, gzip_send)
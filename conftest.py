@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Tests write to a database of their own, never the app's shopping_list.db.
+# Set DATABASE_URL to a Postgres database to run them against Postgres instead.
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(prefix='shopping-list-tests-'), 'test.db'))
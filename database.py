@@ -1,17 +1,432 @@
+import contextvars
+import functools
+import os
+import queue
 import sqlite3
+import threading
+import time
+import weakref
 
-def get_db_connection():
-    conn = sqlite3.connect('shopping_list.db')
+from events import broadcaster
+
+DATABASE_PATH = os.environ.get('SQLITE_PATH', 'shopping_list.db')
+# sqlite3 keeps this many compiled statements per connection
+STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+
+# Applied to every new connection. WAL lets readers run alongside the writer,
+# and synchronous=NORMAL is durable across application crashes in WAL mode.
+# cache_size is in KiB when negative.
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_PRAGMAS = [
+    f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}',
+    'PRAGMA journal_mode = WAL',
+    f"PRAGMA synchronous = {os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+    'PRAGMA foreign_keys = ON',
+    f"PRAGMA mmap_size = {int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}",
+    f"PRAGMA cache_size = {int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024))}",
+    'PRAGMA temp_store = MEMORY',
+]
+
+# Model writes run on one writer thread per process, which commits whatever
+# has queued up (at most SQLITE_GROUP_COMMIT_MAX writes) in one transaction.
+SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE', '1') != '0'
+SQLITE_GROUP_COMMIT_MAX = int(os.environ.get('SQLITE_GROUP_COMMIT_MAX', 64))
+
+# Connections are cached per thread (sqlite3 connections may not be shared
+# across threads), so "closing" one only hands it back for the next caller.
+_local = threading.local()
+_open_connections = weakref.WeakSet()
+_stats_lock = threading.Lock()
+_stats = {
+    'connections_opened': 0, 'checkouts': 0, 'reuses': 0,
+    'write_jobs': 0, 'write_batches': 0, 'write_batch_max': 0,
+    # Seconds write jobs spent queued before the writer started their batch
+    'wait_time_total': 0.0, 'wait_time_max': 0.0,
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """A per-thread cached connection whose close() returns it to the thread instead of closing it."""
+
+    def close(self):
+        _local.depth = max(getattr(_local, 'depth', 1) - 1, 0)
+        # Only the outermost caller may discard uncommitted work; nested
+        # helpers (e.g. Category.get_by_id inside Category.delete) share the connection.
+        if _local.depth == 0 and self.in_transaction:
+            self.rollback()
+
+    def commit(self):
+        # Inside a group commit the writer thread commits once for the whole batch
+        if self.group_commit:
+            return
+        super().commit()
+        # Announce changes (and update in-memory state) only once they are visible to other connections
+        pending, self.pending_callbacks = self.pending_callbacks, []
+        for callback in pending:
+            callback()
+
+    def rollback(self):
+        if self.group_commit:
+            # Undo only the current write, not the rest of the batch
+            self.execute('ROLLBACK TO SAVEPOINT write_job')
+            del self.pending_callbacks[self.job_callbacks_start:]
+            return
+        super().rollback()
+        self.pending_callbacks = []
+
+    def really_close(self):
+        super().close()
+
+
+def _connect():
+    # isolation_level IMMEDIATE takes the write lock when a write transaction
+    # starts, so a busy database is waited for instead of failing halfway through.
+    conn = sqlite3.connect(
+        DATABASE_PATH, factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE,
+        timeout=SQLITE_BUSY_TIMEOUT / 1000, isolation_level='IMMEDIATE'
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    conn.pending_callbacks = []
+    conn.group_commit = False
+    conn.job_callbacks_start = 0
+    _open_connections.add(conn)
+    with _stats_lock:
+        _stats['connections_opened'] += 1
+    return conn
+
+
+def get_db_connection():
+    conn = getattr(_local, 'conn', None)
+    # A forked worker must not reuse the parent's connection
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    else:
+        with _stats_lock:
+            _stats['reuses'] += 1
+    _local.depth += 1
+    with _stats_lock:
+        _stats['checkouts'] += 1
     return conn
 
+
+def close_db_connection():
+    """Really closes the calling thread's cached connection, if any."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.really_close()
+        _local.conn = None
+
+
+class _WriteJob:
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        # Runs in the caller's context, so per-request bookkeeping (metrics) sees its queries
+        self.context = contextvars.copy_context()
+        self.queued_at = time.perf_counter()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Writer:
+    """The thread that performs all of this process's writes.
+
+    Queued writes are run back to back inside one BEGIN IMMEDIATE transaction,
+    each in its own savepoint so a failing write is undone alone, and committed
+    together: one lock acquisition and one WAL sync for the whole group.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self.running = 0  # jobs in the batch being written
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, args, kwargs):
+        job = _WriteJob(func, args, kwargs)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def saturation(self):
+        """Jobs queued or being written per group commit's worth; above 1 writes wait for more than one commit."""
+        return (self.running + self._queue.qsize()) / SQLITE_GROUP_COMMIT_MAX
+
+    def _run(self):
+        _local.is_writer = True
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < SQLITE_GROUP_COMMIT_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        waits = [started - job.queued_at for job in batch]
+        self.running = len(batch)
+        conn = get_db_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.group_commit = True
+            for job in batch:
+                conn.job_callbacks_start = len(conn.pending_callbacks)
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    job.result = job.context.run(job.func, *job.args, **job.kwargs)
+                except Exception as e:
+                    job.error = e
+                    conn.execute('ROLLBACK TO SAVEPOINT write_job')
+                    del conn.pending_callbacks[conn.job_callbacks_start:]
+                conn.execute('RELEASE SAVEPOINT write_job')
+            conn.group_commit = False
+            conn.commit()
+        except Exception as e:
+            # The batch as a whole failed (e.g. the lock wait timed out), so no write landed
+            conn.group_commit = False
+            if conn.in_transaction:
+                conn.rollback()
+            for job in batch:
+                job.result = None
+                job.error = job.error or e
+        finally:
+            conn.close()
+            self.running = 0
+            with _stats_lock:
+                _stats['write_jobs'] += len(batch)
+                _stats['write_batches'] += 1
+                _stats['write_batch_max'] = max(_stats['write_batch_max'], len(batch))
+                _stats['wait_time_total'] += sum(waits)
+                _stats['wait_time_max'] = max(_stats['wait_time_max'], *waits)
+            for job in batch:
+                job.done.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        # Threads do not survive a fork, so each worker starts its own writer
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = Writer()
+        return _writer
+
+
+# Raised by writes that break a constraint (NOT NULL, FOREIGN KEY, UNIQUE)
+IntegrityError = sqlite3.IntegrityError
+
+
+def writes(func):
+    """Routes a model method that writes through this process's writer thread."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Writes made by another write (e.g. a save inside a delete) are already on the writer
+        if not SQLITE_WRITE_QUEUE or getattr(_local, 'is_writer', False):
+            return func(*args, **kwargs)
+        return get_writer().submit(func, args, kwargs)
+    return wrapper
+
+
+def after_commit(conn, callback):
+    """Calls callback once conn's transaction (or the group commit it is part of) has committed.
+
+    A rollback, or a write undone to its savepoint, drops it uncalled.
+    """
+    if not conn.in_transaction:
+        callback()
+    else:
+        conn.pending_callbacks.append(callback)
+
+
+def execute(conn, sql, params=()):
+    # sqlite3 reuses the compiled statement from the connection's cache
+    return conn.execute(sql, params)
+
+
+def executemany(conn, sql, rows):
+    return conn.executemany(sql, rows)
+
+
+def fetch_batches(conn, sql, params=(), batch_size=500):
+    """Yields the rows of sql in lists of up to batch_size, without reading them all into memory."""
+    # sqlite3 steps through the result as rows are fetched
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def begin_snapshot(conn):
+    """Starts a transaction so the following reads see one consistent state."""
+    conn.execute('BEGIN')
+
+
+def start_change_listener():
+    # Nothing to listen to: commits publish to this process's broadcaster directly
+    pass
+
+
+def get_pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    # Reads use a connection of their own thread and never wait; the waiting and
+    # saturation reported are the writer's, the one resource writes queue for
+    stats.update({
+        'backend': 'sqlite',
+        'open_connections': len(_open_connections),
+        'write_queue_depth': _writer.queue_depth() if _writer is not None else 0,
+        'wait_time_avg': stats['wait_time_total'] / stats['write_jobs'] if stats['write_jobs'] else 0.0,
+        'saturation': _writer.saturation() if _writer is not None else 0.0,
+    })
+    return stats
+
+
+# SQLite caps the number of bound parameters per statement (999 on older builds)
+SQLITE_MAX_PARAMS = 999
+
+
+def bulk_update(conn, table, columns, rows):
+    """Updates many rows with one CASE statement per chunk.
+
+    rows are (id, value, ...) tuples in the order of columns. table and
+    columns are interpolated into the SQL, so they must never come from user input.
+    """
+    rows = list(rows)
+    chunk_size = max(SQLITE_MAX_PARAMS // (2 * len(columns) + 1), 1)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        assignments = []
+        params = []
+        for index, column in enumerate(columns):
+            assignments.append(f"{column} = CASE id {' '.join(['WHEN ? THEN ?'] * len(chunk))} END")
+            for row in chunk:
+                params.extend((row[0], row[index + 1]))
+        params.extend(row[0] for row in chunk)
+        conn.execute(
+            f"UPDATE {table} SET {', '.join(assignments)} WHERE id IN ({', '.join(['?'] * len(chunk))})",
+            params
+        )
+
+
+def bulk_insert(conn, table, columns, rows, returning='id'):
+    """Inserts many rows with one multi-row INSERT per chunk and returns the RETURNING rows.
+
+    table, columns and returning are interpolated into the SQL, so they must
+    never come from user input.
+    """
+    rows = list(rows)
+    chunk_size = max(SQLITE_MAX_PARAMS // len(columns), 1)
+    row_placeholders = f"({', '.join(['?'] * len(columns))})"
+    returned = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        returned.extend(conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_placeholders] * len(chunk))} RETURNING {returning}",
+            [value for row in chunk for value in row]
+        ).fetchall())
+    return returned
+
+
+def search_items(conn, terms, list_id=None, limit=20, offset=0):
+    """Live items matching every term, best matches first.
+
+    The last term, the one still being typed, also matches as a word prefix
+    once it is two characters long. Every match is ranked, so a page of
+    results is the same whatever its offset and however broad the query.
+    """
+    query = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+    if len(terms[-1]) > 1:
+        query += '*'
+    params = [query]
+    list_filter = ''
+    if list_id is not None:
+        list_filter = 'AND c.list_id = ?'
+        params.append(list_id)
+    # bm25() weights the columns in table order: a hit in the name counts most
+    return conn.execute(f'''
+        SELECT
+            i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it, i.is_completed,
+            c.id AS category_id, c.name AS category_name, s.id AS list_id, s.name AS list_name
+        FROM items_fts
+        JOIN items i ON i.id = items_fts.rowid
+        JOIN categories c ON c.id = i.category_id
+        JOIN shopping_lists s ON s.id = c.list_id
+        WHERE items_fts MATCH ? AND i.is_deleted = FALSE {list_filter}
+        ORDER BY bm25(items_fts, 10.0, 1.0, 2.0, 2.0), i.id DESC
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset]).fetchall()
+
+
+# How many revisions of history each list keeps for delta sync
+CHANGE_LOG_RETENTION = int(os.environ.get('CHANGE_LOG_RETENTION', 1000))
+
+
+def record_change(conn, entity, entity_ids, list_id=None):
+    """Bumps the revision of every list owning the changed rows and logs the rows for delta sync.
+
+    entity is 'item', 'category' or 'list'. Pass list_id for rows that no
+    longer exist (a deleted category). List changes are logged on every list,
+    since every page shows all the list tabs. Open event streams are notified
+    when the transaction commits.
+    """
+    entity_ids = [int(entity_id) for entity_id in entity_ids]
+    if not entity_ids:
+        return
+    if entity == 'list':
+        owners = [(row['id'], entity_id) for row in conn.execute('SELECT id FROM shopping_lists') for entity_id in entity_ids]
+    elif list_id is not None:
+        owners = [(int(list_id), entity_id) for entity_id in entity_ids]
+    else:
+        owners = []
+        for start in range(0, len(entity_ids), SQLITE_MAX_PARAMS):
+            chunk = entity_ids[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ', '.join(['?'] * len(chunk))
+            if entity == 'item':
+                sql = f'SELECT c.list_id, i.id FROM items i JOIN categories c ON c.id = i.category_id WHERE i.id IN ({placeholders})'
+            else:
+                sql = f'SELECT list_id, id FROM categories WHERE id IN ({placeholders})'
+            owners.extend((row[0], row[1]) for row in conn.execute(sql, chunk))
+
+    by_list = {}
+    for owner_id, entity_id in owners:
+        by_list.setdefault(owner_id, []).append(entity_id)
+    for owner_id, ids in by_list.items():
+        conn.execute('UPDATE shopping_lists SET revision = revision + 1 WHERE id = ?', (owner_id,))
+        revision = conn.execute('SELECT revision FROM shopping_lists WHERE id = ?', (owner_id,)).fetchone()[0]
+        conn.executemany(
+            'INSERT INTO changes (list_id, revision, entity, entity_id) VALUES (?, ?, ?, ?)',
+            [(owner_id, revision, entity, entity_id) for entity_id in ids]
+        )
+        conn.pending_callbacks.append(functools.partial(broadcaster.publish, owner_id, revision, entity, ids))
+        # Trim old history now and then rather than on every write
+        if revision % 100 == 0:
+            conn.execute('DELETE FROM changes WHERE list_id = ? AND revision <= ?', (owner_id, revision - CHANGE_LOG_RETENTION))
+
+
 def create_tables():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Enable foreign key support
-    cursor.execute("PRAGMA foreign_keys = ON")
-
     # Create shopping_lists table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS shopping_lists (
@@ -52,4 +467,159 @@ def create_tables():
     cursor.execute("INSERT OR IGNORE INTO categories (id, name, display_order, list_id) VALUES (1, 'Other', 99999, 1)")
 
     conn.commit()
+    migrate(conn)
     conn.close()
+
+
+# Ordered schema migrations as (version, statements). Released steps must
+# never change; append a new step instead.
+MIGRATIONS = [
+    (1, [
+        'CREATE INDEX IF NOT EXISTS idx_items_category_deleted_order ON items (category_id, is_deleted, display_order)',
+        'CREATE INDEX IF NOT EXISTS idx_categories_list_order ON categories (list_id, display_order)',
+        'CREATE INDEX IF NOT EXISTS idx_categories_list_name ON categories (list_id, name)',
+    ]),
+    # Spread existing orders out to the sparse keys used by ordering.py (ORDER_GAP = 1024)
+    (2, [
+        'UPDATE items SET display_order = display_order * 1024',
+        'UPDATE categories SET display_order = display_order * 1024',
+    ]),
+    # Per-list revision counter, bumped by every write to a list's rows
+    (3, [
+        'ALTER TABLE shopping_lists ADD COLUMN revision INTEGER NOT NULL DEFAULT 0',
+    ]),
+    # Change log read by the delta-sync API
+    (4, [
+        '''CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            list_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_changes_list_revision ON changes (list_id, revision)',
+    ]),
+    # Deletion times (Unix seconds) and the archive that compaction moves old tombstones into
+    (5, [
+        'ALTER TABLE items ADD COLUMN deleted_at INTEGER',
+        "UPDATE items SET deleted_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE is_deleted = 1",
+        'CREATE INDEX IF NOT EXISTS idx_items_deleted_at ON items (is_deleted, deleted_at)',
+        '''CREATE TABLE IF NOT EXISTS items_archive (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            notes TEXT,
+            who_needs_it TEXT,
+            who_will_buy_it TEXT,
+            is_completed INTEGER,
+            category_id INTEGER,
+            display_order INTEGER,
+            deleted_at INTEGER,
+            archived_at INTEGER NOT NULL
+        )''',
+    ]),
+    # Full-text index over the searchable item columns, kept in step with items by
+    # triggers. The prefix indexes make prefixes of up to 6 letters cheap to expand.
+    (6, [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, notes, who_needs_it, who_will_buy_it,
+            content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4 5 6'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts (rowid, name, notes, who_needs_it, who_will_buy_it)
+            VALUES (new.id, new.name, new.notes, new.who_needs_it, new.who_will_buy_it);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, notes, who_needs_it, who_will_buy_it)
+            VALUES ('delete', old.id, old.name, old.notes, old.who_needs_it, old.who_will_buy_it);
+        END''',
+        # Only edits to indexed text touch the index, not toggles or reorders
+        '''CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, notes, who_needs_it, who_will_buy_it ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, notes, who_needs_it, who_will_buy_it)
+            VALUES ('delete', old.id, old.name, old.notes, old.who_needs_it, old.who_will_buy_it);
+            INSERT INTO items_fts (rowid, name, notes, who_needs_it, who_will_buy_it)
+            VALUES (new.id, new.name, new.notes, new.who_needs_it, new.who_will_buy_it);
+        END''',
+        "INSERT INTO items_fts (items_fts) VALUES ('rebuild')",
+    ]),
+    # Per-category revision, the key of the cached category fragments. Triggers
+    # bump it whenever anything the category's markup shows changes: its own
+    # name or position, or any of its visible items.
+    (7, [
+        'ALTER TABLE categories ADD COLUMN revision INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TRIGGER IF NOT EXISTS categories_revision_update AFTER UPDATE OF name, display_order ON categories BEGIN
+            UPDATE categories SET revision = revision + 1 WHERE id = new.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_category_revision_insert AFTER INSERT ON items WHEN new.is_deleted = 0 BEGIN
+            UPDATE categories SET revision = revision + 1 WHERE id = new.category_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_category_revision_delete AFTER DELETE ON items WHEN old.is_deleted = 0 BEGIN
+            UPDATE categories SET revision = revision + 1 WHERE id = old.category_id;
+        END''',
+        # A move changes both the category the item left and the one it joined
+        '''CREATE TRIGGER IF NOT EXISTS items_category_revision_update
+            AFTER UPDATE OF name, quantity, notes, who_needs_it, who_will_buy_it, is_completed, is_deleted, category_id, display_order ON items
+            WHEN old.is_deleted = 0 OR new.is_deleted = 0 BEGIN
+            UPDATE categories SET revision = revision + 1 WHERE id IN (old.category_id, new.category_id);
+        END''',
+    ]),
+    # Responses of requests sent with an Idempotency-Key, replayed to retries.
+    # status stays NULL while the first request is still running.
+    (8, [
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            headers TEXT,
+            body BLOB,
+            created_at INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)',
+    ]),
+    # Ordering counters: the display_order of the last item appended to a
+    # category and of the last category appended to a list. An append bumps
+    # the counter instead of scanning for MAX(display_order). The triggers keep
+    # a counter from falling behind orders set any other way, e.g. a drag to
+    # the end of a category or a rebalance.
+    (9, [
+        'ALTER TABLE categories ADD COLUMN next_item_order INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE shopping_lists ADD COLUMN next_category_order INTEGER NOT NULL DEFAULT 0',
+        '''UPDATE categories SET next_item_order = coalesce(
+            (SELECT MAX(display_order) FROM items WHERE category_id = categories.id), 0)''',
+        '''UPDATE shopping_lists SET next_category_order = coalesce(
+            (SELECT MAX(display_order) FROM categories WHERE list_id = shopping_lists.id), 0)''',
+        '''CREATE TRIGGER IF NOT EXISTS items_order_counter_insert AFTER INSERT ON items BEGIN
+            UPDATE categories SET next_item_order = new.display_order WHERE id = new.category_id AND next_item_order < new.display_order;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS items_order_counter_update AFTER UPDATE OF category_id, display_order ON items BEGIN
+            UPDATE categories SET next_item_order = new.display_order WHERE id = new.category_id AND next_item_order < new.display_order;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS categories_order_counter_insert AFTER INSERT ON categories BEGIN
+            UPDATE shopping_lists SET next_category_order = new.display_order WHERE id = new.list_id AND next_category_order < new.display_order;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS categories_order_counter_update AFTER UPDATE OF list_id, display_order ON categories BEGIN
+            UPDATE shopping_lists SET next_category_order = new.display_order WHERE id = new.list_id AND next_category_order < new.display_order;
+        END''',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+
+
+def migrate(conn):
+    """Brings an existing database up to the latest schema version in place."""
+    for version, statements in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock, so concurrently starting
+        # workers apply each step exactly once.
+        conn.execute('BEGIN IMMEDIATE')
+        if get_schema_version(conn) >= version:
+            conn.rollback()
+            continue
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+        conn.commit()
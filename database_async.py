@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+from time import perf_counter
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from database_pg import (
+    NOTIFY_CHANNEL, POOL_CHECKOUT_TIMEOUT, POOL_IDLE_TIMEOUT, POOL_MAX_SIZE, POOL_MIN_SIZE, PREPARE_THRESHOLD,
+    to_pyformat,
+)
+from events import broadcaster
+from metrics import record_query
+
+# Async counterpart of database_pg for app_asgi.py, on psycopg 3. It serves the
+# reads that scale with the number of open connections (revision checks, event
+# streams); everything else still goes through the shared models and db.py, on
+# app_asgi's worker threads and database_pg's pool.
+
+_pool = None
+
+
+def _conninfo():
+    if "DATABASE_URL" not in os.environ:
+        raise RuntimeError("DATABASE_URL is not set. This configuration is for production.")
+    return os.environ["DATABASE_URL"]
+
+
+async def open_pool():
+    global _pool
+    _pool = AsyncConnectionPool(
+        _conninfo(),
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_idle=POOL_IDLE_TIMEOUT,
+        timeout=POOL_CHECKOUT_TIMEOUT,
+        kwargs={'autocommit': True, 'prepare_threshold': PREPARE_THRESHOLD if PREPARE_THRESHOLD >= 0 else None},
+        open=False
+    )
+    await _pool.open()
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def fetch_value(sql, params=()):
+    """Runs a single-row, single-column query written with ? placeholders and returns the value, or None for no row."""
+    async with _pool.connection() as conn:
+        started = perf_counter()
+        cursor = await conn.execute(to_pyformat(sql), params)
+        row = await cursor.fetchone()
+        record_query(sql, params, perf_counter() - started)
+    return row[0] if row else None
+
+
+def get_pool_stats():
+    stats = _pool.get_stats() if _pool is not None else {}
+    stats['backend'] = 'postgres-async'
+    return stats
+
+
+async def listen_for_changes(retry_after=5):
+    """Relays NOTIFYs from record_change() to this process's event streams until cancelled."""
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(_conninfo(), autocommit=True) as conn:
+                await conn.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                async for notify in conn.notifies():
+                    event = json.loads(notify.payload)
+                    broadcaster.publish(event['list_id'], event['revision'], event['entity'], event['ids'])
+        except psycopg.Error:
+            # Streams fall back to their heartbeat checks until we reconnect
+            await asyncio.sleep(retry_after)
@@ -1,9 +1,260 @@
+import itertools
+import json
 import os
+import re
+import select
+import threading
+import time
+import weakref
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import urllib.parse as up
+from collections import OrderedDict
+from functools import lru_cache
 
-def get_db_connection():
+from events import broadcaster
+
+# Pool sizing is per process: every gunicorn worker gets its own pool.
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+# Idle connections above POOL_MIN_SIZE are closed after this many seconds
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+# How long a checkout may wait for a free connection before giving up
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 30))
+# Connections idle for longer than this are pinged before being handed out
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 30))
+# A statement is prepared on the server once a connection has run it this many
+# times; a negative value turns prepared statements off (e.g. behind pgbouncer
+# in transaction mode).
+PREPARE_THRESHOLD = int(os.environ.get('DB_PREPARE_THRESHOLD', 5))
+# Upper bound on prepared statements per connection
+STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+# Upper bound on statements whose uses are counted towards PREPARE_THRESHOLD per
+# connection; the least recently run are forgotten first. Statements built with
+# a varying number of placeholders (IN lists) would otherwise grow it forever.
+STATEMENT_USES_SIZE = int(os.environ.get('DB_STATEMENT_USES_SIZE', 4 * STATEMENT_CACHE_SIZE))
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+_statement_ids = itertools.count(1)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """A psycopg2 connection whose close() returns it to its pool.
+
+    It also remembers the statements it has prepared on the server, keyed by
+    their SQL text, for as long as the session lives.
+    """
+    pool = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}  # sql -> prepared statement name
+        self.statement_uses = OrderedDict()  # sql -> executions before it got prepared, least recently run first
+        self.pending_callbacks = []  # run by the next commit, dropped by a rollback
+
+    def prepared_name(self, sql):
+        """The name sql is prepared under, preparing it once it is used often enough, or None."""
+        name = self.statements.get(sql)
+        if name is not None or PREPARE_THRESHOLD < 0 or len(self.statements) >= STATEMENT_CACHE_SIZE:
+            return name
+        uses = self.statement_uses.pop(sql, 0) + 1
+        if uses < PREPARE_THRESHOLD:
+            self.statement_uses[sql] = uses
+            while len(self.statement_uses) > STATEMENT_USES_SIZE:
+                self.statement_uses.popitem(last=False)
+            return None
+        name = f'stmt_{next(_statement_ids)}'
+        cursor = super().cursor()
+        try:
+            # PREPARE is not transactional, so the statement outlives a later rollback
+            cursor.execute(f'SAVEPOINT prepare_statement; PREPARE {name} AS {to_numbered(sql)}; RELEASE SAVEPOINT prepare_statement')
+        except psycopg2.Error:
+            # e.g. a parameter whose type the server cannot infer; run it unprepared from now on
+            cursor.execute('ROLLBACK TO SAVEPOINT prepare_statement')
+            self.statement_uses[sql] = float('-inf')
+            return None
+        finally:
+            cursor.close()
+        self.statements[sql] = name
+        return name
+
+    def commit(self):
+        super().commit()
+        pending, self.pending_callbacks = self.pending_callbacks, []
+        for callback in pending:
+            callback()
+
+    def rollback(self):
+        super().rollback()
+        self.pending_callbacks = []
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.putconn(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, returned_at), most recently used last
+        # Checked-out connections are only weakly referenced, so a connection
+        # leaked by an exception frees its slot once it is garbage collected.
+        self._in_use = weakref.WeakSet()
+        self._connecting = 0
+        self._stats = {
+            'checkouts': 0, 'waits': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0,
+            'timeouts': 0, 'connections_created': 0, 'connections_closed': 0,
+            'health_check_failures': 0,
+        }
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._connecting
+
+    def _close(self, conn):
+        self._stats['connections_closed'] += 1
+        try:
+            conn.really_close()
+        except psycopg2.Error:
+            pass
+
+    def _reap_idle(self, now):
+        # Oldest connections sit at the front of the idle list
+        while self._idle and self._size() > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self._close(conn)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._reap_idle(now)
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use.add(conn)
+                    create = False
+                elif self._size() < self.max_size:
+                    self._connecting += 1
+                    create = True
+                else:
+                    if now >= deadline:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+                    waited = True
+                    # Wake up periodically: a leaked connection frees its slot without notifying
+                    self._cond.wait(min(deadline - now, 1.0))
+                    continue
+
+            if create:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._connecting -= 1
+                conn.pool = self
+                with self._cond:
+                    self._in_use.add(conn)
+                    self._stats['connections_created'] += 1
+            elif conn.closed or (time.monotonic() - returned_at > self.health_check_after and not self._is_healthy(conn)):
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._stats['health_check_failures'] += 1
+                    self._close(conn)
+                continue
+
+            wait_time = time.monotonic() - started
+            with self._cond:
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                    self._stats['wait_time_total'] += wait_time
+                    self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            # A second close() of the same checkout is a no-op
+            if conn not in self._in_use:
+                return
+        # Never hand out a connection with an open or failed transaction
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.really_close()
+        with self._cond:
+            self._in_use.discard(conn)
+            if conn.closed:
+                self._stats['connections_closed'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._reap_idle(time.monotonic())
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            in_use = len(self._in_use)
+            stats.update({
+                'backend': 'postgres',
+                'size': self._size(),
+                'idle': len(self._idle),
+                'in_use': in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'saturation': in_use / self.max_size if self.max_size else 0.0,
+                'wait_time_avg': stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0,
+            })
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited across a fork are kept referenced, never closed: closing
+# them from the child would terminate sessions the parent is still using.
+_inherited_pools = []
+
+
+def _connect():
     up.uses_netloc.append("postgres")
     # In a production environment (like on Render), DATABASE_URL will be set.
     # For local development, you might have a different way to connect,
@@ -17,10 +268,264 @@ def get_db_connection():
         user=url.username,
         password=url.password,
         host=url.hostname,
-        port=url.port
+        port=url.port,
+        connection_factory=PooledConnection
     )
     return conn
 
+
+def get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            _pool = ConnectionPool(_connect)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_db_connection():
+    return get_pool().getconn()
+
+
+def get_pool_stats():
+    return get_pool().stats()
+
+
+_PLACEHOLDER = re.compile(r"('(?:[^']|'')*')|\?")
+
+
+@lru_cache(maxsize=1024)
+def _translate(sql, style):
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1):
+            return match.group(1)  # leave string literals alone
+        count += 1
+        return f'${count}' if style == 'numbered' else '%s'
+
+    if style == 'pyformat':
+        sql = sql.replace('%', '%%')
+    return _PLACEHOLDER.sub(replace, sql), count
+
+
+def to_pyformat(sql):
+    """Rewrites the ? placeholders shared with SQLite into psycopg's %s."""
+    return _translate(sql, 'pyformat')[0]
+
+
+def to_numbered(sql):
+    return _translate(sql, 'numbered')[0]
+
+
+# Raised by writes that break a constraint (NOT NULL, FOREIGN KEY, UNIQUE)
+IntegrityError = psycopg2.IntegrityError
+
+
+def writes(func):
+    # Postgres copes with concurrent writers itself; writes run on the calling thread
+    return func
+
+
+def after_commit(conn, callback):
+    """Calls callback once conn's transaction has committed; a rollback drops it uncalled."""
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        callback()
+    else:
+        conn.pending_callbacks.append(callback)
+
+
+def execute(conn, sql, params=()):
+    """Runs sql written with ? placeholders and returns a cursor of dict-like rows."""
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    name = conn.prepared_name(sql)
+    if name is None:
+        cursor.execute(to_pyformat(sql), params)
+    elif params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f'EXECUTE {name}')
+    return cursor
+
+
+def executemany(conn, sql, rows, page_size=100):
+    # execute_batch sends page_size statements per round trip instead of one
+    cursor = conn.cursor()
+    psycopg2.extras.execute_batch(cursor, to_pyformat(sql), rows, page_size=page_size)
+    return cursor
+
+
+_cursor_ids = itertools.count(1)
+
+
+def fetch_batches(conn, sql, params=(), batch_size=500):
+    """Yields the rows of sql in lists of up to batch_size, without reading them all into memory."""
+    # A named cursor keeps the result on the server and sends it over batch_size rows at a time
+    cursor = conn.cursor(name=f'batches_{next(_cursor_ids)}', cursor_factory=psycopg2.extras.DictCursor)
+    cursor.itersize = batch_size
+    try:
+        cursor.execute(to_pyformat(sql), params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        if not conn.closed and not cursor.closed:
+            cursor.close()
+
+
+def begin_snapshot(conn):
+    """Starts a transaction so the following reads see one consistent state."""
+    conn.cursor().execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+
+def bulk_update(conn, table, columns, rows, page_size=500):
+    """Updates many rows with one UPDATE ... FROM (VALUES ...) statement per page.
+
+    rows are (id, value, ...) tuples in the order of columns. table and
+    columns are interpolated into the SQL, so they must never come from user input.
+    """
+    cursor = conn.cursor()
+    psycopg2.extras.execute_values(
+        cursor,
+        f"UPDATE {table} AS t SET {', '.join(f'{column} = v.{column}' for column in columns)} "
+        f"FROM (VALUES %s) AS v (id, {', '.join(columns)}) WHERE t.id = v.id",
+        list(rows),
+        page_size=page_size
+    )
+
+
+def bulk_insert(conn, table, columns, rows, returning='id', page_size=500):
+    """Inserts many rows with one multi-row INSERT per page and returns the RETURNING rows.
+
+    table, columns and returning are interpolated into the SQL, so they must
+    never come from user input.
+    """
+    return psycopg2.extras.execute_values(
+        conn.cursor(cursor_factory=psycopg2.extras.DictCursor),
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s RETURNING {returning}",
+        list(rows),
+        page_size=page_size,
+        fetch=True
+    )
+
+
+def search_items(conn, terms, list_id=None, limit=20, offset=0):
+    """Live items matching every term, best matches first.
+
+    The last term, the one still being typed, also matches as a word prefix
+    once it is two characters long. Every match is ranked, so a page of
+    results is the same whatever its offset and however broad the query.
+    """
+    # Terms are plain words, so they cannot carry tsquery operators
+    query = ' & '.join(terms)
+    if len(terms[-1]) > 1:
+        query += ':*'
+    params = [query]
+    list_filter = ''
+    if list_id is not None:
+        list_filter = 'AND c.list_id = ?'
+        params.append(list_id)
+    # is_deleted = FALSE matches the partial GIN index, which finds the rows to rank
+    return execute(conn, f'''
+        SELECT
+            i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it, i.is_completed,
+            c.id AS category_id, c.name AS category_name, s.id AS list_id, s.name AS list_name
+        FROM items i
+        JOIN categories c ON c.id = i.category_id
+        JOIN shopping_lists s ON s.id = c.list_id
+        WHERE i.search_vector @@ to_tsquery('simple', ?) AND i.is_deleted = FALSE {list_filter}
+        ORDER BY ts_rank(i.search_vector, to_tsquery('simple', ?)) DESC, i.id DESC
+        LIMIT ? OFFSET ?
+    ''', params + [query, limit, offset]).fetchall()
+
+
+# How many revisions of history each list keeps for delta sync
+CHANGE_LOG_RETENTION = int(os.environ.get('CHANGE_LOG_RETENTION', 1000))
+
+
+def record_change(conn, entity, entity_ids, list_id=None):
+    """Bumps the revision of every list owning the changed rows and logs the rows for delta sync.
+
+    entity is 'item', 'category' or 'list'. Pass list_id for rows that no
+    longer exist (a deleted category). List changes are logged on every list,
+    since every page shows all the list tabs. The NOTIFY sent here is only
+    delivered if the transaction commits.
+    """
+    entity_ids = [int(entity_id) for entity_id in entity_ids]
+    if not entity_ids:
+        return
+    if entity == 'list':
+        owners = [(row[0], entity_id) for row in execute(conn, 'SELECT id FROM shopping_lists') for entity_id in entity_ids]
+    elif list_id is not None:
+        owners = [(int(list_id), entity_id) for entity_id in entity_ids]
+    elif entity == 'item':
+        owners = [(row[0], row[1]) for row in execute(conn, 'SELECT c.list_id, i.id FROM items i JOIN categories c ON c.id = i.category_id WHERE i.id = ANY(?)', (entity_ids,))]
+    else:
+        owners = [(row[0], row[1]) for row in execute(conn, 'SELECT list_id, id FROM categories WHERE id = ANY(?)', (entity_ids,))]
+
+    by_list = {}
+    for owner_id, entity_id in owners:
+        by_list.setdefault(owner_id, []).append(entity_id)
+    for owner_id, ids in by_list.items():
+        revision = execute(conn, 'UPDATE shopping_lists SET revision = revision + 1 WHERE id = ? RETURNING revision', (owner_id,)).fetchone()[0]
+        psycopg2.extras.execute_values(
+            conn.cursor(),
+            'INSERT INTO changes (list_id, revision, entity, entity_id) VALUES %s',
+            [(owner_id, revision, entity, entity_id) for entity_id in ids]
+        )
+        # NOTIFY payloads are capped at 8000 bytes; listeners only need the revision
+        payload = {'list_id': owner_id, 'revision': revision, 'entity': entity, 'ids': ids if len(ids) <= 100 else []}
+        execute(conn, 'SELECT pg_notify(?, ?)', (NOTIFY_CHANNEL, json.dumps(payload)))
+        # Trim old history now and then rather than on every write
+        if revision % 100 == 0:
+            execute(conn, 'DELETE FROM changes WHERE list_id = ? AND revision <= ?', (owner_id, revision - CHANGE_LOG_RETENTION))
+
+
+# Channel every worker LISTENs on to relay list changes to its SSE streams
+NOTIFY_CHANNEL = 'list_changes'
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listen(poll_timeout=5):
+    while True:
+        conn = None
+        try:
+            conn = _connect()
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+            while True:
+                if select.select([conn], [], [], poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    event = json.loads(notify.payload)
+                    broadcaster.publish(event['list_id'], event['revision'], event['entity'], event['ids'])
+        except psycopg2.Error:
+            # Lost the connection; streams fall back to their heartbeat checks until we reconnect
+            if conn is not None:
+                conn.close()
+            time.sleep(poll_timeout)
+
+
+def start_change_listener():
+    """Starts this worker's LISTEN thread, once per process."""
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            _listener = threading.Thread(target=_listen, name='pg-change-listener', daemon=True)
+            _listener.start()
+            _listener_pid = os.getpid()
+
+
 def create_tables():
     """Creates the necessary tables in the PostgreSQL database."""
     conn = get_db_connection()
@@ -64,6 +569,188 @@ def create_tables():
     
     cursor.execute("INSERT INTO categories (id, name, display_order, list_id) VALUES (1, 'Other', 99999, 1) ON CONFLICT (id) DO NOTHING")
 
+    # The rows above bypass the SERIAL sequences, so move them past the ids in use
+    for table in ('shopping_lists', 'categories'):
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))")
+
     conn.commit()
     cursor.close()
+    migrate(conn)
     conn.close()
+
+
+# Ordered schema migrations as (version, statements). Released steps must
+# never change; append a new step instead.
+MIGRATIONS = [
+    (1, [
+        'CREATE INDEX IF NOT EXISTS idx_items_category_deleted_order ON items (category_id, is_deleted, display_order)',
+        'CREATE INDEX IF NOT EXISTS idx_categories_list_order ON categories (list_id, display_order)',
+        'CREATE INDEX IF NOT EXISTS idx_categories_list_name ON categories (list_id, name)',
+    ]),
+    # Spread existing orders out to the sparse keys used by ordering.py (ORDER_GAP = 1024)
+    (2, [
+        'UPDATE items SET display_order = display_order * 1024',
+        'UPDATE categories SET display_order = display_order * 1024',
+    ]),
+    # Per-list revision counter, bumped by every write to a list's rows
+    (3, [
+        'ALTER TABLE shopping_lists ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0',
+    ]),
+    # Change log read by the delta-sync API
+    (4, [
+        '''CREATE TABLE IF NOT EXISTS changes (
+            id BIGSERIAL PRIMARY KEY,
+            list_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_changes_list_revision ON changes (list_id, revision)',
+    ]),
+    # Deletion times (Unix seconds) and the archive that compaction moves old tombstones into
+    (5, [
+        'ALTER TABLE items ADD COLUMN IF NOT EXISTS deleted_at BIGINT',
+        'UPDATE items SET deleted_at = EXTRACT(EPOCH FROM now())::BIGINT WHERE is_deleted',
+        'CREATE INDEX IF NOT EXISTS idx_items_deleted_at ON items (is_deleted, deleted_at)',
+        '''CREATE TABLE IF NOT EXISTS items_archive (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            notes TEXT,
+            who_needs_it TEXT,
+            who_will_buy_it TEXT,
+            is_completed BOOLEAN,
+            category_id INTEGER,
+            display_order INTEGER,
+            deleted_at BIGINT,
+            archived_at BIGINT NOT NULL
+        )''',
+    ]),
+    # Full-text search vector over the searchable item columns, weighted name first
+    (6, [
+        '''ALTER TABLE items ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(who_needs_it, '') || ' ' || coalesce(who_will_buy_it, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(notes, '')), 'C')
+        ) STORED''',
+        'CREATE INDEX IF NOT EXISTS idx_items_search ON items USING GIN (search_vector) WHERE is_deleted = FALSE',
+    ]),
+    # Per-category revision, the key of the cached category fragments. Triggers
+    # bump it whenever anything the category's markup shows changes: its own
+    # name or position, or any of its visible items. The item triggers run once
+    # per statement, so a bulk update touches each category row once.
+    (7, [
+        'ALTER TABLE categories ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0',
+        '''CREATE OR REPLACE FUNCTION bump_category_revision() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.revision := OLD.revision + 1;
+            RETURN NEW;
+        END $$''',
+        '''CREATE TRIGGER categories_revision_update BEFORE UPDATE OF name, display_order ON categories
+            FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.display_order IS DISTINCT FROM NEW.display_order)
+            EXECUTE FUNCTION bump_category_revision()''',
+        '''CREATE OR REPLACE FUNCTION bump_item_category_revisions() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE categories SET revision = revision + 1
+                WHERE id IN (SELECT category_id FROM new_rows WHERE NOT is_deleted);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE categories SET revision = revision + 1
+                WHERE id IN (SELECT category_id FROM old_rows WHERE NOT is_deleted);
+            ELSE
+                -- A move changes both the category the item left and the one it joined
+                UPDATE categories SET revision = revision + 1 WHERE id IN (
+                    SELECT o.category_id FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE (NOT o.is_deleted OR NOT n.is_deleted) AND (o.name, o.quantity, o.notes, o.who_needs_it, o.who_will_buy_it,
+                        o.is_completed, o.is_deleted, o.category_id, o.display_order) IS DISTINCT FROM (n.name, n.quantity, n.notes,
+                        n.who_needs_it, n.who_will_buy_it, n.is_completed, n.is_deleted, n.category_id, n.display_order)
+                    UNION
+                    SELECT n.category_id FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE NOT n.is_deleted AND o.category_id IS DISTINCT FROM n.category_id
+                );
+            END IF;
+            RETURN NULL;
+        END $$''',
+        '''CREATE TRIGGER items_category_revision_insert AFTER INSERT ON items
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_item_category_revisions()''',
+        '''CREATE TRIGGER items_category_revision_delete AFTER DELETE ON items
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_item_category_revisions()''',
+        '''CREATE TRIGGER items_category_revision_update AFTER UPDATE ON items
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_item_category_revisions()''',
+    ]),
+    # Responses of requests sent with an Idempotency-Key, replayed to retries.
+    # status stays NULL while the first request is still running.
+    (8, [
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            headers TEXT,
+            body BYTEA,
+            created_at BIGINT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)',
+    ]),
+    # Ordering counters: the display_order of the last item appended to a
+    # category and of the last category appended to a list. An append bumps
+    # the counter with UPDATE ... RETURNING, whose row lock makes concurrent
+    # appends take turns instead of reading the same MAX(display_order). The
+    # triggers keep a counter from falling behind orders set any other way,
+    # e.g. a drag to the end of a category or a rebalance.
+    (9, [
+        'ALTER TABLE categories ADD COLUMN IF NOT EXISTS next_item_order INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE shopping_lists ADD COLUMN IF NOT EXISTS next_category_order INTEGER NOT NULL DEFAULT 0',
+        '''UPDATE categories c SET next_item_order = m.top
+            FROM (SELECT category_id, MAX(display_order) AS top FROM items GROUP BY category_id) m
+            WHERE c.id = m.category_id AND c.next_item_order < m.top''',
+        '''UPDATE shopping_lists l SET next_category_order = m.top
+            FROM (SELECT list_id, MAX(display_order) AS top FROM categories GROUP BY list_id) m
+            WHERE l.id = m.list_id AND l.next_category_order < m.top''',
+        '''CREATE OR REPLACE FUNCTION raise_item_order_counters() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE categories c SET next_item_order = m.top
+            FROM (SELECT category_id, MAX(display_order) AS top FROM new_rows GROUP BY category_id) m
+            WHERE c.id = m.category_id AND c.next_item_order < m.top;
+            RETURN NULL;
+        END $$''',
+        '''CREATE TRIGGER items_order_counter_insert AFTER INSERT ON items
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION raise_item_order_counters()''',
+        '''CREATE TRIGGER items_order_counter_update AFTER UPDATE ON items
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION raise_item_order_counters()''',
+        '''CREATE OR REPLACE FUNCTION raise_category_order_counters() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE shopping_lists l SET next_category_order = m.top
+            FROM (SELECT list_id, MAX(display_order) AS top FROM new_rows GROUP BY list_id) m
+            WHERE l.id = m.list_id AND l.next_category_order < m.top;
+            RETURN NULL;
+        END $$''',
+        '''CREATE TRIGGER categories_order_counter_insert AFTER INSERT ON categories
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION raise_category_order_counters()''',
+        '''CREATE TRIGGER categories_order_counter_update AFTER UPDATE ON categories
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION raise_category_order_counters()''',
+    ]),
+]
+
+# Arbitrary key for the advisory lock that serializes migrations across workers
+MIGRATION_LOCK_ID = 7310001
+
+
+def get_schema_version(cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(conn):
+    """Brings an existing database up to the latest schema version in place."""
+    cursor = conn.cursor()
+    for version, statements in MIGRATIONS:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+        if get_schema_version(cursor) >= version:
+            conn.rollback()
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_version (version) VALUES (%s)', (version,))
+        conn.commit()
+    cursor.close()
@@ -0,0 +1,112 @@
+import os
+from time import perf_counter
+
+from metrics import record_query
+
+# The backend comes from configuration: DATABASE_BACKEND if set, otherwise
+# Postgres whenever DATABASE_URL points at one, otherwise the local SQLite file.
+BACKEND = os.environ.get('DATABASE_BACKEND') or (
+    'postgres' if os.environ.get('DATABASE_URL', '').startswith(('postgres://', 'postgresql://')) else 'sqlite'
+)
+
+if BACKEND == 'postgres':
+    import database_pg as backend
+elif BACKEND == 'sqlite':
+    import database as backend
+else:
+    raise RuntimeError(f"Unknown DATABASE_BACKEND: {BACKEND}")
+
+
+class Connection:
+    """A checked-out connection of the configured backend.
+
+    Models write their SQL once, with ? placeholders and TRUE/FALSE literals;
+    the backend translates it and keeps prepared statements cached on the
+    underlying connection, so a pooled connection reuses them across requests.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def execute(self, sql, params=()):
+        started = perf_counter()
+        try:
+            return backend.execute(self.raw, sql, params)
+        finally:
+            record_query(sql, params, perf_counter() - started)
+
+    def executemany(self, sql, rows):
+        started = perf_counter()
+        try:
+            return backend.executemany(self.raw, sql, rows)
+        finally:
+            record_query(sql, (), perf_counter() - started)
+
+    def fetch_batches(self, sql, params=(), batch_size=500):
+        # The rows are read while the caller iterates, so the statement is timed across its batches
+        batches = backend.fetch_batches(self.raw, sql, params, batch_size)
+        elapsed = 0.0
+        try:
+            while True:
+                started = perf_counter()
+                batch = next(batches, None)
+                elapsed += perf_counter() - started
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            record_query(sql, params, elapsed)
+
+    def begin_snapshot(self):
+        backend.begin_snapshot(self.raw)
+
+    def after_commit(self, callback):
+        """Calls callback once the current transaction has committed, e.g. to update in-memory state."""
+        backend.after_commit(self.raw, callback)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+def get_db_connection():
+    return Connection(backend.get_db_connection())
+
+
+def _timed(kind, func, *args):
+    # The helpers build their own SQL, so they are counted as one statement of their own kind
+    started = perf_counter()
+    try:
+        return func(*args)
+    finally:
+        record_query(kind, (), perf_counter() - started, kind)
+
+
+def bulk_update(conn, table, columns, rows):
+    _timed('bulk_update', backend.bulk_update, conn.raw, table, columns, rows)
+
+
+def bulk_insert(conn, table, columns, rows, returning='id'):
+    return _timed('bulk_insert', backend.bulk_insert, conn.raw, table, columns, rows, returning)
+
+
+def search_items(conn, terms, list_id=None, limit=20, offset=0):
+    return _timed('search_items', backend.search_items, conn.raw, terms, list_id, limit, offset)
+
+
+def record_change(conn, entity, entity_ids, list_id=None):
+    _timed('record_change', backend.record_change, conn.raw, entity, entity_ids, list_id)
+
+
+# Decorates model methods that write, so the backend can choose where they run
+writes = backend.writes
+IntegrityError = backend.IntegrityError
+
+create_tables = backend.create_tables
+get_pool_stats = backend.get_pool_stats
+start_change_listener = backend.start_change_listener
@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _template_fingerprint():
+    # Part of every ETag, so a deploy that changes the markup invalidates clients' copies
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(TEMPLATE_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:8]
+
+
+TEMPLATE_FINGERPRINT = _template_fingerprint()
+
+
+def make_etag(kind, row_id, revision):
+    """A strong ETag derived from the owning list's revision, or None if the row has no list."""
+    if revision is None:
+        return None
+    return f'{kind}-{row_id}-r{revision}-{TEMPLATE_FINGERPRINT}'
+
+
+def with_etag(response, etag):
+    if etag:
+        response.set_etag(etag)
+        # Clients may keep the body but must revalidate it before every use
+        response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, request, response_class):
+    """A bodiless 304 if the client already holds this version, otherwise None.
+
+    request and response_class are Flask's or Quart's, whichever app is asking.
+    """
+    # If-None-Match compares weakly: the gzipped copy of a page carries W/"<etag>"
+    if etag and request.if_none_match.contains_weak(etag):
+        return with_etag(response_class('', 304), etag)
+    return None
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+
+# Seconds between keep-alive comments, and between revision checks that catch
+# writes made by other worker processes
+SSE_HEARTBEAT = 15
+# Streams one process of the threaded app keeps open at once. Each holds a
+# worker thread, so the cap stays below the thread count (gunicorn.conf.py
+# sets it to half) and the rest are left for ordinary requests.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 16))
+# Seconds a turned-away page is told to wait before opening a stream again
+SSE_RETRY_AFTER = int(os.environ.get('SSE_RETRY_AFTER', 30))
+
+
+class Broadcaster:
+    """Fans list change notifications out to the SSE streams open in this process.
+
+    Each stream gets its own small queue. A stream that falls behind only
+    misses intermediate notifications: the client fetches the delta from its
+    own revision, so the latest one is all it needs.
+    """
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._subscribers = {}  # list_id -> set of queues
+        self._lock = threading.Lock()
+
+    def subscribe(self, list_id, subscriber=None):
+        # The async app passes an asyncio.Queue and publishes from its event loop
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(int(list_id), set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, list_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(int(list_id))
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[int(list_id)]
+
+    def publish(self, list_id, revision, entity=None, entity_ids=()):
+        event = {'list_id': int(list_id), 'revision': revision, 'entity': entity, 'ids': list(entity_ids)}
+        with self._lock:
+            subscribers = list(self._subscribers.get(int(list_id), ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except (queue.Full, asyncio.QueueFull):
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {str(list_id): len(subscribers) for list_id, subscribers in self._subscribers.items()}
+
+
+broadcaster = Broadcaster()
+
+
+class StreamSlots:
+    """Counts the event streams open in this process and refuses any past the cap."""
+
+    def __init__(self, max_streams=SSE_MAX_STREAMS):
+        self.max_streams = max_streams
+        self.open = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.open >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'open': self.open, 'max': self.max_streams, 'rejected': self.rejected}
+
+
+stream_slots = StreamSlots()
+
+
+def format_event(event):
+    return f"id: {event['revision']}\nevent: change\ndata: {json.dumps(event)}\n\n"
+
+
+def revision_event(list_id, revision):
+    return {'list_id': int(list_id), 'revision': revision, 'entity': None, 'ids': []}
+
+
+def event_stream(list_id, since, get_revision):
+    """Yields SSE frames for one list until the client disconnects.
+
+    get_revision() reads the list's current revision from the database; it is
+    polled on every heartbeat so writes from other processes still arrive.
+    """
+    subscriber = broadcaster.subscribe(list_id)
+    last_sent = since
+    try:
+        yield 'retry: 3000\n\n'
+        # Catch up on anything written before the stream was opened
+        revision = get_revision()
+        if revision is not None and revision > last_sent:
+            last_sent = revision
+            yield format_event(revision_event(list_id, revision))
+        while True:
+            try:
+                event = subscriber.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                revision = get_revision()
+                if revision is None:
+                    return
+                if revision > last_sent:
+                    last_sent = revision
+                    yield format_event(revision_event(list_id, revision))
+                else:
+                    yield ': keep-alive\n\n'
+                continue
+            if event['revision'] > last_sent:
+                last_sent = event['revision']
+                yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(list_id, subscriber)
+
+
+async def async_event_stream(list_id, since, get_revision):
+    """event_stream() for the async app: an idle stream costs a coroutine, not a thread.
+
+    get_revision is a coroutine function.
+    """
+    subscriber = broadcaster.subscribe(list_id, asyncio.Queue(maxsize=broadcaster.queue_size))
+    last_sent = since
+    try:
+        yield 'retry: 3000\n\n'
+        revision = await get_revision()
+        if revision is not None and revision > last_sent:
+            last_sent = revision
+            yield format_event(revision_event(list_id, revision))
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                revision = await get_revision()
+                if revision is None:
+                    return
+                if revision > last_sent:
+                    last_sent = revision
+                    yield format_event(revision_event(list_id, revision))
+                else:
+                    yield ': keep-alive\n\n'
+                continue
+            if event['revision'] > last_sent:
+                last_sent = event['revision']
+                yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(list_id, subscriber)
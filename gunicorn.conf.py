@@ -0,0 +1,20 @@
+import os
+
+# Every open page holds a Server-Sent Events stream (/api/lists/<id>/events)
+# for as long as it stays open. A sync worker serves one request at a time, so
+# a single stream would block it; threaded workers give each stream its own
+# thread and leave the rest for ordinary requests.
+#
+# Streams are capped at SSE_MAX_STREAMS per worker so they can't take every
+# thread; pages turned away fall back to polling for changes. For more open
+# pages than workers x SSE_MAX_STREAMS, serve the async app instead, where an
+# idle stream costs no thread:
+#   hypercorn app_asgi:app --worker-class uvloop
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Half the threads for streams, half for the requests pages make; read by
+# events.py in each worker
+os.environ.setdefault('SSE_MAX_STREAMS', str(threads // 2))
+# Streams send a keep-alive comment every 15s; idle keep-alive connections close sooner
+keepalive = 5
@@ -0,0 +1,129 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+from cache import LRUCache
+from models.idempotency_key import IdempotencyKey
+
+# Clients that retry a write after a timeout send the same Idempotency-Key
+# header with every attempt. The first attempt claims the key in the
+# idempotency_keys table and its response is stored there; retries get that
+# response back instead of running the write again. Completed responses are
+# also kept in an in-process LRU, so most retries never reach the database.
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 1024))
+# A claim this old whose response never arrived belongs to a request that died
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+# Larger response bodies are not stored; retries get the status and headers only
+IDEMPOTENCY_MAX_BODY = int(os.environ.get('IDEMPOTENCY_MAX_BODY', 64 * 1024))
+# Expired keys are deleted after every this many claims in a process
+PURGE_EVERY = 500
+
+KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+# Request bodies the frameworks parse from a cached copy, so hashing them first is free
+HASHED_MIMETYPES = {'application/json', 'application/x-www-form-urlencoded'}
+# Its boundary changes with every send, so a multipart form is compared by its fields
+FORM_MIMETYPE = 'multipart/form-data'
+# Recomputed for every response, so never replayed
+UNSTORED_HEADERS = {'content-length', 'date', 'server', 'x-query-count'}
+
+PROCEED, REPLAY, CONFLICT, MISMATCH = 'proceed', 'replay', 'conflict', 'mismatch'
+
+StoredResponse = collections.namedtuple('StoredResponse', 'fingerprint status headers body created_at')
+
+
+def valid_key(key):
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+def encode_form(fields):
+    return urllib.parse.urlencode(sorted(fields)).encode()
+
+
+def fingerprint(method, path, body=b''):
+    """Identifies what a request asked for, so a key reused for a different request is caught."""
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, max_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL):
+        self.ttl = ttl
+        self.responses = LRUCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.replays = 0
+        self.conflicts = 0
+        self.mismatches = 0
+
+    def begin(self, key, request_fingerprint):
+        """Decides what to do with a request carrying `key`.
+
+        Returns (PROCEED, None) once the key is claimed for this request, which
+        must then call finish() or release(); (REPLAY, StoredResponse) for a
+        retry of a finished request; (CONFLICT, None) while the first attempt is
+        still running; (MISMATCH, None) if the key was used for another request.
+        """
+        now = int(time.time())
+        stored = self.responses.get(key)
+        if stored is None or stored.created_at < now - self.ttl:
+            if IdempotencyKey.claim(key, request_fingerprint, now, now - IDEMPOTENCY_LOCK_TIMEOUT, now - self.ttl):
+                self._claimed(now)
+                return PROCEED, None
+            row = IdempotencyKey.get(key)
+            if row is None or row['status'] is None:
+                # Still running, or released just now by a request that failed
+                return self._count(MISMATCH if row and row['fingerprint'] != request_fingerprint else CONFLICT), None
+            body = bytes(row['body']) if row['body'] is not None else None
+            stored = StoredResponse(row['fingerprint'], row['status'], json.loads(row['headers']), body, row['created_at'])
+            self.responses.set(key, stored)
+        if stored.fingerprint != request_fingerprint:
+            return self._count(MISMATCH), None
+        return self._count(REPLAY), stored
+
+    def finish(self, key, request_fingerprint, status, headers, body):
+        """Stores the response of a claimed request. Server errors free the key for a retry instead."""
+        if status >= 500:
+            self.release(key)
+            return
+        headers = [[name, value] for name, value in headers if name.lower() not in UNSTORED_HEADERS]
+        if body is not None and len(body) > IDEMPOTENCY_MAX_BODY:
+            body = None
+        IdempotencyKey.complete(key, status, json.dumps(headers), body)
+        self.responses.set(key, StoredResponse(request_fingerprint, status, headers, body, int(time.time())))
+
+    def release(self, key):
+        IdempotencyKey.release(key)
+
+    def _claimed(self, now):
+        with self._lock:
+            self.claims += 1
+            purge = self.claims % PURGE_EVERY == 0
+        if purge:
+            IdempotencyKey.purge(now - self.ttl)
+
+    def _count(self, outcome):
+        with self._lock:
+            if outcome == REPLAY:
+                self.replays += 1
+            elif outcome == CONFLICT:
+                self.conflicts += 1
+            elif outcome == MISMATCH:
+                self.mismatches += 1
+        return outcome
+
+    def stats(self):
+        with self._lock:
+            counts = {'claims': self.claims, 'replays': self.replays, 'conflicts': self.conflicts, 'mismatches': self.mismatches}
+        return {**counts, 'ttl': self.ttl, 'cache': self.responses.stats()}
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,299 @@
+import bisect
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+
+# Per-process request and query metrics, served in the Prometheus text format
+# on /metrics. Each worker process keeps its own numbers, so scrape the workers
+# individually (or sum them) when running several.
+
+# Statements slower than this many milliseconds are logged; 0 turns the log off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+# Adds an X-Query-Count header to every response (always on in debug mode)
+QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', '0') != '0'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+slow_query_log = logging.getLogger('shopping_list.slow_queries')
+
+
+class Histogram:
+    """A labelled Prometheus histogram: cumulative buckets, sum and count per label set."""
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+            cumulative += values[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {values[-1]:.6f}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time from the start of a request to its response.',
+    ('method', 'route', 'status')
+)
+request_db_time = Histogram(
+    'http_request_db_seconds', 'Time a request spent in database statements.', ('method', 'route')
+)
+request_render_time = Histogram(
+    'http_request_render_seconds', 'Time a request spent rendering templates.', ('method', 'route')
+)
+request_queries = Histogram(
+    'http_request_queries', 'Database statements run for one request.', ('method', 'route'), QUERY_COUNT_BUCKETS
+)
+query_duration = Histogram(
+    'db_query_duration_seconds', 'Time per database statement, by kind of statement.', ('statement',)
+)
+HISTOGRAMS = [request_duration, request_db_time, request_render_time, request_queries, query_duration]
+
+
+class RequestStats:
+    """What one request has spent so far; shared with the threads it hands work to."""
+
+    __slots__ = ('started', 'queries', 'db_time', 'render_time', 'render_started', 'finished', 'streaming')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+        self.finished = False
+        self.streaming = False
+
+
+# A context variable rather than a thread-local, so the stats follow a request
+# into the worker threads that Quart's run_sync and the SQLite writer use.
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def start_request():
+    _current.set(RequestStats())
+
+
+def current_request():
+    return _current.get()
+
+
+def finish_request(method, route, status):
+    """Records the current request once and returns its stats (None outside a request)."""
+    stats = _current.get()
+    if stats is None or stats.finished or stats.streaming:
+        return None
+    stats.finished = True
+    route = route or 'unmatched'
+    request_duration.observe(time.perf_counter() - stats.started, method, route, str(status))
+    request_db_time.observe(stats.db_time, method, route)
+    request_render_time.observe(stats.render_time, method, route)
+    request_queries.observe(stats.queries, method, route)
+    return stats
+
+
+def end_request():
+    _current.set(None)
+
+
+def stream_request(body, method, route, status=200):
+    """Wraps a streamed response body so its request is recorded once the body has been sent.
+
+    The view, after_request and teardown all run before a streamed body is
+    generated, so the templates it renders and the statements it runs would
+    otherwise go uncounted. Its X-Query-Count header is left out, since the
+    headers go out first. Returns the body as it is outside a request.
+    """
+    stats = _current.get()
+    if stats is None:
+        return body
+    stats.streaming = True
+    if hasattr(body, '__aiter__'):
+        return AsyncStreamedBody(body, stats, method, route, status)
+    return StreamedBody(body, stats, method, route, status)
+
+
+class _StreamedBodyBase:
+    """Makes a request's stats current while each chunk of its body is generated."""
+
+    def __init__(self, body, stats, method, route, status):
+        self.body = body
+        self.iterator = None
+        self.stats = stats
+        self.method = method
+        self.route = route
+        self.status = status
+
+    def _resume(self):
+        # Time spent waiting for the client to read a chunk is not render time
+        if self.stats.render_started is not None:
+            self.stats.render_started = time.perf_counter()
+        return _current.set(self.stats)
+
+    def _pause(self, token):
+        if self.stats.render_started is not None:
+            self.stats.render_time += time.perf_counter() - self.stats.render_started
+        _current.reset(token)
+
+    def _finish(self):
+        if self.stats.streaming:
+            self.stats.streaming = False
+            token = _current.set(self.stats)
+            finish_request(self.method, self.route, self.status)
+            _current.reset(token)
+
+
+class StreamedBody(_StreamedBodyBase):
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = self._resume()
+        try:
+            if self.iterator is None:
+                self.iterator = iter(self.body)
+            return next(self.iterator)
+        except StopIteration:
+            self._pause(token)
+            token = None
+            self._finish()
+            raise
+        except Exception:
+            self.status = 500
+            raise
+        finally:
+            if token is not None:
+                self._pause(token)
+
+    def close(self):
+        # Also reached when the client goes away, or for a body that was never read
+        token = self._resume()
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._pause(token)
+            self._finish()
+
+
+class AsyncStreamedBody(_StreamedBodyBase):
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        token = self._resume()
+        try:
+            if self.iterator is None:
+                self.iterator = self.body.__aiter__()
+            return await self.iterator.__anext__()
+        except StopAsyncIteration:
+            self._pause(token)
+            token = None
+            self._finish()
+            raise
+        except Exception:
+            self.status = 500
+            raise
+        finally:
+            if token is not None:
+                self._pause(token)
+
+    async def aclose(self):
+        token = self._resume()
+        try:
+            if hasattr(self.body, 'aclose'):
+                await self.body.aclose()
+        finally:
+            self._pause(token)
+            self._finish()
+
+
+def template_started(*args, **kwargs):
+    stats = _current.get()
+    if stats is not None:
+        stats.render_started = time.perf_counter()
+
+
+def template_finished(*args, **kwargs):
+    stats = _current.get()
+    if stats is not None and stats.render_started is not None:
+        stats.render_time += time.perf_counter() - stats.render_started
+        stats.render_started = None
+
+
+_STATEMENT_KIND = re.compile(r'\s*(\w+)')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def statement_kind(sql):
+    match = _STATEMENT_KIND.match(sql)
+    return match.group(1).lower() if match else 'other'
+
+
+def record_query(sql, params, elapsed, kind=None):
+    """Counts one statement against the current request and the query histogram."""
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    query_duration.observe(elapsed, kind or statement_kind(sql))
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning(
+            'slow query (%.1f ms): %s; params: %s', elapsed * 1000, redact(sql), redact_params(params)
+        )
+
+
+def redact(sql):
+    """The statement on one line, with any inline string literals blanked out."""
+    return ' '.join(_STRING_LITERAL.sub("'?'", sql).split())
+
+
+def redact_params(params):
+    # Only the types are logged; the values may be anything a user typed
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
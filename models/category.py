@@ -1,4 +1,5 @@
-from database import get_db_connection
+from db import get_db_connection, bulk_update, record_change, writes
+from ordering import ORDER_GAP, order_between, spaced_orders
 
 class Category:
     def __init__(self, name, list_id, id=None, display_order=0):
@@ -7,13 +8,15 @@ class Category:
         self.list_id = list_id
         self.display_order = display_order
 
+    @writes
     def save(self):
         conn = get_db_connection()
-        max_order = conn.execute('SELECT MAX(display_order) FROM categories WHERE list_id = ?', (self.list_id,)).fetchone()[0] or 0
-        self.display_order = max_order + 1
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO categories (name, display_order, list_id) VALUES (?, ?, ?)', (self.name, self.display_order, self.list_id))
-        self.id = cursor.lastrowid
+        self.display_order = Category.append_orders(conn, self.list_id)
+        self.id = conn.execute(
+            'INSERT INTO categories (name, display_order, list_id) VALUES (?, ?, ?) RETURNING id',
+            (self.name, self.display_order, self.list_id)
+        ).fetchone()[0]
+        record_change(conn, 'category', [self.id])
         conn.commit()
         conn.close()
 
@@ -34,35 +37,84 @@ class Category:
         return None
 
     @staticmethod
+    def get_by_name(list_id, name):
+        conn = get_db_connection()
+        category = conn.execute('SELECT * FROM categories WHERE list_id = ? AND name = ?', (list_id, name)).fetchone()
+        conn.close()
+        if category:
+            return Category(category['name'], category['list_id'], category['id'], category['display_order'])
+        return None
+
+    @staticmethod
+    @writes
     def update(category_id, new_name):
         conn = get_db_connection()
         conn.execute('UPDATE categories SET name = ? WHERE id = ?', (new_name, category_id))
+        record_change(conn, 'category', [category_id])
         conn.commit()
         conn.close()
 
     @staticmethod
+    @writes
     def update_order(category_ids):
         conn = get_db_connection()
-        cursor = conn.cursor()
-        for index, category_id in enumerate(category_ids):
-            cursor.execute('UPDATE categories SET display_order = ? WHERE id = ?', (index, category_id))
+        bulk_update(conn, 'categories', ['display_order'], zip([int(i) for i in category_ids], spaced_orders(len(category_ids))))
+        record_change(conn, 'category', category_ids)
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def append_orders(conn, list_id, count=1):
+        """Reserves the display_orders of `count` categories appended to a list and returns the first."""
+        row = conn.execute(
+            'UPDATE shopping_lists SET next_category_order = next_category_order + ? WHERE id = ? RETURNING next_category_order',
+            (ORDER_GAP * count, list_id)
+        ).fetchone()
+        last = row[0] if row else ORDER_GAP * count
+        return last - ORDER_GAP * (count - 1)
+
+    @staticmethod
+    def _neighbour_orders(conn, prev_id, next_id):
+        rows = conn.execute('SELECT id, display_order FROM categories WHERE id IN (?, ?)', (prev_id, next_id)).fetchall()
+        # Ids may arrive as strings from JSON, so compare them as strings
+        orders = {str(row['id']): row['display_order'] for row in rows}
+        return orders.get(str(prev_id)), orders.get(str(next_id))
+
+    @staticmethod
+    @writes
+    def move(category_id, prev_id=None, next_id=None):
+        """Places a category between two neighbours (either may be None) by rewriting only its own row."""
+        conn = get_db_connection()
+        new_order = order_between(*Category._neighbour_orders(conn, prev_id, next_id))
+        if new_order is None:
+            # The gap between the neighbours is used up, renumber the list once
+            list_id = conn.execute('SELECT list_id FROM categories WHERE id = ?', (category_id,)).fetchone()['list_id']
+            rows = conn.execute('SELECT id FROM categories WHERE list_id = ? ORDER BY display_order, id', (list_id,)).fetchall()
+            bulk_update(conn, 'categories', ['display_order'], zip([row['id'] for row in rows], spaced_orders(len(rows))))
+            new_order = order_between(*Category._neighbour_orders(conn, prev_id, next_id))
+        conn.execute('UPDATE categories SET display_order = ? WHERE id = ?', (new_order, category_id))
+        record_change(conn, 'category', [category_id])
         conn.commit()
         conn.close()
 
     @staticmethod
+    @writes
     def delete(category_id):
         conn = get_db_connection()
         # Find the "Other" category for the same list
         category_to_delete = Category.get_by_id(category_id)
         if not category_to_delete or category_to_delete.name == 'Other':
+            conn.close()
             return # Or handle error appropriately
 
-        other = conn.execute('SELECT id FROM categories WHERE name = "Other" AND list_id = ?', (category_to_delete.list_id,)).fetchone()
+        other = conn.execute('SELECT id FROM categories WHERE name = ? AND list_id = ?', ('Other', category_to_delete.list_id)).fetchone()
         if other:
             other_id = other['id']
             # Move items to the "Other" category before deleting
-            conn.execute('UPDATE items SET category_id = ? WHERE category_id = ?', (other_id, category_id))
+            moved = [row['id'] for row in conn.execute('UPDATE items SET category_id = ? WHERE category_id = ? RETURNING id', (other_id, category_id)).fetchall()]
+            record_change(conn, 'item', moved, list_id=category_to_delete.list_id)
         
         conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+        record_change(conn, 'category', [category_id], list_id=category_to_delete.list_id)
         conn.commit()
         conn.close()
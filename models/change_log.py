@@ -0,0 +1,71 @@
+from db import get_db_connection
+
+class ChangeLog:
+    @staticmethod
+    def get_since(list_id, since):
+        """Everything that changed in a list after revision `since`, or None if the list does not exist.
+
+        Changed items and categories are returned in their current state and
+        removed ones by id. 'reset' is set when the log no longer reaches back
+        to `since`, in which case the client has to reload the whole list.
+        """
+        conn = get_db_connection()
+        # Read the revision and the rows it describes from one snapshot
+        conn.begin_snapshot()
+        row = conn.execute('SELECT revision FROM shopping_lists WHERE id = ?', (list_id,)).fetchone()
+        if row is None:
+            conn.commit()
+            conn.close()
+            return None
+
+        delta = {
+            'revision': row['revision'], 'reset': False, 'items': [], 'deleted_items': [],
+            'categories': [], 'deleted_categories': [], 'lists': None,
+        }
+        if since >= delta['revision']:
+            conn.commit()
+            conn.close()
+            return delta
+
+        oldest = conn.execute('SELECT MIN(revision) FROM changes WHERE list_id = ?', (list_id,)).fetchone()[0]
+        if oldest is None or oldest > since + 1:
+            delta['reset'] = True
+            conn.commit()
+            conn.close()
+            return delta
+
+        changed = {'item': set(), 'category': set(), 'list': set()}
+        for change in conn.execute('SELECT DISTINCT entity, entity_id FROM changes WHERE list_id = ? AND revision > ?', (list_id, since)):
+            changed[change['entity']].add(change['entity_id'])
+
+        live_items = set()
+        for item in conn.execute('''
+            SELECT
+                i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it,
+                i.is_completed, i.display_order, c.id AS category_id, c.name AS category_name
+            FROM items i
+            JOIN categories c ON c.id = i.category_id
+            WHERE i.is_deleted = FALSE AND c.list_id = ? AND i.id IN
+                (SELECT entity_id FROM changes WHERE list_id = ? AND revision > ? AND entity = 'item')
+        ''', (list_id, list_id, since)):
+            live_items.add(item['id'])
+            delta['items'].append(dict(item))
+        delta['deleted_items'] = sorted(changed['item'] - live_items)
+
+        live_categories = set()
+        for category in conn.execute('''
+            SELECT id, name, display_order FROM categories
+            WHERE list_id = ? AND id IN
+                (SELECT entity_id FROM changes WHERE list_id = ? AND revision > ? AND entity = 'category')
+        ''', (list_id, list_id, since)):
+            live_categories.add(category['id'])
+            delta['categories'].append(dict(category))
+        delta['deleted_categories'] = sorted(changed['category'] - live_categories)
+
+        # The tabs show every list, so any list change sends the full set
+        if changed['list']:
+            delta['lists'] = [dict(l) for l in conn.execute('SELECT id, name FROM shopping_lists ORDER BY id')]
+
+        conn.commit()
+        conn.close()
+        return delta
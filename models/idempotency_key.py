@@ -0,0 +1,61 @@
+from db import get_db_connection, writes
+
+class IdempotencyKey:
+    @staticmethod
+    def get(key):
+        conn = get_db_connection()
+        row = conn.execute(
+            'SELECT key, fingerprint, status, headers, body, created_at FROM idempotency_keys WHERE key = ?', (key,)
+        ).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    @staticmethod
+    @writes
+    def claim(key, fingerprint, now, stale_before, expired_before):
+        """Reserves a key for the request about to run; False if another request holds it.
+
+        A key is free when it is new, when its response has expired, or when the
+        request that claimed it never finished (its worker died mid-request).
+        """
+        conn = get_db_connection()
+        claimed = conn.execute('''
+            INSERT INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO NOTHING RETURNING key
+        ''', (key, fingerprint, now)).fetchone()
+        if claimed is None:
+            claimed = conn.execute('''
+                UPDATE idempotency_keys SET fingerprint = ?, status = NULL, headers = NULL, body = NULL, created_at = ?
+                WHERE key = ? AND (created_at < ? OR (status IS NULL AND created_at < ?))
+                RETURNING key
+            ''', (fingerprint, now, key, expired_before, stale_before)).fetchone()
+        conn.commit()
+        conn.close()
+        return claimed is not None
+
+    @staticmethod
+    @writes
+    def complete(key, status, headers, body):
+        conn = get_db_connection()
+        conn.execute(
+            'UPDATE idempotency_keys SET status = ?, headers = ?, body = ? WHERE key = ?', (status, headers, body, key)
+        )
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    @writes
+    def release(key):
+        conn = get_db_connection()
+        conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL', (key,))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    @writes
+    def purge(expired_before):
+        conn = get_db_connection()
+        deleted = conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (expired_before,)).rowcount
+        conn.commit()
+        conn.close()
+        return deleted
@@ -1,4 +1,10 @@
-from database import get_db_connection
+import collections
+import re
+import time
+from db import get_db_connection, bulk_insert, bulk_update, record_change, search_items, writes
+from ordering import ORDER_GAP, encode_cursor, order_between, spaced_orders
+from suggest import item_names
+from models.category import Category
 
 class Item:
     def __init__(self, name, quantity, id=None, notes=None, who_needs_it=None, who_will_buy_it=None, category_id=None, display_order=0, is_completed=0):
@@ -12,41 +18,176 @@ class Item:
         self.display_order = display_order
         self.is_completed = is_completed
 
+    @writes
     def save(self):
         conn = get_db_connection()
         if self.id:
             conn.execute(
                 'UPDATE items SET name = ?, quantity = ?, notes = ?, who_needs_it = ?, who_will_buy_it = ?, category_id = ?, is_completed = ? WHERE id = ?',
-                (self.name, self.quantity, self.notes, self.who_needs_it, self.who_will_buy_it, self.category_id, self.is_completed, self.id)
+                (self.name, self.quantity, self.notes, self.who_needs_it, self.who_will_buy_it, self.category_id, bool(self.is_completed), self.id)
             )
         else:
-            max_order = conn.execute('SELECT MAX(display_order) FROM items WHERE category_id = ?', (self.category_id,)).fetchone()[0] or 0
-            self.display_order = max_order + 1
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO items (name, quantity, notes, who_needs_it, who_will_buy_it, category_id, display_order) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self.display_order = Item._append_orders(conn, self.category_id)
+            self.id = conn.execute(
+                'INSERT INTO items (name, quantity, notes, who_needs_it, who_will_buy_it, category_id, display_order) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id',
                 (self.name, self.quantity, self.notes, self.who_needs_it, self.who_will_buy_it, self.category_id, self.display_order)
-            )
-            self.id = cursor.lastrowid
+            ).fetchone()[0]
+            Item._remember_names(conn, [self.name])
+        record_change(conn, 'item', [self.id])
         conn.commit()
         conn.close()
 
+    ITEM_COLUMNS = '''
+        i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it,
+        i.is_completed, i.display_order,
+        c.id as category_id, c.name as category_name, c.display_order as category_order
+    '''
+
     @staticmethod
-    def get_all_for_list(list_id):
+    def get_all_for_list(list_id, after=None, limit=None):
+        """The list's items in page order, or with a limit one keyset page of them.
+
+        after is the (category display_order, category id, display_order, id)
+        of the last item of the previous page.
+        """
         conn = get_db_connection()
-        items_with_categories = conn.execute('''
-            SELECT
-                i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it,
-                i.is_completed, i.display_order,
-                c.id as category_id, c.name as category_name
+        keyset = 'AND (c.display_order, c.id, i.display_order, i.id) > (?, ?, ?, ?)' if after else ''
+        items_with_categories = conn.execute(f'''
+            SELECT {Item.ITEM_COLUMNS}
             FROM items i
             JOIN categories c ON i.category_id = c.id
-            WHERE i.is_deleted = 0 AND c.list_id = ?
-            ORDER BY c.display_order, i.display_order
-        ''', (list_id,)).fetchall()
+            WHERE i.is_deleted = FALSE AND c.list_id = ? {keyset}
+            ORDER BY c.display_order, c.id, i.display_order, i.id
+            {'LIMIT ?' if limit else ''}
+        ''', (list_id, *(after or ()), *([limit] if limit else []))).fetchall()
         conn.close()
         return items_with_categories
+
+    @staticmethod
+    def get_page(category_id, after=None, limit=50):
+        """Up to limit items of a category following the (display_order, id) in after.
+
+        Returns the items and the cursor of the page after them, or None if this was the last page.
+        """
+        conn = get_db_connection()
+        keyset = 'AND (i.display_order, i.id) > (?, ?)' if after else ''
+        rows = conn.execute(f'''
+            SELECT {Item.ITEM_COLUMNS}
+            FROM items i
+            JOIN categories c ON i.category_id = c.id
+            WHERE i.category_id = ? AND i.is_deleted = FALSE {keyset}
+            ORDER BY i.display_order, i.id
+            LIMIT ?
+        ''', (category_id, *(after or ()), limit + 1)).fetchall()
+        conn.close()
+        items = [dict(row) for row in rows[:limit]]
+        # One row more than asked for tells whether another page follows
+        next_cursor = encode_cursor(items[-1]['display_order'], items[-1]['id']) if len(rows) > limit else None
+        return items, next_cursor
     
+    @staticmethod
+    def export_batches(list_id, batch_size=500):
+        """Yields the list's items, with their category names, in page order and in lists of up to batch_size rows."""
+        conn = get_db_connection()
+        try:
+            conn.begin_snapshot()
+            yield from conn.fetch_batches('''
+                SELECT
+                    c.name AS category, i.name, i.quantity, i.notes, i.who_needs_it,
+                    i.who_will_buy_it, i.is_completed
+                FROM items i
+                JOIN categories c ON i.category_id = c.id
+                WHERE i.is_deleted = FALSE AND c.list_id = ?
+                ORDER BY c.display_order, i.display_order
+            ''', (list_id,), batch_size)
+        finally:
+            conn.close()
+
+    @staticmethod
+    @writes
+    def import_rows(list_id, rows):
+        """Appends rows of (category, name, quantity, notes, who_needs_it, who_will_buy_it, is_completed) to a list.
+
+        Categories are matched by name and created when missing. Returns the new item ids.
+        """
+        if not rows:
+            return []
+        conn = get_db_connection()
+        try:
+            categories = {}
+            for row in conn.execute('SELECT id, name FROM categories WHERE list_id = ? ORDER BY display_order DESC', (list_id,)):
+                categories[row['name']] = row['id']
+
+            missing = list(dict.fromkeys(row[0] for row in rows if row[0] not in categories))
+            if missing:
+                first_order = Category.append_orders(conn, list_id, len(missing))
+                created = bulk_insert(
+                    conn, 'categories', ['name', 'display_order', 'list_id'],
+                    [(name, first_order + ORDER_GAP * index, list_id) for index, name in enumerate(missing)],
+                    returning='id, name'
+                )
+                categories.update((row[1], row[0]) for row in created)
+                record_change(conn, 'category', [row[0] for row in created], list_id=list_id)
+
+            # One counter bump per category reserves the orders of the whole chunk
+            counts = collections.Counter(categories[row[0]] for row in rows)
+            next_order = {category_id: Item._append_orders(conn, category_id, count) for category_id, count in counts.items()}
+            values = []
+            for category, name, quantity, notes, who_needs_it, who_will_buy_it, is_completed in rows:
+                category_id = categories[category]
+                values.append((name, quantity, notes, who_needs_it, who_will_buy_it, bool(is_completed), category_id, next_order[category_id]))
+                next_order[category_id] += ORDER_GAP
+
+            ids = [row[0] for row in bulk_insert(
+                conn, 'items',
+                ['name', 'quantity', 'notes', 'who_needs_it', 'who_will_buy_it', 'is_completed', 'category_id', 'display_order'],
+                values
+            )]
+            record_change(conn, 'item', ids, list_id=list_id)
+            Item._remember_names(conn, [row[1] for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        return ids
+
+    @staticmethod
+    def _remember_names(conn, names):
+        # The suggester only learns a name once the write storing it has committed
+        names = list(names)
+
+        def add_names():
+            for name in names:
+                item_names.add(name)
+        conn.after_commit(add_names)
+
+    @staticmethod
+    def name_counts(limit):
+        """The limit most used item names, counting deleted and archived items, as (name, uses) pairs."""
+        conn = get_db_connection()
+        rows = conn.execute('''
+            SELECT name, COUNT(*) AS uses
+            FROM (SELECT name FROM items UNION ALL SELECT name FROM items_archive) AS history
+            GROUP BY name
+            ORDER BY uses DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.close()
+        return [(row[0], row[1]) for row in rows]
+
+    # Words of a search query beyond this many are ignored
+    SEARCH_MAX_TERMS = 8
+
+    @staticmethod
+    def search(query, list_id=None, limit=20, offset=0):
+        """Items matching every word of query as a prefix, across all lists unless list_id is given, best first."""
+        terms = re.findall(r'\w+', query)[:Item.SEARCH_MAX_TERMS]
+        if not terms:
+            return []
+        conn = get_db_connection()
+        rows = search_items(conn, terms, list_id, limit, offset)
+        conn.close()
+        return [dict(row, is_completed=bool(row['is_completed'])) for row in rows]
+
     @staticmethod
     def get_by_id(item_id):
         conn = get_db_connection()
@@ -57,56 +198,261 @@ class Item:
         return None
         
     @staticmethod
+    @writes
     def update(item_id, name, quantity, notes, who_needs_it, who_will_buy_it, category_id, is_completed):
         conn = get_db_connection()
         conn.execute(
             'UPDATE items SET name = ?, quantity = ?, notes = ?, who_needs_it = ?, who_will_buy_it = ?, category_id = ?, is_completed = ? WHERE id = ?',
-            (name, quantity, notes, who_needs_it, who_will_buy_it, category_id, is_completed, item_id)
+            (name, quantity, notes, who_needs_it, who_will_buy_it, category_id, bool(is_completed), item_id)
         )
+        record_change(conn, 'item', [item_id])
         conn.commit()
         conn.close()
     
     @staticmethod
+    @writes
     def update_name(item_id, name):
         conn = get_db_connection()
         conn.execute('UPDATE items SET name = ? WHERE id = ?', (name, item_id))
+        record_change(conn, 'item', [item_id])
+        Item._remember_names(conn, [name])
         conn.commit()
         conn.close()
 
     @staticmethod
+    @writes
     def toggle_completed(item_id, is_completed):
         conn = get_db_connection()
-        conn.execute('UPDATE items SET is_completed = ? WHERE id = ?', (is_completed, item_id))
+        conn.execute('UPDATE items SET is_completed = ? WHERE id = ?', (bool(is_completed), item_id))
+        record_change(conn, 'item', [item_id])
         conn.commit()
         conn.close()
 
     @staticmethod
+    @writes
     def clear_completed(list_id):
         conn = get_db_connection()
-        conn.execute('''
-            UPDATE items SET is_deleted = 1 
-            WHERE is_completed = 1 AND category_id IN 
+        cleared = [row['id'] for row in conn.execute('''
+            UPDATE items SET is_deleted = TRUE, deleted_at = ?
+            WHERE is_completed = TRUE AND is_deleted = FALSE AND category_id IN
             (SELECT id FROM categories WHERE list_id = ?)
-        ''', (list_id,))
+            RETURNING id
+        ''', (int(time.time()), list_id)).fetchall()]
+        record_change(conn, 'item', cleared, list_id=list_id)
         conn.commit()
         conn.close()
         
     @staticmethod
+    @writes
     def update_order_and_category(item_id, new_category_id, sibling_ids):
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE items SET category_id = ? WHERE id = ?', (new_category_id, item_id))
-        
-        for index, sibling_id in enumerate(sibling_ids):
-            cursor.execute('UPDATE items SET display_order = ? WHERE id = ?', (index, sibling_id))
-            
+        conn.execute('UPDATE items SET category_id = ? WHERE id = ?', (new_category_id, item_id))
+        bulk_update(conn, 'items', ['display_order'], zip([int(i) for i in sibling_ids], spaced_orders(len(sibling_ids))))
+        record_change(conn, 'item', [item_id])
         conn.commit()
         conn.close()
 
     @staticmethod
+    def _append_orders(conn, category_id, count=1):
+        """Reserves the display_orders of `count` items appended to a category and returns the first.
+
+        Bumping the category's counter replaces a MAX(display_order) scan, and on
+        Postgres the row lock it takes makes concurrent appends get distinct orders.
+        """
+        row = conn.execute(
+            'UPDATE categories SET next_item_order = next_item_order + ? WHERE id = ? RETURNING next_item_order',
+            (ORDER_GAP * count, category_id)
+        ).fetchone()
+        last = row[0] if row else ORDER_GAP * count
+        return last - ORDER_GAP * (count - 1)
+
+    @staticmethod
+    def _neighbour_orders(conn, prev_id, next_id):
+        rows = conn.execute('SELECT id, display_order FROM items WHERE id IN (?, ?)', (prev_id, next_id)).fetchall()
+        # Ids may arrive as strings from JSON, so compare them as strings
+        orders = {str(row['id']): row['display_order'] for row in rows}
+        return orders.get(str(prev_id)), orders.get(str(next_id))
+
+    @staticmethod
+    def _rebalance(conn, category_id):
+        rows = conn.execute('SELECT id FROM items WHERE category_id = ? AND is_deleted = FALSE ORDER BY display_order, id', (category_id,)).fetchall()
+        bulk_update(conn, 'items', ['display_order'], zip([row['id'] for row in rows], spaced_orders(len(rows))))
+
+    @staticmethod
+    def _target_orders(conn, item_id, category_id, prev_id, next_id):
+        prev_order, next_order = Item._neighbour_orders(conn, prev_id, next_id)
+        if next_id is None and prev_order is not None:
+            # The client may have loaded only the first pages of the category, so
+            # a drop after its last item means right after prev, not the very end
+            row = conn.execute('''
+                SELECT display_order FROM items
+                WHERE category_id = ? AND is_deleted = FALSE AND id != ? AND (display_order, id) > (?, ?)
+                ORDER BY display_order, id LIMIT 1
+            ''', (category_id, int(item_id), prev_order, int(prev_id))).fetchone()
+            next_order = row['display_order'] if row else None
+        elif prev_order is None and next_order is None:
+            # Dropped into a category with none of its items loaded: it goes ahead
+            # of them, where the client shows it, instead of reusing the first order
+            row = conn.execute(
+                'SELECT MIN(display_order) FROM items WHERE category_id = ? AND is_deleted = FALSE AND id != ?',
+                (category_id, int(item_id))
+            ).fetchone()
+            next_order = row[0]
+        return prev_order, next_order
+
+    @staticmethod
+    def _move(conn, item_id, new_category_id, prev_id, next_id):
+        """Places an item between its new neighbours; returns False if it already sits there."""
+        prev_order, next_order = Item._target_orders(conn, item_id, new_category_id, prev_id, next_id)
+        current = conn.execute('SELECT category_id, display_order FROM items WHERE id = ?', (item_id,)).fetchone()
+        if (current is not None and current['display_order'] is not None and str(current['category_id']) == str(new_category_id)
+                and (prev_order is None or prev_order < current['display_order'])
+                and (next_order is None or current['display_order'] < next_order)):
+            return False
+        new_order = order_between(prev_order, next_order)
+        if new_order is None:
+            # The gap between the neighbours is used up, renumber the category once
+            Item._rebalance(conn, new_category_id)
+            new_order = order_between(*Item._target_orders(conn, item_id, new_category_id, prev_id, next_id))
+        conn.execute('UPDATE items SET category_id = ?, display_order = ? WHERE id = ?', (new_category_id, new_order, item_id))
+        return True
+
+    @staticmethod
+    @writes
+    def move(item_id, new_category_id, prev_id=None, next_id=None):
+        """Places an item between two neighbours (either may be None) by rewriting only its own row."""
+        conn = get_db_connection()
+        Item._move(conn, item_id, new_category_id, prev_id, next_id)
+        record_change(conn, 'item', [item_id])
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    @writes
+    def apply_batch(operations):
+        """Applies a list of item mutations in one transaction.
+
+        Each operation is a dict with an "op" of toggle, rename, move or delete
+        and an item "id". Each kind touches its own columns, so toggles, renames
+        and deletes are grouped into one bulk update each (the last operation on
+        an item wins); moves depend on their neighbours and run in order.
+
+        Every operation sets an absolute value, and ones that would change
+        nothing (or target an item that is gone) are skipped, so a client that
+        resends a batch after a lost response leaves the list as it was.
+        Malformed operations, and moves into a category that is not in the
+        item's list, are rejected one by one without holding up the rest.
+
+        Returns the ids of the items it changed and a list of
+        {'index', 'error'} for the operations it rejected.
+        """
+        toggles, renames, deletes, moves, rejected = {}, {}, set(), [], []
+        for index, operation in enumerate(operations):
+            try:
+                kind, item_id = operation['op'], int(operation['id'])
+                if kind == 'toggle':
+                    toggles[item_id] = bool(operation['is_completed'])
+                elif kind == 'rename':
+                    if not isinstance(operation['name'], str) or not operation['name'].strip():
+                        raise ValueError("name must be a non-empty string")
+                    renames[item_id] = operation['name']
+                elif kind == 'delete':
+                    deletes.add(item_id)
+                elif kind == 'move':
+                    prev_id, next_id = operation.get('prev_id'), operation.get('next_id')
+                    moves.append((
+                        index, item_id, int(operation['category_id']),
+                        None if prev_id is None else int(prev_id), None if next_id is None else int(next_id),
+                    ))
+                else:
+                    raise ValueError(f"Unknown batch operation: {kind}")
+            except KeyError as e:
+                rejected.append({'index': index, 'error': f"missing {e}"})
+            except (TypeError, ValueError) as e:
+                rejected.append({'index': index, 'error': str(e)})
+
+        conn = get_db_connection()
+        try:
+            ids = list({*toggles, *renames, *deletes, *(move[1] for move in moves)})
+            live = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for row in conn.execute(f'''
+                    SELECT i.id, i.name, i.is_completed, c.list_id FROM items i JOIN categories c ON c.id = i.category_id
+                    WHERE i.id IN ({', '.join(['?'] * len(chunk))}) AND i.is_deleted = FALSE
+                ''', chunk):
+                    live[row['id']] = row
+            category_ids = list({move[2] for move in moves})
+            category_lists = {}
+            for start in range(0, len(category_ids), 500):
+                chunk = category_ids[start:start + 500]
+                for row in conn.execute(f"SELECT id, list_id FROM categories WHERE id IN ({', '.join(['?'] * len(chunk))})", chunk):
+                    category_lists[row['id']] = row['list_id']
+            toggles = {item_id: value for item_id, value in toggles.items() if item_id in live and bool(live[item_id]['is_completed']) != value}
+            renames = {item_id: name for item_id, name in renames.items() if item_id in live and live[item_id]['name'] != name}
+            deletes = {item_id for item_id in deletes if item_id in live}
+            bulk_update(conn, 'items', ['is_completed'], toggles.items())
+            bulk_update(conn, 'items', ['name'], renames.items())
+            bulk_update(conn, 'items', ['is_deleted', 'deleted_at'], [(item_id, True, int(time.time())) for item_id in deletes])
+            moved = set()
+            for index, item_id, category_id, prev_id, next_id in moves:
+                if item_id not in live or item_id in deletes:
+                    continue
+                if category_lists.get(category_id) != live[item_id]['list_id']:
+                    # Deleted by someone else, or never part of this list
+                    rejected.append({'index': index, 'error': f"category {category_id} is not in the item's list"})
+                    continue
+                if Item._move(conn, item_id, category_id, prev_id, next_id):
+                    moved.add(item_id)
+            changed = {*toggles, *renames, *deletes, *moved}
+            record_change(conn, 'item', changed)
+            Item._remember_names(conn, renames.values())
+            conn.commit()
+        finally:
+            conn.close()
+        rejected.sort(key=lambda rejection: rejection['index'])
+        return changed, rejected
+
+    @staticmethod
+    @writes
     def delete(item_id):
         conn = get_db_connection()
-        conn.execute('UPDATE items SET is_deleted = 1 WHERE id = ?', (item_id,))
+        conn.execute('UPDATE items SET is_deleted = TRUE, deleted_at = ? WHERE id = ?', (int(time.time()), item_id))
+        record_change(conn, 'item', [item_id])
         conn.commit()
         conn.close()
+
+    # Columns copied into items_archive, in order
+    ARCHIVE_COLUMNS = 'id, name, quantity, notes, who_needs_it, who_will_buy_it, is_completed, category_id, display_order, deleted_at'
+
+    @staticmethod
+    @writes
+    def compact_batch(deleted_before, batch_size, archive=True):
+        """Removes up to batch_size items deleted before the given Unix time, copying them to items_archive unless archive is False.
+
+        Returns the number of rows removed.
+        """
+        conn = get_db_connection()
+        try:
+            ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM items WHERE is_deleted = TRUE AND deleted_at <= ? ORDER BY id LIMIT ?',
+                (deleted_before, batch_size)
+            ).fetchall()]
+            if not ids:
+                return 0
+            # DELETE ... RETURNING only hands back rows this call removed, so
+            # two compactions racing over the same ids cannot archive a row twice.
+            rows = conn.execute(
+                f"DELETE FROM items WHERE id IN ({', '.join(['?'] * len(ids))}) AND is_deleted = TRUE RETURNING {Item.ARCHIVE_COLUMNS}",
+                ids
+            ).fetchall()
+            if archive and rows:
+                archived_at = int(time.time())
+                conn.executemany(
+                    f"INSERT INTO items_archive ({Item.ARCHIVE_COLUMNS}, archived_at) VALUES ({', '.join(['?'] * 11)})",
+                    [tuple(row) + (archived_at,) for row in rows]
+                )
+            conn.commit()
+            return len(rows)
+        finally:
+            conn.close()
@@ -0,0 +1,242 @@
+import itertools
+from db import get_db_connection
+from ordering import encode_cursor
+from models.category import Category
+from models.shopping_list import ShoppingList
+
+class ListSnapshot:
+    """Everything the index page needs: all lists plus the active list's categories with their items."""
+
+    def __init__(self, lists, active_list_id, categories, grouped_items, revision=0, collapsed=frozenset()):
+        self.lists = lists
+        self.active_list_id = active_list_id
+        self.categories = categories
+        self.grouped_items = grouped_items
+        self.revision = revision
+        # Ids of the categories rendered without their items
+        self.collapsed = collapsed
+        # Set by a streamed snapshot whose list changed before its items were read
+        self.stale = False
+
+    @staticmethod
+    def revision_query(list_id=None, category_id=None, item_id=None):
+        """The (sql, params) reading the revision of the list owning the given row.
+
+        Shared with the async app, which runs it on its own driver.
+        """
+        if item_id is not None:
+            return '''
+                SELECT s.revision FROM items i
+                JOIN categories c ON c.id = i.category_id
+                JOIN shopping_lists s ON s.id = c.list_id
+                WHERE i.id = ?
+            ''', (item_id,)
+        if category_id is not None:
+            return '''
+                SELECT s.revision FROM categories c
+                JOIN shopping_lists s ON s.id = c.list_id
+                WHERE c.id = ?
+            ''', (category_id,)
+        return 'SELECT revision FROM shopping_lists WHERE id = ?', (list_id,)
+
+    @staticmethod
+    def get_revision(list_id=None, category_id=None, item_id=None):
+        """The current revision of the list owning the given row, or None if the row does not exist."""
+        conn = get_db_connection()
+        row = conn.execute(*ListSnapshot.revision_query(list_id, category_id, item_id)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    GROUPED_COLUMNS = '''
+        c.id AS category_id, c.name AS category_name, c.display_order AS category_order, c.revision AS category_revision,
+        i.id, i.name, i.quantity, i.notes, i.who_needs_it, i.who_will_buy_it, i.is_completed, i.display_order
+    '''
+
+    @staticmethod
+    def group_rows(rows):
+        """Categories with their items from GROUPED_COLUMNS rows ordered by category."""
+        return list(ListSnapshot.iter_groups(rows))
+
+    @staticmethod
+    def iter_groups(rows):
+        """Like group_rows(), but yields each category as soon as its last row has been read."""
+        category = None
+        # Each new category_id starts a new group
+        for row in rows:
+            if category is None or category['id'] != row['category_id']:
+                if category is not None:
+                    yield category
+                category = {
+                    'id': row['category_id'], 'name': row['category_name'], 'display_order': row['category_order'],
+                    'revision': row['category_revision'], 'items': [],
+                }
+            if row['id'] is not None:
+                category['items'].append({
+                    'id': row['id'], 'name': row['name'], 'quantity': row['quantity'], 'notes': row['notes'],
+                    'who_needs_it': row['who_needs_it'], 'who_will_buy_it': row['who_will_buy_it'],
+                    'is_completed': row['is_completed'], 'display_order': row['display_order'],
+                    'category_id': row['category_id'], 'category_name': row['category_name'],
+                })
+        if category is not None:
+            yield category
+
+    # Shared with the async app, like revision_query()
+    CATEGORY_REVISION_QUERY = 'SELECT revision FROM categories WHERE id = ?'
+
+    @staticmethod
+    def get_category_revision(category_id):
+        """The revision of a category's own markup, or None if the category does not exist."""
+        conn = get_db_connection()
+        row = conn.execute(ListSnapshot.CATEGORY_REVISION_QUERY, (category_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    @staticmethod
+    def paginate(grouped_items, page_size, budget=None, collapsed=frozenset()):
+        """Trims each category of grouped_items to what a first paint shows, yielding it once trimmed.
+
+        Each category keeps at most page_size items, and once budget items are
+        shown across the page the remaining categories keep none. Categories
+        whose id is in collapsed keep none either and are marked 'collapsed'.
+        A category that was cut short gets the cursor its next page is fetched
+        from in 'next_cursor' ('' if none of its items were shown); the others
+        get None.
+        """
+        remaining = budget
+        for category in grouped_items:
+            items = category['items']
+            category['collapsed'] = category['id'] in collapsed
+            shown = page_size if remaining is None else max(0, min(page_size, remaining))
+            if category['collapsed']:
+                shown = 0
+            category['next_cursor'] = None
+            if len(items) > shown:
+                last = items[shown - 1] if shown else None
+                category['next_cursor'] = encode_cursor(last['display_order'], last['id']) if last else ''
+                category['items'] = items[:shown]
+            if remaining is not None:
+                remaining -= len(category['items'])
+            yield category
+
+    @staticmethod
+    def load_category(category_id, page_size=None):
+        """One category with its items (the first page_size of them), shaped like an entry of grouped_items, or None."""
+        conn = get_db_connection()
+        rows = conn.execute(f'''
+            SELECT {ListSnapshot.GROUPED_COLUMNS}
+            FROM categories c
+            LEFT JOIN (
+                SELECT * FROM items WHERE category_id = ? AND is_deleted = FALSE
+                ORDER BY display_order, id {'LIMIT ?' if page_size else ''}
+            ) i ON i.category_id = c.id
+            WHERE c.id = ?
+            ORDER BY i.display_order, i.id
+        ''', (category_id, *([page_size + 1] if page_size else []), category_id)).fetchall()
+        conn.close()
+        grouped_items = ListSnapshot.group_rows(rows)
+        if page_size:
+            grouped_items = list(ListSnapshot.paginate(grouped_items, page_size))
+        return grouped_items[0] if grouped_items else None
+
+    @staticmethod
+    def grouped_query(list_id, page_size=None):
+        """The (sql, params) reading a list's categories with their items as GROUPED_COLUMNS rows."""
+        if page_size:
+            # One short index scan per category finds the order of its (page_size + 1)th
+            # item, so only the items up to there are read, however long the list
+            return f'''
+                WITH c AS MATERIALIZED (
+                    SELECT categories.*, (
+                        SELECT MAX(display_order) FROM (
+                            SELECT display_order FROM items
+                            WHERE category_id = categories.id AND is_deleted = FALSE
+                            ORDER BY display_order, id LIMIT ?
+                        ) AS first_items
+                    ) AS last_order
+                    FROM categories WHERE list_id = ?
+                )
+                SELECT {ListSnapshot.GROUPED_COLUMNS}
+                FROM c
+                LEFT JOIN items i ON i.category_id = c.id AND i.is_deleted = FALSE AND i.display_order <= c.last_order
+                ORDER BY c.display_order, c.id, i.display_order, i.id
+            ''', (page_size + 1, list_id)
+        return f'''
+            SELECT {ListSnapshot.GROUPED_COLUMNS}
+            FROM categories c
+            LEFT JOIN items i ON i.category_id = c.id AND i.is_deleted = FALSE
+            WHERE c.list_id = ?
+            ORDER BY c.display_order, c.id, i.display_order, i.id
+        ''', (list_id,)
+
+    @staticmethod
+    def _read_lists(conn, list_id):
+        """All lists, the id of the one to show and its revision."""
+        list_rows = conn.execute('SELECT * FROM shopping_lists ORDER BY id').fetchall()
+        lists = [ShoppingList(l['name'], l['id']) for l in list_rows]
+        revisions = {l['id']: l['revision'] for l in list_rows}
+
+        # Fall back to the first list if the requested one no longer exists
+        active_list_id = int(list_id) if list_id else None
+        if lists and active_list_id not in revisions:
+            active_list_id = lists[0].id
+        return lists, active_list_id, revisions.get(active_list_id, 0)
+
+    @staticmethod
+    def load(list_id, page_size=None, budget=None, collapsed=frozenset()):
+        """The index page's data; with a page_size, only what its first paint shows (see paginate())."""
+        conn = get_db_connection()
+        # Read both queries from one consistent snapshot of the database
+        conn.begin_snapshot()
+        lists, active_list_id, revision = ListSnapshot._read_lists(conn, list_id)
+        grouped_items = ListSnapshot.group_rows(conn.execute(*ListSnapshot.grouped_query(active_list_id, page_size)))
+        if page_size:
+            grouped_items = list(ListSnapshot.paginate(grouped_items, page_size, budget, collapsed))
+        categories = [Category(g['name'], active_list_id, g['id'], g['display_order']) for g in grouped_items]
+        conn.commit()
+        conn.close()
+        return ListSnapshot(lists, active_list_id, categories, grouped_items, revision, collapsed)
+
+    @staticmethod
+    def stream(list_id, page_size=None, budget=None, batch_size=100, collapsed=frozenset()):
+        """Like load(), but the categories are read while grouped_items is iterated.
+
+        grouped_items is a generator over a server-side cursor and categories
+        fills up as it runs, so a page can go out while its later categories are
+        still being read, without the whole list ever sitting in memory. Nothing
+        is held open until grouped_items is first iterated.
+        """
+        conn = get_db_connection()
+        lists, active_list_id, revision = ListSnapshot._read_lists(conn, list_id)
+        conn.close()
+        snapshot = ListSnapshot(lists, active_list_id, [], [], revision, collapsed)
+        if lists:
+            snapshot.grouped_items = snapshot._stream_groups(page_size, budget, batch_size)
+        return snapshot
+
+    def _stream_groups(self, page_size, budget, batch_size):
+        conn = get_db_connection()
+        batches = None
+        try:
+            conn.begin_snapshot()
+            # A write between reading the lists and the items shows up early, which
+            # syncing from self.revision repeats harmlessly; only caching must not happen
+            row = conn.execute(*ListSnapshot.revision_query(self.active_list_id)).fetchone()
+            self.stale = row is None or row[0] != self.revision
+            batches = conn.fetch_batches(*ListSnapshot.grouped_query(self.active_list_id, page_size), batch_size)
+            grouped_items = ListSnapshot.iter_groups(itertools.chain.from_iterable(batches))
+            if page_size:
+                grouped_items = ListSnapshot.paginate(grouped_items, page_size, budget, self.collapsed)
+            for category in grouped_items:
+                self.categories.append(Category(category['name'], self.active_list_id, category['id'], category['display_order']))
+                yield category
+            conn.commit()
+        finally:
+            # The cursor goes first: the connection may be handed to another request once closed
+            if batches is not None:
+                batches.close()
+            conn.close()
+
+    def close(self):
+        """Stops reading a streamed snapshot's items early, handing back its connection."""
+        if hasattr(self.grouped_items, 'close'):
+            self.grouped_items.close()
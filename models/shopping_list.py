@@ -1,15 +1,15 @@
-from database import get_db_connection
+from db import get_db_connection, record_change, writes
 
 class ShoppingList:
     def __init__(self, name, id=None):
         self.id = id
         self.name = name
 
+    @writes
     def save(self):
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO shopping_lists (name) VALUES (?)', (self.name,))
-        self.id = cursor.lastrowid
+        self.id = conn.execute('INSERT INTO shopping_lists (name) VALUES (?) RETURNING id', (self.name,)).fetchone()[0]
+        record_change(conn, 'list', [self.id])
         conn.commit()
         conn.close()
 
@@ -30,15 +30,19 @@ class ShoppingList:
         return None
 
     @staticmethod
+    @writes
     def update_name(list_id, new_name):
         conn = get_db_connection()
         conn.execute('UPDATE shopping_lists SET name = ? WHERE id = ?', (new_name, list_id))
+        record_change(conn, 'list', [list_id])
         conn.commit()
         conn.close()
 
     @staticmethod
+    @writes
     def delete(list_id):
         conn = get_db_connection()
         conn.execute('DELETE FROM shopping_lists WHERE id = ?', (list_id,))
+        record_change(conn, 'list', [list_id])
         conn.commit()
         conn.close()
@@ -0,0 +1,37 @@
+# Items and categories are ordered by sparse integer keys, so a drag only has
+# to rewrite the moved row. Siblings are renumbered only when a gap runs out.
+ORDER_GAP = 1024
+
+
+def order_between(prev_order, next_order):
+    """Returns a display_order strictly between two neighbours (either may be None), or None if there is no room."""
+    if prev_order is None and next_order is None:
+        return ORDER_GAP
+    if prev_order is None:
+        return next_order - ORDER_GAP
+    if next_order is None:
+        return prev_order + ORDER_GAP
+    if next_order - prev_order > 1:
+        return (prev_order + next_order) // 2
+    return None
+
+
+def spaced_orders(count):
+    """The display_order values a rebalance assigns to `count` siblings."""
+    return [(index + 1) * ORDER_GAP for index in range(count)]
+
+
+# Pages of items are read by keyset: a cursor holds the sort key of the last
+# row already sent, and the next page starts strictly after it. Unlike OFFSET,
+# this costs the same on every page and skips or repeats nothing when rows
+# before the cursor are added or removed in between.
+def encode_cursor(*values):
+    return ':'.join(str(value) for value in values)
+
+
+def decode_cursor(cursor, size):
+    """The sort key in a cursor made by encode_cursor(); raises ValueError if it is malformed."""
+    values = tuple(int(value) for value in cursor.split(':'))
+    if len(values) != size:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
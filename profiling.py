@@ -0,0 +1,233 @@
+import cProfile
+import collections
+import datetime
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+# On-demand profiling of live workers. An operator arms it through the
+# token-protected /admin/profile endpoint; the request is written to a control
+# file that every worker process checks at most once per PROFILE_POLL_INTERVAL,
+# so all gunicorn workers follow it, whichever one took the request. Armed
+# workers profile their next N matching requests and write one file per request
+# to PROFILE_DIR. Without PROFILE_TOKEN the endpoint and the hooks are off;
+# /admin/stats takes the same token.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_POLL_INTERVAL = float(os.environ.get('PROFILE_POLL_INTERVAL', 1))
+# An armed profile that hasn't run out of requests is dropped after this many seconds
+PROFILE_TTL = float(os.environ.get('PROFILE_TTL', 600))
+PROFILE_MAX_REQUESTS = 1000
+MODES = {'cprofile', 'sample'}
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+CONTROL_FILE = 'control.json'
+
+
+class InvalidProfileRequest(ValueError):
+    pass
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer and counts the collapsed stacks.
+
+    Unlike cProfile it costs the profiled thread nothing per call, so timings
+    stay realistic; the output is the collapsed-stack format that flamegraph.pl
+    and speedscope read.
+    """
+
+    def __init__(self, thread_id, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            # A sample taken while stop() was called would only show the profiler itself
+            if stack and not self._stop.is_set():
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class Session:
+    """One profiled request."""
+
+    def __init__(self, mode, interval, label):
+        self.mode = mode
+        self.label = label
+        self.started = time.perf_counter()
+        if mode == 'cprofile':
+            # cProfile only sees the thread it was enabled on, i.e. this request's
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = StackSampler(threading.get_ident(), interval)
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        return time.perf_counter() - self.started
+
+
+class Profiler:
+    """This worker's view of the control file, and the requests it profiles."""
+
+    def __init__(self, directory=PROFILE_DIR, token=PROFILE_TOKEN):
+        self.directory = directory
+        self.token = token
+        self.enabled = bool(token)
+        self.control_path = os.path.join(directory, CONTROL_FILE)
+        self._lock = threading.Lock()
+        self._next_poll = 0.0
+        self._control_mtime = None
+        self._control_id = None
+        self.pid = os.getpid()
+        self.config = None
+        self.remaining = 0
+        self.expires_at = 0.0
+        self.active = False
+        self.busy = False
+        self.written = []
+
+    def check_token(self, header):
+        """True if an Authorization header carries the profiling token."""
+        scheme, _, token = (header or '').partition(' ')
+        return self.enabled and scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def arm(self, requests=10, route=None, mode='cprofile', interval_ms=None):
+        """Tells every worker to profile its next `requests` requests (to `route`, if given)."""
+        try:
+            requests = int(requests)
+            interval = float(interval_ms) / 1000 if interval_ms is not None else DEFAULT_SAMPLE_INTERVAL
+        except (TypeError, ValueError):
+            raise InvalidProfileRequest("requests and interval_ms must be numbers")
+        if not 1 <= requests <= PROFILE_MAX_REQUESTS:
+            raise InvalidProfileRequest(f"requests must be between 1 and {PROFILE_MAX_REQUESTS}")
+        if mode not in MODES:
+            raise InvalidProfileRequest(f"mode must be one of: {', '.join(sorted(MODES))}")
+        if not 0.001 <= interval <= 1:
+            raise InvalidProfileRequest("interval_ms must be between 1 and 1000")
+        control = {
+            'id': uuid.uuid4().hex, 'requests': requests, 'route': route or None, 'mode': mode,
+            'interval': interval, 'expires_at': time.time() + PROFILE_TTL,
+        }
+        self._write_control(control)
+        return control
+
+    def disarm(self):
+        self._write_control({'id': uuid.uuid4().hex, 'requests': 0})
+
+    def _write_control(self, control):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written whole and renamed into place, so no worker reads half a file
+        temporary = f'{self.control_path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(control, f)
+        os.replace(temporary, self.control_path)
+        self._next_poll = 0.0
+
+    def poll(self):
+        """Picks up a changed control file; costs a clock read between polls."""
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        with self._lock:
+            self._next_poll = now + PROFILE_POLL_INTERVAL
+            try:
+                mtime = os.stat(self.control_path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._control_mtime and self.pid == os.getpid():
+                return
+            self._control_mtime = mtime
+            try:
+                with open(self.control_path) as f:
+                    control = json.load(f)
+            except (OSError, ValueError):
+                return
+            if control.get('id') == self._control_id and self.pid == os.getpid():
+                return
+            # A forked worker starts its own count, even for a profile armed before the fork
+            self.pid = os.getpid()
+            self._control_id = control.get('id')
+            self.config = control
+            self.remaining = control.get('requests', 0)
+            self.expires_at = control.get('expires_at', 0)
+            self.active = self.remaining > 0 and self.expires_at > time.time()
+
+    def start(self, route, path):
+        """A Session if this request should be profiled, otherwise None."""
+        if not self.active:
+            return None
+        config = self.config
+        if config['route'] and config['route'] not in (route, path):
+            return None
+        with self._lock:
+            if self.remaining <= 0 or self.expires_at <= time.time():
+                self.active = False
+                return None
+            # One request at a time, so concurrent requests don't skew each other's profile
+            if self.busy:
+                return None
+            self.busy = True
+            self.remaining -= 1
+            self.active = self.remaining > 0
+        return Session(config['mode'], config['interval'], route or path)
+
+    def finish(self, session):
+        elapsed = session.stop()
+        with self._lock:
+            self.busy = False
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', session.label).strip('_') or 'index'
+        extension = 'prof' if session.mode == 'cprofile' else 'collapsed'
+        path = os.path.join(self.directory, f'{slug}-{stamp}-pid{os.getpid()}-{elapsed * 1000:.0f}ms.{extension}')
+        if session.mode == 'cprofile':
+            session.profiler.dump_stats(path)
+        else:
+            session.profiler.write(path)
+        with self._lock:
+            self.written = (self.written + [path])[-50:]
+        return path
+
+    def status(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'pid': os.getpid(),
+                'active': self.active,
+                'remaining': self.remaining if self.active else 0,
+                'config': self.config,
+                'written': list(self.written),
+            }
+
+
+profiler = Profiler()
@@ -18,6 +18,245 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // --- Delta Sync ---
+    // The page remembers the list revision it was rendered at. After a change we
+    // fetch only what changed since then and patch the DOM instead of reloading.
+    const listContainer = document.getElementById('list-container');
+    let listRevision = listContainer ? Number(listContainer.dataset.revision) : 0;
+    let syncQueue = Promise.resolve();
+
+    function elementFromHtml(html) {
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        return template.content.firstElementChild;
+    }
+
+    // Places element among its siblings according to data-display-order
+    function insertByOrder(parent, selector, element) {
+        const order = Number(element.dataset.displayOrder);
+        const next = Array.from(parent.querySelectorAll(`:scope > ${selector}`))
+            .find(sibling => sibling !== element && Number(sibling.dataset.displayOrder) > order);
+        parent.insertBefore(element, next || parent.querySelector(':scope > .load-more'));
+    }
+
+    // Like insertByOrder, but an item that sorts after everything loaded so far
+    // in a partly loaded category is left for its page to bring in
+    function insertItem(list, element) {
+        const order = Number(element.dataset.displayOrder);
+        const loadedAfter = Array.from(list.querySelectorAll(':scope > .sortable-item'))
+            .some(sibling => sibling !== element && Number(sibling.dataset.displayOrder) > order);
+        if (!loadedAfter && list.querySelector(':scope > .load-more')) return;
+        insertByOrder(list, '.sortable-item', element);
+    }
+
+    function syncCategoryOption(category) {
+        const select = document.getElementById('item-category_id');
+        if (!select) return;
+        let option = select.querySelector(`option[value="${category.id}"]`);
+        if (!option) {
+            option = document.createElement('option');
+            option.value = category.id;
+            select.appendChild(option);
+        }
+        option.textContent = category.name;
+    }
+
+    // A category with more changed items than this is swapped whole, as one
+    // server-rendered (and usually cached) fragment, rather than patched item by item
+    const CATEGORY_SWAP_THRESHOLD = 20;
+
+    function swapCategory(categoryId) {
+        return fetch(`/category/${categoryId}/fragment`)
+            .then(res => res.ok ? res.text() : Promise.reject(res))
+            .then(html => {
+                const group = listContainer.querySelector(`.category-group[data-category-id="${categoryId}"]`);
+                if (!group) return;
+                const fresh = elementFromHtml(html);
+                initItemSortable(fresh.querySelector('.item-list'));
+                restoreCollapsed(fresh);
+                group.replaceWith(fresh);
+                fresh.querySelectorAll('.load-more').forEach(watchLoadMore);
+            });
+    }
+
+    function applyDelta(delta) {
+        if (delta.reset) {
+            location.reload();
+            return;
+        }
+
+        delta.deleted_categories.forEach(id => {
+            const group = listContainer.querySelector(`.category-group[data-category-id="${id}"]`);
+            if (group) group.remove();
+            const option = document.querySelector(`#item-category_id option[value="${id}"]`);
+            if (option) option.remove();
+        });
+        delta.categories.forEach(category => {
+            let group = listContainer.querySelector(`.category-group[data-category-id="${category.id}"]`);
+            if (group) {
+                group.querySelector('.category-name').textContent = category.name;
+                group.dataset.displayOrder = category.display_order;
+            } else {
+                group = elementFromHtml(category.html);
+                initItemSortable(group.querySelector('.item-list'));
+                const placeholder = listContainer.querySelector(':scope > p');
+                if (placeholder) placeholder.remove();
+            }
+            insertByOrder(listContainer, '.category-group', group);
+            syncCategoryOption(category);
+        });
+
+        delta.deleted_items.forEach(id => {
+            const element = listContainer.querySelector(`.sortable-item[data-item-id="${id}"]`);
+            if (element) element.remove();
+        });
+        const changedPerCategory = {};
+        delta.items.forEach(item => {
+            changedPerCategory[item.category_id] = (changedPerCategory[item.category_id] || 0) + 1;
+        });
+        const swapped = Object.keys(changedPerCategory)
+            .filter(id => changedPerCategory[id] > CATEGORY_SWAP_THRESHOLD)
+            .filter(id => listContainer.querySelector(`.category-group[data-category-id="${id}"]`));
+        delta.items.forEach(item => {
+            // Items inside a category about to be swapped stay until the swap replaces them
+            const existing = listContainer.querySelector(`.sortable-item[data-item-id="${item.id}"]`);
+            if (existing && !swapped.includes(existing.closest('.item-list').dataset.categoryId)) existing.remove();
+            if (swapped.includes(String(item.category_id))) return;
+            const list = listContainer.querySelector(`.item-list[data-category-id="${item.category_id}"]`);
+            if (list) insertItem(list, elementFromHtml(item.html));
+        });
+
+        if (delta.lists) {
+            const tabs = document.querySelectorAll('.list-tabs .tab[data-list-id]');
+            const sameLists = tabs.length === delta.lists.length &&
+                delta.lists.every(l => document.querySelector(`.list-tabs .tab[data-list-id="${l.id}"]`));
+            if (!sameLists) {
+                // Lists were added or removed, the tab bar needs a full render
+                location.reload();
+                return;
+            }
+            delta.lists.forEach(l => {
+                document.querySelector(`.list-tabs .tab[data-list-id="${l.id}"]`).textContent = l.name;
+            });
+        }
+
+        listRevision = delta.revision;
+        // The fragments are at least as new as the delta; a failed swap falls back to a reload
+        return Promise.all(swapped.map(swapCategory)).catch(() => location.reload());
+    }
+
+    function syncChanges() {
+        if (!listContainer) return Promise.resolve();
+        // Syncs run one after another, each starting from the revision the previous one reached
+        syncQueue = syncQueue
+            .then(() => fetch(`/api/lists/${listContainer.dataset.listId}/changes?since=${listRevision}`))
+            .then(res => res.json())
+            .then(applyDelta)
+            // Server markup may have replaced items with edits still waiting to be sent
+            .then(() => editQueue.replay())
+            .catch(() => {});
+        return syncQueue;
+    }
+
+    // Shows a queued edit on the page; applying one that is already shown changes nothing
+    function applyEdit(operation) {
+        const element = listContainer && listContainer.querySelector(`.sortable-item[data-item-id="${operation.id}"]`);
+        if (!element) return;
+        if (operation.op === 'toggle') {
+            element.classList.toggle('completed', Boolean(operation.is_completed));
+            element.querySelector('.item-completed-checkbox').checked = Boolean(operation.is_completed);
+        } else if (operation.op === 'rename') {
+            // Absent while the name is being edited inline
+            const name = element.querySelector('.item-name');
+            if (name) name.textContent = operation.name;
+        } else if (operation.op === 'delete') {
+            element.remove();
+        } else if (operation.op === 'move') {
+            const list = listContainer.querySelector(`.item-list[data-category-id="${operation.category_id}"]`);
+            if (!list) return;
+            const prev = operation.prev_id && list.querySelector(`:scope > .sortable-item[data-item-id="${operation.prev_id}"]`);
+            const next = operation.next_id && list.querySelector(`:scope > .sortable-item[data-item-id="${operation.next_id}"]`);
+            if (prev) {
+                if (prev.nextElementSibling !== element) prev.after(element);
+            } else if (next) {
+                if (next.previousElementSibling !== element) next.before(element);
+            } else if (element.parentElement !== list) {
+                list.insertBefore(element, list.querySelector(':scope > .load-more'));
+            }
+        }
+    }
+
+    // Toggles, renames, drags and deletes go through the offline queue (offline.js);
+    // the server's answer comes back through the delta sync like anyone else's edit.
+    const editQueue = new EditQueue({ endpoint: '/batch', apply: applyEdit, onFlushed: () => syncChanges() });
+
+    // Other people's edits arrive as server-sent events carrying the new revision.
+    // A server with no stream to spare answers 503, which closes the EventSource
+    // for good; the page then polls for changes and tries a stream again later.
+    const STREAM_RETRY_INTERVAL = 30000;
+    const CHANGES_POLL_INTERVAL = 10000;
+
+    function listenForChanges() {
+        const events = new EventSource(`/api/lists/${listContainer.dataset.listId}/events?since=${listRevision}`);
+        events.addEventListener('change', e => {
+            if (JSON.parse(e.data).revision > listRevision) syncChanges();
+        });
+        events.addEventListener('error', () => {
+            // A dropped stream reconnects by itself; only a refused one ends up closed
+            if (events.readyState !== EventSource.CLOSED) return;
+            const poll = setInterval(syncChanges, CHANGES_POLL_INTERVAL);
+            setTimeout(() => {
+                clearInterval(poll);
+                listenForChanges();
+            }, STREAM_RETRY_INTERVAL);
+        });
+    }
+
+    if (listContainer && window.EventSource) listenForChanges();
+
+    // Sends a form-style request but asks for JSON, so the server skips its redirect to /.
+    // A request sent again with the same idempotencyKey is answered without repeating the write.
+    function postForJson(url, body, idempotencyKey) {
+        const headers = { 'Accept': 'application/json' };
+        if (idempotencyKey) headers['Idempotency-Key'] = idempotencyKey;
+        return fetch(url, {
+            method: 'POST',
+            headers: headers,
+            body: body
+        });
+    }
+
+    // --- Item Name Suggestions ---
+    // Names used before are offered as the user types, most used first
+    const itemNameField = document.getElementById('item-name');
+    const itemNameSuggestions = document.getElementById('item-name-suggestions');
+    let suggestTimer = null;
+
+    if (itemNameField && itemNameSuggestions) {
+        itemNameField.addEventListener('input', () => {
+            clearTimeout(suggestTimer);
+            const prefix = itemNameField.value.trim();
+            if (!prefix) {
+                itemNameSuggestions.replaceChildren();
+                return;
+            }
+            suggestTimer = setTimeout(() => {
+                fetch(`/api/suggest?prefix=${encodeURIComponent(prefix)}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        // Ignore answers for a prefix the user has already typed past
+                        if (data.prefix !== itemNameField.value.trim()) return;
+                        itemNameSuggestions.replaceChildren(...data.suggestions.map(name => {
+                            const option = document.createElement('option');
+                            option.value = name;
+                            return option;
+                        }));
+                    })
+                    .catch(() => {});
+            }, 100);
+        });
+    }
+
     // --- Modal Logic ---
     function openModal(modal) {
         if (modal == null) return;
@@ -69,52 +308,43 @@ document.addEventListener('DOMContentLoaded', () => {
     document.addEventListener('change', e => {
         if (e.target.matches('.item-completed-checkbox')) {
             const checkbox = e.target;
-            const itemId = checkbox.dataset.itemId;
-            const isCompleted = checkbox.checked ? 1 : 0;
-            fetch(`/toggle_completed/${itemId}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ is_completed: isCompleted })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    const itemElement = checkbox.closest('.sortable-item');
-                    if (checkbox.checked) {
-                        itemElement.classList.add('completed');
-                    } else {
-                        itemElement.classList.remove('completed');
-                    }
-                }
-            });
+            editQueue.enqueue(
+                { op: 'toggle', id: Number(checkbox.dataset.itemId), is_completed: checkbox.checked },
+                !checkbox.checked
+            );
         }
     });
 
     // --- SortableJS for Items ---
-    document.querySelectorAll('.item-list').forEach(list => {
+    function initItemSortable(list) {
         new Sortable(list, {
             group: 'items',
             animation: 150,
+            draggable: '.sortable-item',
             filter: '.item-completed-checkbox, .edit-item-btn, .add-sub-item-btn, a', // Ignore clicks on interactive elements
             onEnd: handleSortableEnd
         });
-    });
+    }
+
+    document.querySelectorAll('.item-list').forEach(initItemSortable);
 
     // --- SortableJS for Categories ---
-    const listContainer = document.getElementById('list-container');
     if (listContainer) {
         new Sortable(listContainer, {
             animation: 150,
             handle: 'h3',
             onEnd: function(evt) {
-                const categoryIds = [];
-                listContainer.querySelectorAll('.category-group').forEach(group => {
-                    categoryIds.push(group.dataset.categoryId);
-                });
+                const group = evt.item;
+                const prev = group.previousElementSibling;
+                const next = group.nextElementSibling;
                 fetch('/update_category_order', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ category_ids: categoryIds })
+                    body: JSON.stringify({
+                        category_id: group.dataset.categoryId,
+                        prev_id: prev && prev.matches('.category-group') ? prev.dataset.categoryId : null,
+                        next_id: next && next.matches('.category-group') ? next.dataset.categoryId : null
+                    })
                 });
             }
         });
@@ -123,23 +353,121 @@ document.addEventListener('DOMContentLoaded', () => {
     function handleSortableEnd(evt) {
         const item = evt.item;
         const newCategoryId = evt.to.closest('.category-group').dataset.categoryId || null;
-        
-        const siblingIds = [];
-        evt.to.querySelectorAll('.sortable-item').forEach(sibling => {
-            siblingIds.push(sibling.dataset.itemId);
+        // Items not loaded yet come after the "load more" row, so it stays last
+        const more = evt.to.querySelector(':scope > .load-more');
+        if (more) evt.to.appendChild(more);
+
+        // Only the neighbours are sent, so the server rewrites just the moved row.
+        // Dropped after the last loaded item, there is no next; the server then
+        // places it right after prev, ahead of any items not loaded yet.
+        const prev = item.previousElementSibling;
+        const next = item.nextElementSibling && item.nextElementSibling.matches('.sortable-item') ? item.nextElementSibling : null;
+
+        editQueue.enqueue({
+            op: 'move',
+            id: Number(item.dataset.itemId),
+            category_id: Number(newCategoryId),
+            prev_id: prev ? Number(prev.dataset.itemId) : null,
+            next_id: next ? Number(next.dataset.itemId) : null
         });
+    }
 
-        fetch('/update_item_and_order', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                item_id: item.dataset.itemId,
-                new_category_id: newCategoryId,
-                sibling_ids: siblingIds
-            })
+    // --- Collapsible Categories ---
+    // Collapsed categories are remembered per browser in a cookie, so the server
+    // renders them without their items. A collapsed category fetches its items
+    // only once it is opened again.
+    const collapsedCookie = document.cookie.split('; ').find(cookie => cookie.startsWith('collapsed_categories='));
+    const collapsedCategories = new Set(collapsedCookie ? collapsedCookie.split('=')[1].split('.').filter(Boolean) : []);
+
+    function saveCollapsed() {
+        const value = Array.from(collapsedCategories).join('.');
+        document.cookie = `collapsed_categories=${value}; path=/; max-age=${value ? 31536000 : 0}; SameSite=Lax`;
+    }
+
+    function setCollapsed(group, collapsed) {
+        group.classList.toggle('collapsed', collapsed);
+        const button = group.querySelector('.collapse-category-btn');
+        button.setAttribute('aria-expanded', String(!collapsed));
+        button.title = collapsed ? 'Expand' : 'Collapse';
+    }
+
+    function restoreCollapsed(group) {
+        if (collapsedCategories.has(group.dataset.categoryId)) setCollapsed(group, true);
+    }
+
+    document.querySelectorAll('.category-group').forEach(restoreCollapsed);
+
+    document.addEventListener('click', e => {
+        const button = e.target.closest('.collapse-category-btn');
+        if (!button) return;
+        const group = button.closest('.category-group');
+        const collapsed = !group.classList.contains('collapsed');
+        setCollapsed(group, collapsed);
+        if (collapsed) {
+            collapsedCategories.add(group.dataset.categoryId);
+        } else {
+            collapsedCategories.delete(group.dataset.categoryId);
+        }
+        saveCollapsed();
+    });
+
+    // --- Lazy Loading ---
+    // Long lists arrive with only their first items. The "load more" row at the
+    // end of a partly loaded category fetches its next page as it nears the
+    // viewport (or when its category is expanded), so scrolling loads the rest.
+    const loadMoreObserver = window.IntersectionObserver ? new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) loadMore(entry.target);
         });
+    }, { rootMargin: '400px' }) : null;
+
+    const LOAD_MORE_RETRY_DELAY = 5000;
+
+    function watchLoadMore(sentinel) {
+        if (loadMoreObserver) {
+            loadMoreObserver.observe(sentinel);
+        } else {
+            loadMore(sentinel);
+        }
+    }
+
+    function loadMore(sentinel) {
+        if (sentinel.dataset.loading) return;
+        sentinel.dataset.loading = 'true';
+        const list = sentinel.closest('.item-list');
+        const cursor = sentinel.dataset.cursor;
+        fetch(`/category/${list.dataset.categoryId}/items` + (cursor ? `?after=${encodeURIComponent(cursor)}` : ''))
+            .then(res => res.ok ? res.text() : Promise.reject(res))
+            .then(html => {
+                if (loadMoreObserver) loadMoreObserver.unobserve(sentinel);
+                // Replaced meanwhile, e.g. by a category swap
+                if (!sentinel.isConnected) return;
+                const template = document.createElement('template');
+                template.innerHTML = html;
+                template.content.querySelectorAll('.sortable-item').forEach(element => {
+                    // The newer copy wins if a sync or a drag already placed this item
+                    const existing = listContainer.querySelector(`.sortable-item[data-item-id="${element.dataset.itemId}"]`);
+                    if (existing) existing.remove();
+                });
+                sentinel.replaceWith(template.content);
+                const next = list.querySelector(':scope > .load-more');
+                if (next) watchLoadMore(next);
+                editQueue.replay();
+            })
+            .catch(() => {
+                // Observing afresh re-checks the row, so one still in view tries again
+                setTimeout(() => {
+                    delete sentinel.dataset.loading;
+                    if (loadMoreObserver && sentinel.isConnected) {
+                        loadMoreObserver.unobserve(sentinel);
+                        loadMoreObserver.observe(sentinel);
+                    }
+                }, LOAD_MORE_RETRY_DELAY);
+            });
     }
 
+    document.querySelectorAll('.item-list > .load-more').forEach(watchLoadMore);
+
     // --- Edit/Add Item Forms ---
     const itemModal = document.getElementById('modal-item');
     const itemForm = document.getElementById('item-form');
@@ -204,8 +532,8 @@ document.addEventListener('DOMContentLoaded', () => {
     if (itemForm) {
         itemForm.addEventListener('submit', e => {
             const url = itemForm.action;
+            e.preventDefault();
             if (url.includes('/update_item/')) {
-                e.preventDefault();
                 const formData = new FormData(itemForm);
                 const data = Object.fromEntries(formData.entries());
                 data.is_completed = itemForm.querySelector('#item-is_completed').checked ? 1 : 0;
@@ -214,11 +542,40 @@ document.addEventListener('DOMContentLoaded', () => {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify(data)
-                }).then(() => location.reload());
+                }).then(() => {
+                    closeModal(itemModal);
+                    syncChanges();
+                });
+            } else {
+                // A second submit after a lost response reuses the key, so it can't add the item twice
+                itemForm.dataset.idempotencyKey = itemForm.dataset.idempotencyKey || EditQueue.newKey();
+                postForJson(url, new FormData(itemForm), itemForm.dataset.idempotencyKey).then(() => {
+                    // Answered, so the next submit is a new item rather than a retry of this one
+                    delete itemForm.dataset.idempotencyKey;
+                    closeModal(itemModal);
+                    syncChanges();
+                });
             }
         });
     }
 
+    // --- Delete Item / Clear Completed ---
+    document.addEventListener('click', e => {
+        const deleteLink = e.target.closest('.delete-icon');
+        if (deleteLink) {
+            e.preventDefault();
+            editQueue.enqueue({ op: 'delete', id: Number(deleteLink.closest('.sortable-item').dataset.itemId) });
+        }
+    });
+
+    const clearCompletedForm = document.querySelector('form[action$="/clear_completed"]');
+    if (clearCompletedForm) {
+        clearCompletedForm.addEventListener('submit', e => {
+            e.preventDefault();
+            postForJson(clearCompletedForm.action, new FormData(clearCompletedForm)).then(syncChanges);
+        });
+    }
+
     // --- Inline Item Name Editing ---
     document.addEventListener('click', e => {
         if (e.target.matches('.item-name')) {
@@ -233,19 +590,16 @@ document.addEventListener('DOMContentLoaded', () => {
             itemNameElement.replaceWith(input);
             input.focus();
 
+            let saved = false;
             function saveName() {
+                // Enter is followed by a blur; save once
+                if (saved) return;
+                saved = true;
                 const newName = input.value;
+                input.replaceWith(itemNameElement);
                 if (newName && newName !== currentName) {
-                    fetch(`/update_item_name/${itemId}`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ name: newName })
-                    }).then(() => {
-                        input.replaceWith(itemNameElement);
-                        itemNameElement.textContent = newName;
-                    });
-                } else {
-                    input.replaceWith(itemNameElement);
+                    itemNameElement.textContent = newName;
+                    editQueue.enqueue({ op: 'rename', id: Number(itemId), name: newName }, currentName);
                 }
             }
 
@@ -254,6 +608,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (e.key === 'Enter') {
                     saveName();
                 } else if (e.key === 'Escape') {
+                    saved = true;
                     input.replaceWith(itemNameElement);
                 }
             });
@@ -311,7 +666,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (confirm('Are you sure you want to delete this category? All items will be moved to "Other".')) {
                 fetch(`/delete_category/${categoryId}`, {
                     method: 'POST'
-                }).then(() => location.reload());
+                }).then(syncChanges);
             }
         }
     });
@@ -342,7 +697,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ name: newName })
-            }).then(() => location.reload());
+            }).then(() => {
+                closeModal(editListModal);
+                syncChanges();
+            });
         });
     }
 
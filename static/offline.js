@@ -0,0 +1,198 @@
+// --- Offline Edit Queue ---
+// Item edits are applied to the page straight away and kept in IndexedDB until
+// the server has them, so a flaky connection never loses or blocks an edit.
+// Repeated edits to the same item coalesce: only the latest value of each field
+// is kept, and an edit that restores the value the server already has (toggle
+// on, then off) cancels out. The queue is sent to /batch in one request, retried
+// with backoff while offline, and resent after a reload if it never arrived.
+// Every operation carries an absolute value, so sending one twice is harmless,
+// and a resent batch carries the same Idempotency-Key, so the server answers it
+// from the first attempt's response instead of writing again. Edits the server
+// rejects are dropped one by one: it reports them by index and applies the
+// rest, and a batch refused as a whole is split until the bad edit is alone.
+class EditQueue {
+    constructor({ endpoint = '/batch', apply = () => {}, onFlushed = () => {} } = {}) {
+        this.endpoint = endpoint;
+        this.apply = apply;
+        this.onFlushed = onFlushed;
+        this.records = new Map();  // key -> { key, seq, operation, base }
+        this.seq = 0;
+        this.flushing = false;
+        this.timer = null;
+        this.retryDelay = EditQueue.MIN_RETRY_DELAY;
+        this.batchLimit = EditQueue.MAX_BATCH;
+        this.batchSignature = null;
+        this.batchKey = null;
+        this.db = null;
+        this.ready = this.load();
+
+        window.addEventListener('online', () => this.flush());
+        // Try once more while the page is still alive
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') this.flush();
+        });
+    }
+
+    // Loads edits left over from an earlier visit; without IndexedDB the queue lives in memory only
+    load() {
+        return EditQueue.openDatabase()
+            .then(db => {
+                this.db = db;
+                return new Promise((resolve, reject) => {
+                    const request = db.transaction(EditQueue.STORE).objectStore(EditQueue.STORE).getAll();
+                    request.onsuccess = () => resolve(request.result);
+                    request.onerror = () => reject(request.error);
+                });
+            })
+            .then(records => {
+                records.forEach(record => {
+                    // Edits made on this page before the database opened win
+                    if (!this.records.has(record.key)) this.records.set(record.key, record);
+                    this.seq = Math.max(this.seq, record.seq);
+                });
+                this.replay();
+                this.schedule(0);
+            })
+            .catch(() => {});
+    }
+
+    static openDatabase() {
+        return new Promise((resolve, reject) => {
+            if (!window.indexedDB) {
+                reject(new Error('IndexedDB is not available'));
+                return;
+            }
+            const request = indexedDB.open(EditQueue.DATABASE, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore(EditQueue.STORE, { keyPath: 'key' });
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    // Writes through to IndexedDB; the in-memory map is what the page works from
+    store(method, value) {
+        if (!this.db) return;
+        try {
+            this.db.transaction(EditQueue.STORE, 'readwrite').objectStore(EditQueue.STORE)[method](value);
+        } catch (e) {
+            // A full or closed database only costs persistence across reloads
+        }
+    }
+
+    // Records an edit and applies it to the page. base is the value the item had
+    // before the first queued edit of this field, used to spot edits that cancel out.
+    enqueue(operation, base) {
+        const key = `${operation.op}:${operation.id}`;
+        if (operation.op === 'delete') {
+            // Nothing else about a deleted item matters any more
+            ['toggle', 'rename', 'move'].forEach(op => this.remove(`${op}:${operation.id}`));
+        } else if (this.records.has(`delete:${operation.id}`)) {
+            return;
+        }
+
+        const existing = this.records.get(key);
+        const original = existing ? existing.base : base;
+        this.apply(operation);
+        if (original !== undefined && EditQueue.valueOf(operation) === original) {
+            this.remove(key);
+        } else {
+            const record = { key, seq: ++this.seq, operation, base: original };
+            this.records.set(key, record);
+            this.store('put', record);
+        }
+        this.schedule(EditQueue.COALESCE_DELAY);
+    }
+
+    static newKey() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        // randomUUID needs a secure context; plain http pages get a random string instead
+        return Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+    }
+
+    static valueOf(operation) {
+        if (operation.op === 'toggle') return Boolean(operation.is_completed);
+        if (operation.op === 'rename') return operation.name;
+        return undefined;
+    }
+
+    remove(key) {
+        if (this.records.delete(key)) this.store('delete', key);
+    }
+
+    pending() {
+        return Array.from(this.records.values()).sort((a, b) => a.seq - b.seq);
+    }
+
+    // Re-applies unsent edits, e.g. after server markup replaced the items they touched
+    replay() {
+        this.pending().forEach(record => this.apply(record.operation));
+    }
+
+    schedule(delay) {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.flush(), delay);
+    }
+
+    flush() {
+        if (this.flushing || this.records.size === 0) return Promise.resolve();
+        clearTimeout(this.timer);
+        this.flushing = true;
+        const batch = this.pending().slice(0, this.batchLimit);
+        // A retry of the same edits keeps its key; any new edit makes it a new request
+        const signature = batch.map(record => `${record.key}@${record.seq}`).join(',');
+        if (signature !== this.batchSignature) {
+            this.batchSignature = signature;
+            this.batchKey = EditQueue.newKey();
+        }
+
+        return fetch(this.endpoint, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': this.batchKey },
+            body: JSON.stringify({ operations: batch.map(record => record.operation) })
+        })
+            .then(response => {
+                // 5xx, 408, 429 and 409 (the first attempt is still running) are worth
+                // retrying; any other client error never will succeed
+                const retry = response.status >= 500 || [408, 409, 429].includes(response.status);
+                if (retry) throw new Error(`HTTP ${response.status}`);
+                if (!response.ok && batch.length > 1) {
+                    // One bad edit fails the whole request: send halves until it goes out on its own
+                    this.batchLimit = Math.ceil(batch.length / 2);
+                    this.flushing = false;
+                    this.schedule(0);
+                    return;
+                }
+                return (response.ok ? response.json().catch(() => ({})) : Promise.resolve({})).then(result => {
+                    if (!response.ok) {
+                        console.warn(`Dropped a queued edit the server rejected (HTTP ${response.status})`, batch[0].operation);
+                    }
+                    // The server applies the rest of a batch around the edits it rejects
+                    (result.rejected || []).forEach(rejection => {
+                        console.warn(`Dropped a queued edit the server rejected: ${rejection.error}`, batch[rejection.index].operation);
+                    });
+                    // Edits made while the request was out replaced their record and stay queued
+                    batch.forEach(record => {
+                        if (this.records.get(record.key) === record) this.remove(record.key);
+                    });
+                    this.batchLimit = EditQueue.MAX_BATCH;
+                    this.retryDelay = EditQueue.MIN_RETRY_DELAY;
+                    this.flushing = false;
+                    if (this.records.size) this.schedule(0);
+                    this.onFlushed(response.ok && !(result.rejected || []).length);
+                });
+            })
+            .catch(() => {
+                this.flushing = false;
+                this.schedule(this.retryDelay);
+                this.retryDelay = Math.min(this.retryDelay * 2, EditQueue.MAX_RETRY_DELAY);
+            });
+    }
+}
+
+EditQueue.DATABASE = 'shopping-list';
+EditQueue.STORE = 'pending-edits';
+// Edits within this many milliseconds of each other go out in one request
+EditQueue.COALESCE_DELAY = 300;
+EditQueue.MIN_RETRY_DELAY = 1000;
+EditQueue.MAX_RETRY_DELAY = 60000;
+EditQueue.MAX_BATCH = 200;
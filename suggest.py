@@ -0,0 +1,156 @@
+import bisect
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+# Distinct names kept per process; the least used are dropped beyond this
+SUGGEST_MAX_NAMES = int(os.environ.get('SUGGEST_MAX_NAMES', 20000))
+# Seconds before the index is reloaded from the database in the background,
+# picking up names added by other workers
+SUGGEST_REFRESH = float(os.environ.get('SUGGEST_REFRESH', 600))
+# Results remembered per short prefix; larger limits are computed afresh
+SHORT_PREFIX_RESULTS = 20
+
+
+class PrefixIndex:
+    """A thread-safe, size-bounded index of names weighted by how often they were used.
+
+    Names live in a sorted array of normalized keys, so a prefix lookup is a
+    bisect plus a scan of the matching range.
+    """
+
+    def __init__(self, max_names=SUGGEST_MAX_NAMES):
+        self.max_names = max_names
+        self._keys = []  # sorted normalized names
+        self._entries = {}  # key -> [name as last written, uses]
+        # Answers for one and two letter prefixes, whose ranges are the widest
+        self._short = {}  # key -> best SHORT_PREFIX_RESULTS names
+        self._version = 0  # bumped by every change, so stale answers are not remembered
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(name.split()).casefold()
+
+    def add(self, name, uses=1):
+        key = self.normalize(name)
+        if not key:
+            return
+        with self._lock:
+            self._short.clear()
+            self._version += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0] = name.strip()
+                entry[1] += uses
+                return
+            self._entries[key] = [name.strip(), uses]
+            bisect.insort(self._keys, key)
+            if len(self._keys) > self.max_names:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least used tenth in one pass rather than one name per insert
+        keep = heapq.nlargest(self.max_names * 9 // 10, self._entries.items(), key=lambda entry: entry[1][1])
+        self.evictions += len(self._entries) - len(keep)
+        self._entries = dict(keep)
+        self._keys = sorted(self._entries)
+
+    def replace(self, counts):
+        """Swaps the contents for (name, uses) pairs, e.g. freshly counted in the database."""
+        entries = {}
+        for name, uses in counts:
+            key = self.normalize(name)
+            if not key:
+                continue
+            entry = entries.setdefault(key, [name.strip(), 0])
+            entry[1] += uses
+        keys = sorted(entries)
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self._short = {}
+            self._version += 1
+            if len(keys) > self.max_names:
+                self._evict()
+
+    def suggest(self, prefix, limit=10):
+        """The most used names starting with prefix, ignoring case and extra spaces."""
+        key = self.normalize(prefix)
+        if not key:
+            return []
+        short = len(key) <= 2 and limit <= SHORT_PREFIX_RESULTS
+        with self._lock:
+            self.lookups += 1
+            if short and key in self._short:
+                return self._short[key][:limit]
+            start = bisect.bisect_left(self._keys, key)
+            end = bisect.bisect_left(self._keys, key + chr(sys.maxunicode), start)
+            matches = [self._entries[k] for k in self._keys[start:end]]
+            version = self._version
+        # Ties keep alphabetical order
+        names = [name for name, uses in heapq.nlargest(SHORT_PREFIX_RESULTS if short else limit, matches, key=itemgetter(1))]
+        if short:
+            with self._lock:
+                if version == self._version:
+                    self._short[key] = names
+        return names[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'names': len(self._keys),
+                'max_names': self.max_names,
+                'lookups': self.lookups,
+                'evictions': self.evictions,
+            }
+
+
+# Item names from every list, including deleted and archived items
+item_names = PrefixIndex()
+
+_loaded_at = None
+_loading_pid = None
+_load_lock = threading.Lock()
+
+
+def _load():
+    global _loaded_at, _loading_pid
+    # Imported here because the models import this module to report new names
+    from models.item import Item
+    started = time.monotonic()
+    try:
+        item_names.replace(Item.name_counts(item_names.max_names))
+    except Exception:
+        logger.exception("Loading item name suggestions failed")
+    finally:
+        with _load_lock:
+            _loaded_at = started
+            _loading_pid = None
+
+
+def refresh_in_background(max_age=SUGGEST_REFRESH):
+    """Reloads item_names on a background thread once it is older than max_age seconds."""
+    global _loading_pid
+    if _loaded_at is not None and time.monotonic() - _loaded_at < max_age:
+        return
+    with _load_lock:
+        # One load per process at a time; a load inherited through fork is not running here
+        if _loading_pid == os.getpid():
+            return
+        _loading_pid = os.getpid()
+    threading.Thread(target=_load, name='suggest-load', daemon=True).start()
+
+
+def suggest_item_names(prefix, limit=10):
+    """Suggestions for an item name being typed. Never waits for the database."""
+    refresh_in_background()
+    return item_names.suggest(prefix, limit)
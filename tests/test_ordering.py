@@ -0,0 +1,83 @@
+"""display_order allocation under concurrent writers.
+
+Runs against SQLite, and against Postgres instead when DATABASE_URL points at
+one. bench/concurrent_inserts.py measures the throughput of the same path.
+"""
+import threading
+
+import pytest
+
+import database
+from db import BACKEND, create_tables, get_db_connection
+from models.category import Category
+from models.item import Item
+from models.shopping_list import ShoppingList
+
+THREADS = 16
+INSERTS = 320
+
+
+@pytest.fixture(params=['writer thread', 'direct'] if BACKEND == 'sqlite' else ['direct'])
+def write_path(request, monkeypatch):
+    # On SQLite, writes go through the writer thread unless SQLITE_WRITE_QUEUE=0
+    if BACKEND == 'sqlite':
+        monkeypatch.setattr(database, 'SQLITE_WRITE_QUEUE', request.param == 'writer thread')
+    return request.param
+
+
+@pytest.fixture
+def shopping_list():
+    create_tables()
+    shopping_list = ShoppingList('ordering test')
+    shopping_list.save()
+    yield shopping_list
+    ShoppingList.delete(shopping_list.id)
+
+
+def run_concurrently(save):
+    """Calls save(n) for n in range(INSERTS), spread over THREADS threads that start together."""
+    start = threading.Barrier(THREADS)
+    errors = []
+
+    def worker(numbers):
+        start.wait()
+        for n in numbers:
+            try:
+                save(n)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(range(index, INSERTS, THREADS),)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def column(sql, params):
+    conn = get_db_connection()
+    values = [row[0] for row in conn.execute(sql, params)]
+    conn.close()
+    return values
+
+
+def test_concurrent_item_saves_get_unique_orders(write_path, shopping_list):
+    category = Category(name='Target', list_id=shopping_list.id)
+    category.save()
+
+    run_concurrently(lambda n: Item(name=f'item {n}', quantity=1, category_id=category.id).save())
+
+    orders = column('SELECT display_order FROM items WHERE category_id = ?', (category.id,))
+    assert len(orders) == INSERTS
+    assert None not in orders
+    assert len(set(orders)) == INSERTS
+
+
+def test_concurrent_category_saves_get_unique_orders(write_path, shopping_list):
+    run_concurrently(lambda n: Category(name=f'category {n}', list_id=shopping_list.id).save())
+
+    orders = column('SELECT display_order FROM categories WHERE list_id = ?', (shopping_list.id,))
+    assert len(orders) == INSERTS
+    assert None not in orders
+    assert len(set(orders)) == INSERTS
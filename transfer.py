@@ -0,0 +1,122 @@
+import codecs
+import csv
+import io
+import itertools
+import json
+import os
+
+from models.item import Item
+
+# Bulk export and import of a list's items as JSON Lines or CSV. Both
+# directions stream: exports are generated batch by batch from a database
+# cursor, and imports are parsed and inserted chunk by chunk, so memory use
+# does not grow with the size of the list.
+
+# Columns of an exported item, also the CSV header
+FIELDS = ['category', 'name', 'quantity', 'notes', 'who_needs_it', 'who_will_buy_it', 'is_completed']
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+# Items inserted per write transaction during an import
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+
+
+class InvalidRow(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+        # Rows committed before the bad one; set by import_list
+        self.imported = 0
+
+
+def guess_format(name, default='ndjson'):
+    """The format for a file name, extension or content type."""
+    return 'csv' if name and 'csv' in name.lower() else default
+
+
+def export_list(list_id, fmt='ndjson', batch_size=EXPORT_BATCH_SIZE):
+    """Yields a list's items serialized as fmt, one chunk of text per database batch."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for batch in Item.export_batches(list_id, batch_size):
+            writer.writerows([*row[:-1], int(bool(row[-1]))] for row in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for batch in Item.export_batches(list_id, batch_size):
+            yield ''.join(
+                json.dumps(dict(zip(FIELDS, [*row[:-1], bool(row[-1])])), ensure_ascii=False) + '\n'
+                for row in batch
+            )
+
+
+def _text(value):
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def _clean(record, line):
+    """Turns one parsed record into the row tuple Item.import_rows expects."""
+    if not isinstance(record, dict):
+        raise InvalidRow(line, "expected an object")
+    name = (_text(record.get('name')) or '').strip()
+    if not name:
+        raise InvalidRow(line, "name is required")
+    try:
+        quantity = int(record.get('quantity') or 1)
+    except (TypeError, ValueError):
+        raise InvalidRow(line, "quantity must be a whole number")
+    return (
+        _text(record.get('category')) or 'Other', name, quantity,
+        _text(record.get('notes')), _text(record.get('who_needs_it')), _text(record.get('who_will_buy_it')),
+        _flag(record.get('is_completed'))
+    )
+
+
+def parse_rows(stream, fmt='ndjson'):
+    """Yields row tuples from a binary stream of UTF-8 JSON Lines or CSV, one line at a time."""
+    text = codecs.getreader('utf-8-sig')(stream)
+    if fmt == 'csv':
+        # Line 1 is the header
+        for line, record in enumerate(csv.DictReader(text), start=2):
+            yield _clean(record, line)
+    else:
+        for line, raw in enumerate(text, start=1):
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError as e:
+                raise InvalidRow(line, f"invalid JSON ({e})")
+            yield _clean(record, line)
+
+
+def import_list(list_id, stream, fmt='ndjson', chunk_size=IMPORT_CHUNK_SIZE):
+    """Appends the items in stream to a list and returns how many were added.
+
+    Each chunk is committed on its own; if a row is invalid, the chunks before
+    it stay imported and InvalidRow.imported says how many items that was.
+    """
+    rows = parse_rows(stream, fmt)
+    imported = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return imported
+            imported += len(Item.import_rows(list_id, chunk))
+    except InvalidRow as e:
+        e.imported = imported
+        raise
@@ -0,0 +1,325 @@
+import os
+
+from cache import LRUCache
+from db import IntegrityError
+from etags import make_etag
+from events import broadcaster
+from idempotency import CONFLICT, KEY_HEADER, MAX_KEY_LENGTH, MISMATCH, REPLAY, REPLAYED_HEADER, SAFE_METHODS, fingerprint, idempotency_store, valid_key
+from ordering import decode_cursor, encode_cursor
+from profiling import InvalidProfileRequest, profiler
+from suggest import item_names, suggest_item_names
+from transfer import FORMATS, InvalidRow, guess_format, import_list
+from models.item import Item
+from models.category import Category
+from models.shopping_list import ShoppingList
+
+# Request handling shared by app.py (Flask) and app_asgi.py (Quart). These
+# functions take values already read from the request and return what either
+# framework accepts from a view: a dict, or a (body, status[, headers]) tuple.
+# The entry points keep only what differs between them: reading the request,
+# which Quart awaits, and running the blocking calls here on a worker thread.
+
+# Rendered index pages keyed by (list id, list revision, collapsed categories).
+# Every write bumps the revision in the database, so stale pages are never
+# served, even across workers.
+page_cache = LRUCache(
+    max_size=int(os.environ.get('PAGE_CACHE_SIZE', 128)),
+    ttl=float(os.environ.get('PAGE_CACHE_TTL', 300))
+)
+# Longer pages (in characters) are streamed afresh every time rather than kept
+PAGE_CACHE_MAX_LENGTH = int(os.environ.get('PAGE_CACHE_MAX_LENGTH', 1024 * 1024))
+
+# Rendered category fragments keyed by (category id, category revision). The
+# revision changes with anything the fragment shows, so a page whose list
+# changed re-renders only the categories that did and reuses the rest.
+fragment_cache = LRUCache(
+    max_size=int(os.environ.get('FRAGMENT_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+)
+
+# The index page shows at most ITEMS_PAGE_SIZE items per category and
+# FIRST_PAINT_ITEMS in all; the rest load as they are scrolled into view, so
+# the first paint costs the same however long the list grows.
+ITEMS_PAGE_SIZE = int(os.environ.get('ITEMS_PAGE_SIZE', 50))
+FIRST_PAINT_ITEMS = int(os.environ.get('FIRST_PAINT_ITEMS', 200))
+ITEMS_MAX_LIMIT = 200
+
+# Largest page of search results a client may ask for
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 100))
+SUGGEST_MAX_LIMIT = 20
+
+
+# --- Reading the request ---
+def get_active_list_id(cookies):
+    return cookies.get('active_list_id', '1') # Default to list 1
+
+def get_collapsed_categories(cookies):
+    # Dot-separated ids of the categories main.js has collapsed
+    value = cookies.get('collapsed_categories', '')
+    return frozenset(int(part) for part in value.split('.') if part.isdigit())
+
+def wants_json(accept_mimetypes):
+    # fetch() callers ask for JSON and patch the page themselves instead of following a redirect
+    return accept_mimetypes.best == 'application/json'
+
+def page_args(args, cursor_size):
+    """The keyset cursor and page size a paginated request asked for; raises ValueError for a malformed cursor."""
+    after = args.get('after')
+    limit = min(max(args.get('limit', ITEMS_PAGE_SIZE, type=int), 1), ITEMS_MAX_LIMIT)
+    return (decode_cursor(after, cursor_size) if after else None), limit
+
+def export_format(args):
+    """The format an export asked for; raises ValueError for an unknown one."""
+    fmt = args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    return fmt
+
+def import_format(args, mimetype):
+    """The format of an uploaded file, from ?format= or its content type; raises ValueError for an unknown one."""
+    fmt = args.get('format') or guess_format(mimetype)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    return fmt
+
+def export_headers(list_id, fmt):
+    return {'Content-Disposition': f'attachment; filename="list-{list_id}.{fmt}"'}
+
+
+# --- Index page ---
+def index_etag(list_id, revision, collapsed):
+    # Collapsed categories are rendered without items, so the page differs per set of them
+    return make_etag('index', '-'.join([str(list_id), *(f'c{category_id}' for category_id in sorted(collapsed))]), revision)
+
+def index_context(snapshot, category_fragments):
+    """The arguments index.html is rendered with."""
+    return dict(
+        category_fragments=category_fragments,
+        # Filled in as the categories are read, before the modals listing them render
+        categories=snapshot.categories,
+        all_lists=snapshot.lists,
+        active_list_id=snapshot.active_list_id,
+        revision=snapshot.revision
+    )
+
+def fragment_key(category):
+    # With the page size fixed, the revision and the cut-off point determine the markup
+    return (category['id'], category['revision'], category.get('next_cursor'), category.get('collapsed', False))
+
+
+class PageRecorder:
+    """Keeps the pieces of an index page as it is streamed, and caches the page once sent unless too long."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.pieces = []
+        self.length = 0
+
+    def add(self, piece):
+        if self.pieces is not None:
+            self.pieces.append(piece)
+            self.length += len(piece)
+            if self.length > PAGE_CACHE_MAX_LENGTH:
+                self.pieces = None
+        return piece
+
+    def finish(self):
+        snapshot = self.snapshot
+        if self.pieces is not None and not snapshot.stale:
+            page_cache.set((snapshot.active_list_id, snapshot.revision, snapshot.collapsed), (snapshot, ''.join(self.pieces)))
+
+
+# --- Idempotency keys ---
+def is_mutating(method, endpoint):
+    # /delete/<id> is a GET link, but it writes all the same
+    return method not in SAFE_METHODS or endpoint == 'delete_item'
+
+def replay_response(stored, response_class):
+    response = response_class(stored.body or b'', stored.status)
+    response.headers.clear()
+    for name, value in stored.headers:
+        response.headers.add(name, value)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def claim_idempotency_key(key, method, full_path, body, response_class):
+    """Claims key for this request.
+
+    Returns (claim, None) if the request should run, after which claim is handed
+    to idempotency_store.finish() or release(); otherwise (None, response) with
+    the response to send instead: the stored one for a retry, or an error.
+    """
+    if not valid_key(key):
+        return None, ({'success': False, 'error': f"{KEY_HEADER} must be 1 to {MAX_KEY_LENGTH} printable characters"}, 400)
+    request_fingerprint = fingerprint(method, full_path, body)
+    outcome, stored = idempotency_store.begin(key, request_fingerprint)
+    if outcome == REPLAY:
+        return None, replay_response(stored, response_class)
+    if outcome == CONFLICT:
+        return None, ({'success': False, 'error': "A request with this Idempotency-Key is still in progress"}, 409, {'Retry-After': '1'})
+    if outcome == MISMATCH:
+        return None, ({'success': False, 'error': "This Idempotency-Key was already used for a different request"}, 422)
+    return (key, request_fingerprint), None
+
+
+# --- Writes ---
+def add_list(list_name):
+    if list_name:
+        new_list = ShoppingList(name=list_name)
+        new_list.save()
+        # Create a default "Other" category for the new list
+        Category(name="Other", list_id=new_list.id).save()
+
+def rename(update, row_id, data):
+    """Applies update(row_id, name) for a {"name": ...} payload."""
+    new_name = data.get('name')
+    if new_name:
+        update(row_id, new_name)
+        return {'success': True}
+    return {'success': False, 'error': "New name is required"}, 400
+
+def reorder_categories(data):
+    if 'category_id' in data:
+        # Preferred form: place one category between its new neighbours
+        Category.move(data['category_id'], data.get('prev_id'), data.get('next_id'))
+    elif data.get('category_ids'):
+        Category.update_order(data['category_ids'])
+    return {'success': True}
+
+def add_item(form, active_list_id):
+    """Saves the item described by the add form and returns it."""
+    category_id = form.get('category_id')
+    if not category_id:
+        # Find the Other category for the active list
+        other = Category.get_by_name(active_list_id, 'Other')
+        category_id = other.id if other else None
+
+    item = Item(
+        name=form.get('name'),
+        quantity=int(form.get('quantity', 1)),
+        notes=form.get('notes'),
+        who_needs_it=form.get('who_needs_it'),
+        who_will_buy_it=form.get('who_will_buy_it'),
+        category_id=category_id
+    )
+    item.save()
+    return item
+
+def update_item(item_id, data):
+    Item.update(
+        item_id, data.get('name'), data.get('quantity'), data.get('notes'),
+        data.get('who_needs_it'), data.get('who_will_buy_it'), data.get('category_id'),
+        data.get('is_completed')
+    )
+    return {'success': True}
+
+def move_item(data):
+    if 'sibling_ids' not in data:
+        # Preferred form: place the item between its new neighbours
+        Item.move(data.get('item_id'), data.get('new_category_id'), data.get('prev_id'), data.get('next_id'))
+    else:
+        Item.update_order_and_category(data.get('item_id'), data.get('new_category_id'), data.get('sibling_ids', []))
+    return {'success': True}
+
+def apply_batch(payload):
+    operations = payload.get('operations', []) if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        return {'success': False, 'error': "Expected a JSON object with an \"operations\" list of objects"}, 400
+    try:
+        changed, rejected = Item.apply_batch(operations)
+    except (KeyError, TypeError, ValueError) as e:
+        return {'success': False, 'error': f"Invalid operation: {e}"}, 400
+    except IntegrityError as e:
+        # A value the schema rejects; sending the batch again would fail the same way
+        return {'success': False, 'error': f"Invalid operation: {e}"}, 400
+    # Rejected operations are left out; the rest are applied all the same
+    return {'success': True, 'applied': len(operations) - len(rejected), 'changed': len(changed), 'rejected': rejected}
+
+def import_items(list_id, stream, fmt):
+    try:
+        imported = import_list(list_id, stream, fmt)
+    except InvalidRow as e:
+        return {'success': False, 'error': str(e), 'imported': e.imported}, 400
+    return {'success': True, 'imported': imported}
+
+
+# --- Reads ---
+def item_json(item):
+    return {
+        'id': item.id, 'name': item.name, 'quantity': item.quantity,
+        'notes': item.notes, 'who_needs_it': item.who_needs_it,
+        'who_will_buy_it': item.who_will_buy_it, 'category_id': item.category_id,
+        'is_completed': item.is_completed
+    }
+
+def list_items(list_id, after, limit):
+    """A page of the list's items, in the order the index page shows them."""
+    rows = Item.get_all_for_list(list_id, after, limit + 1)
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last['category_order'], last['category_id'], last['display_order'], last['id'])
+    return {'items': items, 'next_cursor': next_cursor}
+
+def search(args):
+    query = args.get('q', '').strip()
+    limit = min(max(args.get('limit', 20, type=int), 1), SEARCH_MAX_LIMIT)
+    offset = max(args.get('offset', 0, type=int), 0)
+    # One extra row tells us whether there is a next page
+    results = Item.search(query, args.get('list_id', type=int), limit + 1, offset)
+    return {
+        'query': query,
+        'results': results[:limit],
+        'offset': offset,
+        'next_offset': offset + limit if len(results) > limit else None,
+    }
+
+def suggest(args):
+    prefix = args.get('prefix', '')
+    limit = min(max(args.get('limit', 10, type=int), 1), SUGGEST_MAX_LIMIT)
+    # Answers change slowly, so let the browser reuse them while the user retypes
+    return {'prefix': prefix, 'suggestions': suggest_item_names(prefix, limit)}, 200, {'Cache-Control': 'private, max-age=60'}
+
+
+# --- Diagnostics ---
+def refuse_admin(authorization):
+    """None if an Authorization header carries the PROFILE_TOKEN, otherwise the response refusing it."""
+    # Without a token the admin endpoints don't exist
+    if not profiler.enabled:
+        return {'error': 'Not found'}, 404
+    if not profiler.check_token(authorization):
+        return {'error': 'Unauthorized'}, 401, {'WWW-Authenticate': 'Bearer'}
+    return None
+
+def admin_profile(method, authorization, data):
+    """/admin/profile: GET the status, POST to arm profiling, DELETE to disarm it."""
+    refused = refuse_admin(authorization)
+    if refused is not None:
+        return refused
+    if method == 'POST':
+        # e.g. {"requests": 20, "route": "/update_item_and_order", "mode": "sample", "interval_ms": 2}
+        try:
+            armed = profiler.arm(data.get('requests', 10), data.get('route'), data.get('mode', 'cprofile'), data.get('interval_ms'))
+        except InvalidProfileRequest as e:
+            return {'success': False, 'error': str(e)}, 400
+        return {'success': True, 'profile': armed}
+    if method == 'DELETE':
+        profiler.disarm()
+        return {'success': True}
+    # The status and file list are those of whichever worker answers
+    return profiler.status()
+
+def admin_stats(authorization, **sections):
+    """/admin/stats: this worker's caches, pools and subscribers, plus the app's own sections."""
+    refused = refuse_admin(authorization)
+    if refused is not None:
+        return refused
+    return {
+        'page_cache': page_cache.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'event_subscribers': broadcaster.stats(),
+        'suggest': item_names.stats(),
+        'idempotency': idempotency_store.stats(),
+        **sections,
+    }